@@ -0,0 +1,82 @@
+"""
+Сравнение nearest-выборки ERA5 на тайл:
+RegularGridInterpolator на каждый тайл против индексной арифметики
+(nearest_axis_index + одна fancy-index выборка).
+
+    python benchmarks/bench_regular_resampler.py
+"""
+import sys
+import time
+from pathlib import Path
+
+import mercantile
+import numpy as np
+from scipy.interpolate import RegularGridInterpolator
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from helpers import (TILE_SIZE, is_tile_allowed, nearest_axis_index,  # noqa: E402
+                     tile_lonlat_grid, tile_lonlat_vectors)
+
+
+def rgi_tile(data, lats, lons, z, x, y):
+    if lats[0] > lats[-1]:
+        lats = lats[::-1]
+        data = data[::-1, :]
+
+    interp = RegularGridInterpolator(
+        (lats, lons), data, method="nearest", bounds_error=False, fill_value=np.nan)
+
+    lon_grid, lat_grid = tile_lonlat_grid(z, x, y)
+    pts = np.stack([lat_grid.ravel(), lon_grid.ravel()], axis=-1)
+
+    return interp(pts).reshape(TILE_SIZE, TILE_SIZE)
+
+
+def index_tile(data, lats, lons, z, x, y):
+    tile_lons, tile_lats = tile_lonlat_vectors(z, x, y)
+
+    rows = nearest_axis_index(lats, tile_lats)
+    cols = nearest_axis_index(lons, tile_lons)
+
+    tile = data[np.ix_(np.maximum(rows, 0), np.maximum(cols, 0))]
+    tile[rows < 0, :] = np.nan
+    tile[:, cols < 0] = np.nan
+
+    return tile
+
+
+def main():
+    # Глобальная сетка ERA5 0.25°, широты по убыванию как в файлах CDS
+    lats = np.linspace(90, -90, 721)
+    lons = np.arange(-180, 180, 0.25)
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((lats.size, lons.size)).astype(np.float32)
+
+    tiles = [
+        (t.z, t.x, t.y)
+        for z in range(2, 9)
+        for t in mercantile.tiles(-30, 40, 120, 85, [z])
+        if is_tile_allowed(t.z, t.x, t.y)
+    ][:500]
+
+    start = time.perf_counter()
+    expected = [rgi_tile(data, lats, lons, *t) for t in tiles]
+    rgi_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = [index_tile(data, lats, lons, *t) for t in tiles]
+    index_time = time.perf_counter() - start
+
+    for t, a, b in zip(tiles, expected, actual):
+        if not np.array_equal(a, b, equal_nan=True):
+            raise AssertionError(f"Tile {t} differs")
+
+    print(f"Тайлов: {len(tiles)}, результаты совпадают")
+    print(f"RegularGridInterpolator: {rgi_time * 1000 / len(tiles):.2f} мс/тайл")
+    print(f"Индексная выборка:       {index_time * 1000 / len(tiles):.2f} мс/тайл")
+    print(f"Ускорение: x{rgi_time / index_time:.1f}")
+
+
+if __name__ == "__main__":
+    main()
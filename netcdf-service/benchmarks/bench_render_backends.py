@@ -0,0 +1,104 @@
+"""
+Сравнение бэкендов рендера тайлов: пул потоков (RENDER_BACKEND=thread)
+против пула процессов с полями в разделяемой памяти (RENDER_BACKEND=process).
+
+Рендерится один и тот же набор тайлов синтетического ERA5 файла
+с одинаковой параллельностью запросов, результат - тайлов в секунду.
+
+    python benchmarks/bench_render_backends.py [workers]
+"""
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import mercantile
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+from helpers import is_tile_allowed  # noqa: E402
+from render_pool import SharedArrayStore, make_render_executor  # noqa: E402
+
+
+def make_dataset(path):
+    lats = np.linspace(90, -90, 721)
+    lons = np.arange(-180, 180, 0.25)
+    times = pd.date_range("2024-01-01", periods=2, freq="h")
+    levels = np.array([850.0, 500.0])
+
+    rng = np.random.default_rng(0)
+    shape = (times.size, levels.size, lats.size, lons.size)
+    dims = ("valid_time", "pressure_level", "latitude", "longitude")
+
+    ds = xr.Dataset(
+        {name: (dims, rng.standard_normal(shape).astype(np.float32)) for name in ("z", "u", "v")},
+        coords={"valid_time": times, "pressure_level": levels,
+                "latitude": lats, "longitude": lons},
+    )
+    ds.to_netcdf(path)
+
+
+def run(ds_file, ds, variable, tiles, workers):
+    def render(tile):
+        z, x, y = tile
+        return main.render_tile_block(ds_file, ds, variable, z, [x], [y], 0, 0, -2.0, 2.0)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Прогрев: KD-деревья/индексы и разделяемая память
+        list(executor.map(render, tiles[:workers]))
+
+        start = time.perf_counter()
+        results = list(executor.map(render, tiles))
+        elapsed = time.perf_counter() - start
+
+    return results, len(tiles) / elapsed
+
+
+def main_bench():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+
+    tiles = [
+        (t.z, t.x, t.y)
+        for z in range(3, 8)
+        for t in mercantile.tiles(-30, 40, 120, 85, [z])
+        if is_tile_allowed(t.z, t.x, t.y)
+    ][:400]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "era5_bench.nc")
+        make_dataset(path)
+
+        ds = main.get_cached_dataset(path)
+        ds_file = main.DatasetMatch(path, pd.Timestamp("2024-01-01"), 0.0, 1.0, 0, [850.0, 500.0])
+
+        print(f"Тайлов: {len(tiles)}, параллельных запросов: {workers}")
+
+        for variable in ("z", "u"):
+            main.RENDER_PROCESS_EXECUTOR = None
+            expected, thread_rate = run(ds_file, ds, variable, tiles, workers)
+
+            main.RENDER_PROCESS_EXECUTOR = make_render_executor(workers)
+            main.SHARED_FIELDS = SharedArrayStore(256 * 1024 * 1024)
+            try:
+                actual, process_rate = run(ds_file, ds, variable, tiles, workers)
+            finally:
+                main.RENDER_PROCESS_EXECUTOR.shutdown()
+                main.SHARED_FIELDS.close()
+                main.RENDER_PROCESS_EXECUTOR = None
+
+            if expected != actual:
+                raise AssertionError(f"{variable}: PNG differ between backends")
+
+            print(f"{variable}: thread {thread_rate:.0f} тайлов/с, "
+                  f"process {process_rate:.0f} тайлов/с (x{process_rate / thread_rate:.2f})")
+
+        ds.close()
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,165 @@
+"""
+Поиск ближайшего времени в каталоге на синтетических данных:
+полный проход по dataset_times (как было) против двух индексных
+range-запросов NEAREST_TIME_SQL.
+
+Создаёт и в конце удаляет схему bench_time_lookup в базе DB_URL.
+
+    DB_URL=postgresql://... python benchmarks/bench_time_lookup.py [--rows 1000000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import psycopg
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from main import NEAREST_TIME_SQL  # noqa: E402
+
+SCHEMA = "bench_time_lookup"
+START = datetime(2000, 1, 1)
+
+FULL_SCAN_SQL = """
+    SELECT d.file_path, dt.time_value
+    FROM datasets d
+    JOIN dataset_times dt ON d.id = dt.dataset_id
+    WHERE d.dataset_type=%s
+"""
+
+
+def create_catalog(cur, rows: int, steps_per_file: int):
+    files = rows // steps_per_file
+
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    cur.execute(f"SET search_path TO {SCHEMA}")
+
+    cur.execute("""
+        CREATE TABLE datasets (
+            id BIGSERIAL PRIMARY KEY,
+            file_path TEXT UNIQUE NOT NULL,
+            dataset_type TEXT NOT NULL,
+            dataset_time TIMESTAMP NOT NULL,
+            last_modified DOUBLE PRECISION NOT NULL,
+            pressure_levels JSONB
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE dataset_times (
+            id BIGSERIAL PRIMARY KEY,
+            dataset_id BIGINT REFERENCES datasets(id) ON DELETE CASCADE,
+            dataset_type TEXT,
+            time_value TIMESTAMP NOT NULL,
+            time_index INTEGER NOT NULL
+        )
+    """)
+
+    # Суточные файлы ERA5 с почасовыми шагами
+    cur.execute("""
+        INSERT INTO datasets (file_path, dataset_type, dataset_time, last_modified)
+        SELECT 'era5_' || i || '.nc', 'era5',
+               %s::timestamp + (i * %s) * interval '1 hour', 0
+        FROM generate_series(0, %s - 1) AS i
+    """, (START, steps_per_file, files))
+
+    cur.execute("""
+        INSERT INTO dataset_times (dataset_id, dataset_type, time_value, time_index)
+        SELECT d.id, d.dataset_type, d.dataset_time + s * interval '1 hour', s
+        FROM datasets d, generate_series(0, %s - 1) AS s
+    """, (steps_per_file,))
+
+    cur.execute("""
+        CREATE INDEX idx_dataset_times_type_time
+        ON dataset_times(dataset_type, time_value)
+        INCLUDE (dataset_id, time_index)
+    """)
+    cur.execute("ANALYZE datasets")
+    cur.execute("ANALYZE dataset_times")
+
+    return files * steps_per_file
+
+
+def full_scan(cur, target, tolerance_hours):
+    cur.execute(FULL_SCAN_SQL, ("era5",))
+
+    best, best_diff = None, 1e9
+    for file_path, file_time in cur.fetchall():
+        diff = abs((target - file_time).total_seconds() / 3600)
+        if diff <= tolerance_hours and diff < best_diff:
+            best, best_diff = (file_path, file_time), diff
+
+    return best
+
+
+def indexed(cur, target, tolerance_hours):
+    tolerance = timedelta(hours=tolerance_hours)
+
+    cur.execute(NEAREST_TIME_SQL, {
+        "dataset_type": "era5",
+        "time": target,
+        "time_from": target - tolerance,
+        "time_to": target + tolerance,
+    })
+
+    rows = cur.fetchall()
+    if not rows:
+        return None
+
+    best = min(rows, key=lambda row: abs((target - row[1]).total_seconds()))
+    return best[0], best[1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--full-scan-queries", type=int, default=5)
+    args = parser.parse_args()
+
+    with psycopg.connect(os.environ["DB_URL"], autocommit=True) as conn:
+        with conn.cursor() as cur:
+            try:
+                total = create_catalog(cur, args.rows, steps_per_file=24)
+                hours = total - 1
+
+                random.seed(0)
+                targets = [
+                    START + timedelta(minutes=random.randint(0, hours * 60))
+                    for _ in range(args.queries)
+                ]
+
+                start = time.perf_counter()
+                results = [indexed(cur, t, 1) for t in targets]
+                indexed_time = (time.perf_counter() - start) / len(targets)
+
+                start = time.perf_counter()
+                for t, result in zip(targets[:args.full_scan_queries], results):
+                    expected = full_scan(cur, t, 1)
+                    if expected[1] != result[1]:
+                        raise AssertionError(f"{t}: {expected} != {result}")
+                scan_time = (time.perf_counter() - start) / args.full_scan_queries
+
+                cur.execute("EXPLAIN " + NEAREST_TIME_SQL, {
+                    "dataset_type": "era5",
+                    "time": targets[0],
+                    "time_from": targets[0] - timedelta(hours=1),
+                    "time_to": targets[0] + timedelta(hours=1),
+                })
+                plan = "\n".join(row[0] for row in cur.fetchall())
+
+                print(f"Строк dataset_times: {total}")
+                print(f"Полный проход:       {scan_time * 1000:.1f} мс/запрос")
+                print(f"Индексный поиск:     {indexed_time * 1000:.2f} мс/запрос")
+                print(f"Ускорение: x{scan_time / indexed_time:.0f}")
+                print(plan)
+            finally:
+                cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+
+
+if __name__ == "__main__":
+    main()
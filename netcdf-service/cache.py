@@ -0,0 +1,303 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+import os
+import threading
+import time
+
+
+class SizedLRUCache:
+    """
+    Потокобезопасный LRU-кэш с ограничением по суммарному размеру значений.
+
+    Размер значения считается через sizeof (по умолчанию len, т.е. для bytes).
+    Значения больше бюджета не кэшируются.
+    """
+
+    def __init__(self, max_bytes: int, sizeof: Callable[[Any], int] = len):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+
+        self._items: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self._load_locks: Dict[Hashable, threading.Lock] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = self._items.get(key)
+
+            if value is None:
+                self.misses += 1
+                return None
+
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        size = self.sizeof(value)
+
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+
+            self._items[key] = value
+            self._sizes[key] = size
+            self._size += size
+
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._items))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Значение из кэша, при промахе - loader() с сохранением в кэш.
+        Параллельные промахи по одному ключу вызывают loader один раз.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                value = self._items.get(key)
+
+            if value is None:
+                value = loader()
+                self.put(key, value)
+
+        with self._lock:
+            self._load_locks.pop(key, None)
+
+        return value
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Удаляет все ключи, для которых predicate(key) истинно"""
+        with self._lock:
+            keys = [key for key in self._items if predicate(key)]
+            for key in keys:
+                self._remove(key)
+
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._sizes.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Проверка наличия без учета в статистике и порядке LRU"""
+        with self._lock:
+            return key in self._items
+
+    def _remove(self, key: Hashable):
+        self._items.pop(key)
+        self._size -= self._sizes.pop(key)
+
+
+class FileHandleCache:
+    """
+    LRU-кэш открытых файлов (например, xr.Dataset) с TTL и проверкой mtime.
+
+    - не больше max_size открытых файлов, самый давно использованный закрывается;
+    - файл, к которому не обращались ttl секунд, закрывается;
+    - если mtime файла изменился, файл закрывается и открывается заново.
+
+    Закрытие выполняется через close(handle), после чего вызывается
+    on_close(path) - чтобы сбросить производные кэши по этому файлу.
+    Если файл изменился или инвалидирован явно, дополнительно вызывается
+    on_invalidate(path) - для кэшей, переживающих закрытие файла.
+    """
+
+    def __init__(self, opener: Callable[[str], Any], max_size: int, ttl: float,
+                 close: Callable[[Any], None] = lambda handle: handle.close(),
+                 on_close: Optional[Callable[[str], None]] = None,
+                 on_invalidate: Optional[Callable[[str], None]] = None):
+        self.opener = opener
+        self.max_size = max_size
+        self.ttl = ttl
+        self.close_handle = close
+        self.on_close = on_close
+        self.on_invalidate = on_invalidate
+
+        # path -> (handle, mtime, время последнего обращения)
+        self._items: "OrderedDict[str, Tuple[Any, float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._file_locks: Dict[str, threading.Lock] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, path: str) -> Any:
+        mtime = os.path.getmtime(path)
+
+        handle = self._lookup(path, mtime)
+        if handle is not None:
+            return handle
+
+        # Блокировка только на свой файл: другие файлы открываются параллельно
+        with self._file_lock(path):
+            handle = self._lookup(path, mtime, count=False)
+            if handle is not None:
+                return handle
+
+            handle = self.opener(path)
+
+            with self._lock:
+                self.misses += 1
+                self._items[path] = (handle, mtime, time.monotonic())
+                closed = self._evict()
+
+        self._close_all(closed)
+        return handle
+
+    def invalidate(self, path: str) -> bool:
+        """Закрывает файл, если он открыт"""
+        with self._lock:
+            item = self._items.pop(path, None)
+            if item is not None:
+                self.invalidations += 1
+
+        if item is not None:
+            self._close_all([(path, item[0])])
+
+        if self.on_invalidate is not None:
+            self.on_invalidate(path)
+
+        return item is not None
+
+    def expire(self) -> int:
+        """Закрывает файлы, не использовавшиеся дольше ttl"""
+        with self._lock:
+            closed = self._expired()
+
+        self._close_all(closed)
+        return len(closed)
+
+    def clear(self):
+        with self._lock:
+            closed = [(path, item[0]) for path, item in self._items.items()]
+            self._items.clear()
+
+        self._close_all(closed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._items)
+
+    def _lookup(self, path: str, mtime: float, count: bool = True) -> Optional[Any]:
+        closed = []
+
+        with self._lock:
+            item = self._items.get(path)
+
+            changed = item is not None and item[1] != mtime
+
+            if changed:
+                # Файл перезаписан - старый дескриптор больше не годится
+                self._items.pop(path)
+                self.invalidations += 1
+                closed.append((path, item[0]))
+                item = None
+
+            if item is not None:
+                self._items[path] = (item[0], item[1], time.monotonic())
+                self._items.move_to_end(path)
+                if count:
+                    self.hits += 1
+
+            closed.extend(self._expired())
+
+        self._close_all(closed)
+
+        if changed and self.on_invalidate is not None:
+            self.on_invalidate(path)
+
+        return item[0] if item is not None else None
+
+    def _file_lock(self, path: str) -> threading.Lock:
+        with self._lock:
+            lock = self._file_locks.get(path)
+            if lock is None:
+                lock = self._file_locks[path] = threading.Lock()
+            return lock
+
+    def _expired(self) -> List[Tuple[str, Any]]:
+        deadline = time.monotonic() - self.ttl
+        closed = []
+
+        # Элементы упорядочены по времени обращения: старые - в начале
+        while self._items:
+            path, (handle, _, last_used) = next(iter(self._items.items()))
+            if last_used > deadline:
+                break
+            self._items.pop(path)
+            self.expirations += 1
+            closed.append((path, handle))
+
+        return closed
+
+    def _evict(self) -> List[Tuple[str, Any]]:
+        closed = []
+
+        while len(self._items) > self.max_size:
+            path, (handle, _, _) = self._items.popitem(last=False)
+            self.evictions += 1
+            closed.append((path, handle))
+
+        return closed
+
+    def _close_all(self, closed: List[Tuple[str, Any]]):
+        # Закрытие вне общей блокировки: оно может ждать чтения из файла
+        for path, handle in closed:
+            try:
+                self.close_handle(handle)
+            finally:
+                if self.on_close is not None:
+                    self.on_close(path)
@@ -0,0 +1,87 @@
+"""
+Выгрузка значений переменных вдоль треков ПМЦ в CSV.
+
+Вход - CSV с колонками time, lat, lon (остальные колонки переносятся
+в выход как есть). Точки группируются по шагу времени каталога, как
+в /track, поэтому чтение файлов растет с числом разных шагов, а не точек.
+Каталог должен быть уже проиндексирован сервисом. Срезы читаются мимо
+FIELD_CACHE (каждый шаг нужен один раз), --field-cache включает кэш.
+
+    python extract_track.py tracks.csv values.csv --type era5 \\
+        --variables z,u,v,wind_speed --level 850
+"""
+import argparse
+import asyncio
+import csv
+import time
+
+import numpy as np
+import pandas as pd
+import psycopg_pool
+
+import main
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Значения переменных вдоль треков ПМЦ")
+    parser.add_argument("input", help="CSV с колонками time, lat, lon")
+    parser.add_argument("output", help="куда записать CSV со значениями")
+    parser.add_argument("--type", default="era5", help="тип датасета: era5, carra")
+    parser.add_argument("--variables", default="z,u,v,wind_speed",
+                        help="переменные через запятую")
+    parser.add_argument("--level", type=int, default=850, help="уровень давления, гПа")
+    parser.add_argument("--field-cache", action="store_true",
+                        help="класть прочитанные срезы в FIELD_CACHE")
+    return parser.parse_args()
+
+
+async def extract(args):
+    points = pd.read_csv(args.input)
+    variables = [v.strip() for v in args.variables.split(",") if v.strip()]
+
+    times = main.parse_track_times(points["time"])
+    lats = points["lat"].to_numpy(dtype=np.float64)
+    lons = points["lon"].to_numpy(dtype=np.float64)
+
+    if points.empty:
+        with open(args.output, "w", newline="") as f:
+            csv.writer(f).writerow(list(points.columns) + ["data_time"] + variables)
+        print("Нет точек во входном файле")
+        return
+
+    main.pool = psycopg_pool.AsyncConnectionPool(main.DB_DSN, open=False)
+    await main.pool.open()
+
+    started = time.perf_counter()
+    last_report = started
+
+    try:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(list(points.columns) + ["data_time"] + variables)
+
+            rows = points.itertuples(index=False, name=None)
+
+            async for i, data_time, values in main.extract_track(
+                    args.type, times, lats, lons, variables, args.level,
+                    cached=args.field_cache):
+                writer.writerow(
+                    list(next(rows))
+                    + [data_time.isoformat() if data_time is not None else ""]
+                    + ["" if np.isnan(v) else float(v) for v in values])
+
+                now = time.perf_counter()
+                if now - last_report >= main.INDEX_PROGRESS_SECONDS:
+                    last_report = now
+                    print(f"Точки: {i + 1}/{len(points)}, "
+                          f"{(i + 1) / (now - started):.0f} точек/с")
+    finally:
+        main.RENDER_EXECUTOR.shutdown(wait=True)
+        main.DATASET_CACHE.clear()
+        await main.pool.close()
+
+    print(f"Готово: {len(points)} точек за {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == "__main__":
+    asyncio.run(extract(parse_args()))
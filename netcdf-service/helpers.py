@@ -1,8 +1,20 @@
+import hashlib
+import io
+import os
+from pathlib import Path
+
 import numpy as np
 import mercantile
+from PIL import Image, ImageDraw
 
 TILE_SIZE = 256
 
+# Производные переменные скорости ветра и их компоненты
+WIND_COMPONENTS = {
+    "wind_speed": ("u", "v"),
+    "wind_speed10": ("u10", "v10"),
+}
+
 MIN_LON = -30
 MAX_LON = 200
 
@@ -19,16 +31,349 @@ def is_tile_allowed(z: int, x: int, y: int) -> bool:
     return not (west < MIN_LON or east > MAX_LON)
 
 
-def tile_lonlat_grid(z, x, y):
-    """Create lon/lat grid for each pixel in tile"""
+def tile_lonlat_vectors(z, x, y):
+    """Lon of each pixel column and lat of each pixel row in tile"""
     west, south, east, north = tile_bounds(z, x, y)
 
     lons = np.linspace(west, east, TILE_SIZE)
     lats = np.linspace(north, south, TILE_SIZE)  # flip
 
+    return lons, lats
+
+
+def tile_lonlat_grid(z, x, y):
+    """Create lon/lat grid for each pixel in tile"""
+    lons, lats = tile_lonlat_vectors(z, x, y)
+
     return np.meshgrid(lons, lats)
 
 
+def nearest_axis_index(coord, targets):
+    """
+    Индексы ближайших узлов 1D координаты для точек targets,
+    так же как RegularGridInterpolator(method="nearest"):
+    при равном расстоянии берётся узел с меньшей координатой,
+    точки за пределами сетки получают -1.
+    """
+    n = len(coord)
+    descending = coord[0] > coord[-1]
+    c = coord[::-1] if descending else coord
+
+    i = np.clip(np.searchsorted(c, targets) - 1, 0, n - 2)
+    t = (targets - c[i]) / (c[i + 1] - c[i])
+
+    index = np.where(t <= 0.5, i, i + 1)
+
+    if descending:
+        index = n - 1 - index
+
+    index[(targets < c[0]) | (targets > c[-1])] = -1
+
+    return index
+
+
+def nearest_level_index(levels, level) -> int:
+    """
+    Индекс ближайшего уровня давления через бинарный поиск
+    (при равном расстоянии - первый в исходном порядке, как argmin)
+    """
+    levels = np.asarray(levels, dtype=float)
+    order = np.argsort(levels, kind="stable")
+    sorted_levels = levels[order]
+
+    i = int(np.searchsorted(sorted_levels, level))
+    candidates = [order[k] for k in (i - 1, i) if 0 <= k < len(levels)]
+
+    return int(min(candidates, key=lambda k: (abs(levels[k] - level), k)))
+
+
+def regular_tile_index(lats, lons, z, x, y) -> np.ndarray:
+    """
+    Индексы ближайших строк и столбцов регулярной сетки (ERA5)
+    для строк и столбцов тайла: массив (2, 256), -1 - вне сетки
+    """
+    tile_lons, tile_lats = tile_lonlat_vectors(z, x, y)
+
+    return np.stack((
+        nearest_axis_index(lats, tile_lats),
+        nearest_axis_index(lons, tile_lons),
+    )).astype(np.int32)
+
+
+def remap_tile_index(tree, z, x, y, max_dist) -> np.ndarray:
+    """
+    Плоские индексы ближайших узлов криволинейной сетки (CARRA)
+    для каждого пикселя тайла по KD-дереву узлов.
+    -1 означает, что ближайший узел дальше max_dist (нет данных).
+    """
+    lon_grid, lat_grid = tile_lonlat_grid(z, x, y)
+
+    query = np.column_stack((lat_grid.ravel(), lon_grid.ravel()))
+
+    # Узлы дальше max_dist не ищем: для них dist=inf
+    dist, idx = tree.query(query, distance_upper_bound=max_dist)
+
+    index = idx.astype(np.int32).reshape(TILE_SIZE, TILE_SIZE)
+    index[~np.isfinite(dist.reshape(TILE_SIZE, TILE_SIZE))] = -1
+
+    return index
+
+
+def _remap_index_path(index_dir, signature, z, x, y) -> Path:
+    return Path(index_dir) / signature / f"{z}_{x}_{y}.npy"
+
+
+def read_remap_index(index_dir, signature, z, x, y):
+    """Индекс тайла с диска (memory-mapped) или None"""
+    if not index_dir:
+        return None
+
+    path = _remap_index_path(index_dir, signature, z, x, y)
+    if not path.exists():
+        return None
+
+    return np.load(path, mmap_mode="r")
+
+
+def write_remap_index(index_dir, signature, z, x, y, index):
+    if not index_dir:
+        return
+
+    path = _remap_index_path(index_dir, signature, z, x, y)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, index)
+    os.replace(tmp_path, path)
+
+
+def gather_regular(data, rows, cols) -> np.ndarray:
+    """Выборка из 2D поля по индексам строк/столбцов, -1 - NaN"""
+    valid_rows = rows >= 0
+    valid_cols = cols >= 0
+
+    tile = data[np.ix_(np.maximum(rows, 0), np.maximum(cols, 0))]
+
+    if not (valid_rows.all() and valid_cols.all()):
+        tile = tile.astype(np.result_type(tile.dtype, np.float32))
+        tile[~valid_rows, :] = np.nan
+        tile[:, ~valid_cols] = np.nan
+
+    return tile
+
+
+def gather_remap(data, index) -> np.ndarray:
+    """Выборка из 2D поля по плоским индексам узлов, -1 - NaN"""
+    valid = index >= 0
+
+    tile = np.full(index.shape, np.nan,
+                   dtype=np.result_type(data.dtype, np.float32))
+    tile[valid] = data.ravel()[index[valid]]
+
+    return tile
+
+
+def block_average(data) -> np.ndarray:
+    """
+    Уменьшение 1D/2D массива в 2 раза по каждой оси средним по блокам 2(x2).
+    Неполные блоки на краях усредняются по имеющимся узлам, NaN пропускаются.
+    """
+    data = np.asarray(data, dtype=np.float32 if data.dtype.kind != "f" else data.dtype)
+
+    pad = [(0, n % 2) for n in data.shape]
+    if any(p for _, p in pad):
+        data = np.pad(data, pad, constant_values=np.nan)
+
+    shape = []
+    for n in data.shape:
+        shape += [n // 2, 2]
+
+    blocks = data.reshape(shape)
+    axes = tuple(range(1, blocks.ndim, 2))
+
+    valid = np.isfinite(blocks)
+    count = valid.sum(axis=axes)
+    total = np.where(valid, blocks, 0).sum(axis=axes)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (total / count).astype(data.dtype)
+
+
+def grid_resolution(lats, lons):
+    """
+    Шаг сетки в градусах (dlat, dlon).
+    Для криволинейной сетки (2D координаты) - расстояние между соседними
+    узлами в градусах широты, dlon=None: его размер зависит от широты.
+    """
+    if lats.ndim == 1:
+        return (float(np.median(np.abs(np.diff(lats)))),
+                float(np.median(np.abs(np.diff(lons)))))
+
+    coslat = np.cos(np.deg2rad(lats))
+    steps = []
+
+    for axis in (0, 1):
+        dlat = np.diff(lats, axis=axis)
+        dlon = (np.diff(lons, axis=axis) + 180) % 360 - 180
+        scale = coslat[1:, :] if axis == 0 else coslat[:, 1:]
+        steps.append(np.median(np.hypot(dlat, dlon * scale)))
+
+    return float(max(steps)), None
+
+
+def overview_level(z, y, resolution, max_level) -> int:
+    """
+    Самый грубый уровень пирамиды (шаг сетки x 2^level), при котором
+    на каждый пиксель тайла строки y по-прежнему приходится хотя бы
+    один узел сетки по каждой оси. Уровень зависит только от тайла,
+    поэтому тайл одинаков при рендере отдельно и в составе блока
+    """
+    if max_level <= 0:
+        return 0
+
+    west, south, east, north = tile_bounds(z, 0, y)
+
+    pixel_lat = (north - south) / TILE_SIZE
+    pixel_lon = (east - west) / TILE_SIZE
+
+    dlat, dlon = resolution
+    if dlon is None:
+        # Шаг по долготе растет к полюсу: берется ближний к полюсу край тайла
+        edge = max(abs(north), abs(south))
+        dlon = dlat / max(np.cos(np.deg2rad(edge)), 1e-6)
+
+    cells = min(pixel_lat / dlat, pixel_lon / dlon)
+    if cells < 2:
+        return 0
+
+    return min(int(np.log2(cells)), max_level)
+
+
+def decode_field(ds, variable: str, time_index: int = 0, level_index: int = 0) -> np.ndarray:
+    """Читает и декодирует 2D срез переменной как float32 (только для чтения)"""
+    var = ds[variable]
+
+    indexers = {}
+    if 'valid_time' in var.dims:
+        indexers['valid_time'] = time_index
+    if 'pressure_level' in var.dims:
+        indexers['pressure_level'] = level_index
+
+    data = var.isel(**indexers).values
+
+    if data.ndim != 2:
+        data = data.reshape(-1, data.shape[-2], data.shape[-1])[0]
+
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    data.flags.writeable = False
+
+    return data
+
+
+def field_percentiles(data: np.ndarray):
+    if not np.isfinite(data).any():
+        return 0.0, 0.0
+
+    vmin, vmax = np.nanpercentile(data, [2, 98])
+
+    return float(vmin), float(vmax)
+
+
+def grid_signature(lats, lons) -> str:
+    """Короткий хэш сетки: одинаковые сетки разных файлов дают одну подпись"""
+    h = hashlib.sha1()
+
+    for arr in (lats, lons):
+        arr = np.ascontiguousarray(arr, dtype=np.float64)
+        h.update(str(arr.shape).encode())
+        h.update(arr.tobytes())
+
+    return h.hexdigest()[:16]
+
+
+# ----- Sequential (для обычных значений от мин к макс) -----
+PANOPLY_PALETTES = {
+    # ДЛЯ ГЕОПОТЕНЦИАЛА/ТЕМПЕРАТУРЫ МОРЯ - идеально для 850 гПа
+    "NEO_modis_sst_45": ['#053061', '#2166ac', '#4393c3', '#92c5de', '#f7f7f7',
+                         '#fddbc7', '#f4a582', '#d6604d', '#b2182b', '#67001f'],
+
+    # Классическая Panoply для температуры воздуха
+    "GIST_heat": [
+        '#000000',  # чёрный
+        '#8b0000',  # тёмно-красный
+        '#ff0000',  # красный
+        '#ff4500',  # оранжево-красный
+        '#ff8c00',  # оранжевый
+        '#ffd700',  # золотой
+        '#ffff00',  # жёлтый
+        '#ffffe0',  # светло-жёлтый
+        '#ffffff'   # белый
+    ],
+
+    # Для осадков/облачности
+    "NEO_trmm_rainfall": [
+        '#ffffff',  # белый
+        '#deebf7',
+        '#c6dbef',
+        '#9ecae1',
+        '#6baed6',
+        '#4292c6',
+        '#2171b5',
+        '#08519c',
+        '#08306b'   # тёмно-синий
+    ],
+
+    # Для аномалий (дивергентная)
+    "NCDC_temp_anom": [
+        '#053061',  # тёмно-синий
+        '#2166ac',
+        '#4393c3',
+        '#92c5de',
+        '#d1e5f0',
+        '#f7f7f7',  # белый
+        '#fddbc7',
+        '#f4a582',
+        '#d6604d',
+        '#b2182b',
+        '#67001f'   # тёмно-красный
+    ],
+
+    # Для ветра
+    "NEO_wind_spd_anom": [
+        '#4d004b',  # тёмно-фиолетовый
+        '#810f7c',
+        '#88419d',
+        '#8c6bb1',
+        '#8c96c6',
+        '#9ebcda',
+        '#bfd3e6',
+        '#e0ecf4',
+        '#f7f7f7',  # белый
+        '#fee8c8',
+        '#fdbb84',
+        '#fc8d59',
+        '#e34a33',
+        '#b30000',  # красный
+        '#7f0000'   # тёмно-красный
+    ],
+
+    # Топографическая (суша/океан)
+    "GIST_earth": [
+        '#0080ff',  # глубокий океан
+        '#33a1ff',  # мелководье
+        '#87cefa',  # прибрежные воды
+        '#90ee90',  # низменность
+        '#32cd32',  # леса
+        '#228b22',  # возвышенность
+        '#8b5a2b',  # предгорья
+        '#a0522d',  # горы
+        '#d2b48c',  # высокогорья
+        '#ffffff'   # снег/лёд
+    ]
+}
+
+
 def get_panoply_colormap(name="NEO_modis_sst_45"):
     """
     Возвращает цветовую схему Panoply по имени.
@@ -36,89 +381,229 @@ def get_panoply_colormap(name="NEO_modis_sst_45"):
     """
     import matplotlib.colors as mcolors
 
-    # ----- Sequential (для обычных значений от мин к макс) -----
-    palettes = {
-        # ДЛЯ ГЕОПОТЕНЦИАЛА/ТЕМПЕРАТУРЫ МОРЯ - идеально для 850 гПа
-        "NEO_modis_sst_45": ['#053061', '#2166ac', '#4393c3', '#92c5de', '#f7f7f7',
-                             '#fddbc7', '#f4a582', '#d6604d', '#b2182b', '#67001f'],
-
-        # Классическая Panoply для температуры воздуха
-        "GIST_heat": [
-            '#000000',  # чёрный
-            '#8b0000',  # тёмно-красный
-            '#ff0000',  # красный
-            '#ff4500',  # оранжево-красный
-            '#ff8c00',  # оранжевый
-            '#ffd700',  # золотой
-            '#ffff00',  # жёлтый
-            '#ffffe0',  # светло-жёлтый
-            '#ffffff'   # белый
-        ],
-
-        # Для осадков/облачности
-        "NEO_trmm_rainfall": [
-            '#ffffff',  # белый
-            '#deebf7',
-            '#c6dbef',
-            '#9ecae1',
-            '#6baed6',
-            '#4292c6',
-            '#2171b5',
-            '#08519c',
-            '#08306b'   # тёмно-синий
-        ],
-
-        # Для аномалий (дивергентная)
-        "NCDC_temp_anom": [
-            '#053061',  # тёмно-синий
-            '#2166ac',
-            '#4393c3',
-            '#92c5de',
-            '#d1e5f0',
-            '#f7f7f7',  # белый
-            '#fddbc7',
-            '#f4a582',
-            '#d6604d',
-            '#b2182b',
-            '#67001f'   # тёмно-красный
-        ],
-
-        # Для ветра
-        "NEO_wind_spd_anom": [
-            '#4d004b',  # тёмно-фиолетовый
-            '#810f7c',
-            '#88419d',
-            '#8c6bb1',
-            '#8c96c6',
-            '#9ebcda',
-            '#bfd3e6',
-            '#e0ecf4',
-            '#f7f7f7',  # белый
-            '#fee8c8',
-            '#fdbb84',
-            '#fc8d59',
-            '#e34a33',
-            '#b30000',  # красный
-            '#7f0000'   # тёмно-красный
-        ],
-
-        # Топографическая (суша/океан)
-        "GIST_earth": [
-            '#0080ff',  # глубокий океан
-            '#33a1ff',  # мелководье
-            '#87cefa',  # прибрежные воды
-            '#90ee90',  # низменность
-            '#32cd32',  # леса
-            '#228b22',  # возвышенность
-            '#8b5a2b',  # предгорья
-            '#a0522d',  # горы
-            '#d2b48c',  # высокогорья
-            '#ffffff'   # снег/лёд
-        ]
-    }
-
     # По умолчанию - SST палитра (синий-белый)
-    colors = palettes.get(name, palettes["NEO_modis_sst_45"])
+    colors = PANOPLY_PALETTES.get(name, PANOPLY_PALETTES["NEO_modis_sst_45"])
 
     # Создаём дискретную цветовую карту с чёткими границами
     return mcolors.ListedColormap(colors, name=name)
+
+
+def build_palette_lut(name="NEO_modis_sst_45") -> np.ndarray:
+    """
+    uint8 RGBA таблица цветов палитры (n + 1, 4).
+    Последняя строка - прозрачный цвет для пикселей без данных.
+    """
+    import matplotlib.colors as mcolors
+
+    colors = get_panoply_colormap(name).colors
+    rgba = (mcolors.to_rgba_array(colors) * 255).astype(np.uint8)
+
+    return np.vstack([rgba, np.zeros((1, 4), dtype=np.uint8)])
+
+
+# Таблицы цветов строятся один раз при импорте
+PALETTE_LUTS = {name: build_palette_lut(name) for name in PANOPLY_PALETTES}
+
+
+def get_palette_lut(name="NEO_modis_sst_45") -> np.ndarray:
+    return PALETTE_LUTS.get(name, PALETTE_LUTS["NEO_modis_sst_45"])
+
+
+def colorize_indices(data, vmin, vmax, n_levels) -> np.ndarray:
+    """
+    Индексы цветов палитры (uint8) для каждого пикселя.
+    Пиксели без данных (NaN) получают индекс n_levels.
+    """
+    mask = np.isnan(data)
+
+    norm = (data - vmin) / (vmax - vmin)
+    norm = np.clip(norm, 0, 0.999)
+    norm[mask] = 0
+
+    indices = np.floor(norm * n_levels).astype(np.uint8)
+    indices = np.clip(indices, 0, n_levels - 1)
+    indices[mask] = n_levels
+
+    return indices
+
+
+def indices_to_image(indices, lut, palette_mode=False) -> Image.Image:
+    """
+    RGBA изображение из индексов цветов через take по таблице lut,
+    либо 8-битное палитровое ("P") с прозрачным последним цветом
+    """
+    if palette_mode:
+        img = Image.fromarray(indices, "P")
+        img.putpalette(lut[:, :3].ravel().tolist())
+        img.info["transparency"] = len(lut) - 1
+        return img
+
+    return Image.fromarray(lut.take(indices, axis=0), "RGBA")
+
+
+def draw_arrow_polygon(draw, x, y, u, v, length, width, head_len, head_width, color):
+    angle = np.arctan2(-v, u)
+
+    cos_a = np.cos(angle)
+    sin_a = np.sin(angle)
+
+    x_end = x + cos_a * length
+    y_end = y + sin_a * length
+
+    x_body = x + cos_a * (length - head_len)
+    y_body = y + sin_a * (length - head_len)
+
+    px = -sin_a
+    py = cos_a
+
+    p1 = (x + px * width/2, y + py * width/2)
+    p2 = (x - px * width/2, y - py * width/2)
+    p3 = (x_body - px * width/2, y_body - py * width/2)
+    p4 = (x_body + px * width/2, y_body + py * width/2)
+
+    tip = (x_end, y_end)
+    left = (x_body + px * head_width/2, y_body + py * head_width/2)
+    right = (x_body - px * head_width/2, y_body - py * head_width/2)
+
+    polygon = [p1, p2, p3, right, tip, left, p4]
+
+    draw.polygon(polygon, fill=color)
+
+
+# Стрелки ветра ставятся в центры ячеек решетки ARROWS_PER_TILE x ARROWS_PER_TILE.
+# Решетка одинакова во всех тайлах (256 делится на ячейки ~23 px без остатка),
+# то есть привязана к глобальным пикселям и не рвется на стыках тайлов.
+# Стрелка центрирована в ячейке и не выходит за край тайла.
+ARROWS_PER_TILE = 11
+ARROW_ANGLE_BINS = 72
+ARROW_LENGTH = 10.0
+ARROW_WIDTH = 1.5
+ARROW_HEAD_LEN = 6.0
+ARROW_HEAD_WIDTH = 6.0
+ARROW_MIN_SPEED = 0.1
+ARROW_SPRITE_SIZE = 15
+ARROW_SUPERSAMPLE = 4
+
+
+def build_arrow_sprites() -> np.ndarray:
+    """
+    Маски покрытия (float32, 0..1) стрелки, повернутой на угол каждого
+    из ARROW_ANGLE_BINS секторов. Стрелка рисуется с суперсэмплингом
+    и усредняется, центр стрелки - центральный пиксель спрайта.
+    """
+    ss = ARROW_SUPERSAMPLE
+    size = ARROW_SPRITE_SIZE * ss
+    center = size / 2
+
+    sprites = np.empty((ARROW_ANGLE_BINS, ARROW_SPRITE_SIZE, ARROW_SPRITE_SIZE), np.float32)
+
+    for b in range(ARROW_ANGLE_BINS):
+        theta = 2 * np.pi * b / ARROW_ANGLE_BINS
+        u, v = np.cos(theta), np.sin(theta)
+
+        img = Image.new("L", (size, size), 0)
+        draw_arrow_polygon(
+            ImageDraw.Draw(img),
+            center - u * ARROW_LENGTH * ss / 2, center + v * ARROW_LENGTH * ss / 2,
+            u, v,
+            length=ARROW_LENGTH * ss,
+            width=ARROW_WIDTH * ss,
+            head_len=ARROW_HEAD_LEN * ss,
+            head_width=ARROW_HEAD_WIDTH * ss,
+            color=255
+        )
+
+        small = img.resize((ARROW_SPRITE_SIZE, ARROW_SPRITE_SIZE), Image.BOX)
+        sprites[b] = np.asarray(small, dtype=np.float32) / 255
+
+    return sprites
+
+
+ARROW_SPRITES = build_arrow_sprites()
+
+
+def wind_arrow_alpha(u, v) -> np.ndarray:
+    """
+    Покрытие стрелками (float32, 0..1) блока целых тайлов: u/v берутся
+    в узлах решетки, спрайты по сектору направления накладываются
+    одной операцией np.maximum.at
+    """
+    h, w = u.shape
+
+    cell = TILE_SIZE / ARROWS_PER_TILE
+    offsets = ((np.arange(ARROWS_PER_TILE) + 0.5) * cell).astype(np.intp)
+    rows = (np.arange(0, h, TILE_SIZE)[:, None] + offsets).ravel()
+    cols = (np.arange(0, w, TILE_SIZE)[:, None] + offsets).ravel()
+
+    uu = u[np.ix_(rows, cols)]
+    vv = v[np.ix_(rows, cols)]
+
+    # NaN дает False
+    r, c = np.nonzero(np.hypot(uu, vv) >= ARROW_MIN_SPEED)
+
+    angle = np.arctan2(vv[r, c], uu[r, c])
+    bins = np.rint(angle / (2 * np.pi) * ARROW_ANGLE_BINS).astype(np.intp) % ARROW_ANGLE_BINS
+
+    d = np.arange(ARROW_SPRITE_SIZE) - ARROW_SPRITE_SIZE // 2
+
+    alpha = np.zeros((h, w), np.float32)
+    np.maximum.at(
+        alpha,
+        (rows[r][:, None, None] + d[None, :, None], cols[c][:, None, None] + d[None, None, :]),
+        ARROW_SPRITES[bins])
+
+    return alpha
+
+
+def composite_arrows(rgba, alpha) -> np.ndarray:
+    """Черные стрелки поверх RGBA изображения (оператор over)"""
+    mask = alpha > 0
+    a = alpha[mask][:, None]
+
+    pixels = rgba[mask].astype(np.float32)
+    pixels[:, :3] *= 1 - a
+    pixels[:, 3:] += (255 - pixels[:, 3:]) * a
+
+    out = rgba.copy()
+    out[mask] = np.rint(pixels).astype(np.uint8)
+
+    return out
+
+
+def encode_block_tiles(block, xs, ys, vmin, vmax, u_data=None, v_data=None,
+                       palette="NEO_modis_sst_45", palette_mode=False):
+    """
+    Раскраска блока тайлов xs x ys за один проход и нарезка на PNG.
+    Если переданы u_data/v_data, на тайлы наносятся стрелки ветра.
+    """
+    # защита от деления на 0
+    if vmax <= vmin:
+        vmax = vmin + 1e-6
+
+    lut = get_palette_lut(palette)
+    indices = colorize_indices(block, vmin, vmax, len(lut) - 1)
+
+    draw_arrows = u_data is not None and v_data is not None
+
+    if draw_arrows:
+        rgba = composite_arrows(lut.take(indices, axis=0), wind_arrow_alpha(u_data, v_data))
+
+    tiles = {}
+
+    for j, ty in enumerate(ys):
+        for i, tx in enumerate(xs):
+            window = (slice(j * TILE_SIZE, (j + 1) * TILE_SIZE),
+                      slice(i * TILE_SIZE, (i + 1) * TILE_SIZE))
+
+            # Стрелки ветра сглаживаются, поэтому такие тайлы всегда RGBA
+            if draw_arrows:
+                img = Image.fromarray(np.ascontiguousarray(rgba[window]), "RGBA")
+            else:
+                img = indices_to_image(
+                    np.ascontiguousarray(indices[window]), lut, palette_mode=palette_mode)
+
+            buf = io.BytesIO()
+            img.save(buf, format="PNG")
+            tiles[(tx, ty)] = buf.getvalue()
+
+    return tiles
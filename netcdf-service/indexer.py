@@ -0,0 +1,180 @@
+"""
+Разбор NetCDF файлов для каталога: тип, времена, уровни давления
+и пределы палитры по каждому срезу.
+
+Функции выполняются в пуле процессов при индексации, поэтому модуль
+не импортирует main. Ошибки не логируются здесь, а возвращаются
+в IndexedFile.errors - логгер с обработчиком OpenSearch есть только
+в основном процессе.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+import multiprocessing
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from helpers import WIND_COMPONENTS, decode_field, field_percentiles
+from zarr_store import ingest_zarr
+
+
+class IndexedFile(NamedTuple):
+    file_path: str
+    file_size: int
+    last_modified: float
+    dataset_type: Optional[str]
+    dataset_time: Optional[pd.Timestamp]
+    variables: List[str]
+    times: List[pd.Timestamp]
+    pressure_levels: List[float]
+    stats: List[Tuple[str, int, int, Optional[float], float, float]]
+    zarr_path: Optional[str]
+    errors: List[str]
+
+
+def make_index_executor(max_workers: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def extract_dataset_info(
+    file_path: str
+) -> Tuple[str, pd.Timestamp, List[str], List[pd.Timestamp], List[float]]:
+    """Извлекает информацию о датасете из NetCDF файла"""
+
+    with xr.open_dataset(file_path, engine="netcdf4", decode_times=False) as ds:
+        file_name = Path(file_path).name.lower()
+
+        if 'era5' in file_name:
+            dataset_type = 'era5'
+        elif 'carra' in file_name:
+            dataset_type = 'carra'
+        else:
+            dataset_type = 'unknown'
+
+        # --- Декодируем CF-время один раз ---
+        ds_decoded = xr.decode_cf(ds, decode_times=True)
+
+        time_values: List[pd.Timestamp] = []
+
+        # --- Универсальная обработка time / valid_time ---
+        if 'time' in ds_decoded.coords:
+            time_values = pd.to_datetime(ds_decoded.time.values).to_list()
+
+        elif 'valid_time' in ds_decoded.coords:
+            time_values = pd.to_datetime(
+                ds_decoded.valid_time.values
+            ).to_list()
+
+        # --- fallback: дата из имени файла ---
+        if not time_values:
+            match = re.search(
+                r'(\d{4})[_-]?(\d{2})[_-]?(\d{2})', file_name)
+            if match:
+                y, m, d = match.groups()
+                time_values = [pd.Timestamp(f"{y}-{m}-{d}")]
+
+        # --- fallback: mtime ---
+        if not time_values:
+            stat = os.stat(file_path)
+            time_values = [pd.Timestamp.fromtimestamp(stat.st_mtime)]
+            print(f"⚠ Используется mtime для {Path(file_path).name}")
+
+        dataset_time = time_values[0]  # репрезентативное
+
+        variables = list(ds.data_vars.keys())
+
+        pressure_levels: List[float] = []
+        if 'pressure_level' in ds.coords:
+            pressure_levels = ds.pressure_level.values.astype(
+                float).tolist()
+
+        return dataset_type, dataset_time, variables, time_values, pressure_levels
+
+
+def read_stats_field(ds: xr.Dataset, name: str, time_index: int, level_index: int):
+    if name in WIND_COMPONENTS:
+        u_name, v_name = WIND_COMPONENTS[name]
+        u = decode_field(ds, u_name, time_index, level_index)
+        v = decode_field(ds, v_name, time_index, level_index)
+        return np.sqrt(u**2 + v**2)
+
+    return decode_field(ds, name, time_index, level_index)
+
+
+def compute_dataset_stats(
+    file_path: str
+) -> List[Tuple[str, int, int, Optional[float], float, float]]:
+    """
+    Пределы палитры (2/98 перцентили) для каждой переменной,
+    шага времени и уровня давления, включая производную скорость ветра
+    """
+
+    rows = []
+
+    with xr.open_dataset(file_path, engine="netcdf4") as ds:
+        names = [
+            name for name, var in ds.data_vars.items()
+            if 'latitude' in var.coords and 'longitude' in var.coords
+        ]
+        names += [
+            name for name, (u_name, v_name) in WIND_COMPONENTS.items()
+            if u_name in ds and v_name in ds
+        ]
+
+        for name in names:
+            ref = ds[WIND_COMPONENTS[name][0]
+                     ] if name in WIND_COMPONENTS else ds[name]
+
+            n_times = ref.sizes.get('valid_time', 1)
+
+            if 'pressure_level' in ref.dims:
+                levels = ref.pressure_level.values.astype(float).tolist()
+            else:
+                levels = [None]
+
+            for time_index in range(n_times):
+                for level_index, level in enumerate(levels):
+                    vmin, vmax = field_percentiles(
+                        read_stats_field(ds, name, time_index, level_index))
+                    rows.append(
+                        (name, time_index, level_index, level, vmin, vmax))
+
+    return rows
+
+
+def index_file(file_path: str, zarr_dir: str = "", zarr_chunk_size: int = 256) -> IndexedFile:
+    """
+    Все, что нужно каталогу по одному файлу: метаданные, пределы палитры
+    и, если задан zarr_dir, перекладка в Zarr
+    """
+    stat = os.stat(file_path)
+    errors = []
+
+    try:
+        dataset_type, dataset_time, variables, times, levels = extract_dataset_info(
+            file_path)
+    except Exception as e:
+        errors.append(f"Error in reading file {file_path}: {e}")
+        return IndexedFile(file_path, stat.st_size, stat.st_mtime,
+                           None, None, [], [], [], [], None, errors)
+
+    try:
+        stats = compute_dataset_stats(file_path)
+    except Exception as e:
+        errors.append(f"Error in computing stats for {file_path}: {e}")
+        stats = []
+
+    zarr_path = None
+    if zarr_dir:
+        try:
+            zarr_path = ingest_zarr(file_path, zarr_dir, zarr_chunk_size)
+        except Exception as e:
+            errors.append(f"Error in Zarr ingest for {file_path}: {e}")
+
+    return IndexedFile(file_path, stat.st_size, stat.st_mtime, dataset_type, dataset_time,
+                       variables, times, levels, stats, zarr_path, errors)
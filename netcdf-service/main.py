@@ -1,6 +1,11 @@
-from helpers import tile_lonlat_grid, TILE_SIZE, get_panoply_colormap, is_tile_allowed
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import Response
+from helpers import (TILE_SIZE, get_panoply_colormap, is_tile_allowed, nearest_level_index,
+                     nearest_axis_index,
+                     grid_signature, regular_tile_index, remap_tile_index,
+                     read_remap_index, write_remap_index, encode_block_tiles,
+                     gather_regular, gather_remap, block_average, grid_resolution,
+                     overview_level, WIND_COMPONENTS, decode_field, field_percentiles)
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.concurrency import run_in_threadpool
 import xarray as xr
@@ -8,9 +13,12 @@ import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 import matplotlib.colors as mcolors
 import io
-from typing import Dict, Optional, Tuple, List
+from typing import Dict, Optional, Tuple, List, NamedTuple
 import threading
 import sqlite3
+import hashlib
+import struct
+import tempfile
 from pathlib import Path
 import matplotlib.cm as cm
 from scipy.interpolate import RegularGridInterpolator
@@ -22,20 +30,31 @@ import os
 import psycopg
 import json
 from contextlib import asynccontextmanager
+from collections import OrderedDict
+import contextlib
 from environs import Env
+from pydantic import BaseModel
 from opensearch_logger import OpenSearchHandler
+from cache import FileHandleCache, SizedLRUCache
+from render_pool import RenderTask, SharedArrayStore, make_render_executor, render_block
+from zarr_store import ZARR_SUFFIX, ingest_zarr, open_zarr_dataset, remove_zarr_store
+from indexer import IndexedFile, compute_dataset_stats, index_file, make_index_executor
+from tile_store import TileStore
+from subset_export import (ArrowStreamWriter, NetCDFSubsetWriter, csv_chunk, csv_header,
+                           subset_columns)
 import os
 import psycopg_pool
+import anyio
 import asyncio
+import functools
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 
 FONT_PATH = Path(__file__).parent / "assets/fonts/Inter.ttf"
 
 pool = None
 
-nc_lock = asyncio.Lock()
-
 
 def get_font(size=24):
     try:
@@ -46,14 +65,41 @@ def get_font(size=24):
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global pool
+    global pool, RENDER_PROCESS_EXECUTOR, SHARED_FIELDS
 
     pool = psycopg_pool.AsyncConnectionPool(DB_DSN)
 
+    if RENDER_BACKEND == "process":
+        RENDER_PROCESS_EXECUTOR = make_render_executor(RENDER_PROCESSES)
+        SHARED_FIELDS = SharedArrayStore(SHARED_FIELDS_BYTES)
+
     await startup_event()
 
+    tasks = [asyncio.create_task(expire_datasets())]
+    if DATA_WATCH:
+        tasks.append(asyncio.create_task(watch_data_dir()))
+
     yield
 
+    for task in tasks:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    RENDER_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+
+    if RENDER_PROCESS_EXECUTOR is not None:
+        RENDER_PROCESS_EXECUTOR.shutdown(wait=True, cancel_futures=True)
+        SHARED_FIELDS.close()
+
+    DATASET_CACHE.clear()
+
+    if TILE_STORE is not None:
+        TILE_STORE.close()
+
+    if INDEX_EXECUTOR is not None:
+        INDEX_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+
     await pool.close()
 
 app = FastAPI(lifespan=lifespan)
@@ -61,13 +107,117 @@ app = FastAPI(lifespan=lifespan)
 env = Env()
 env.read_env()
 
-DATASET_CACHE: Dict[str, Tuple[xr.Dataset, float]] = {}
-STATS_CACHE: Dict[str, Dict[str, Tuple[float, float]]] = {}
+DATASET_INDEX_CACHE: Dict[str, "DatasetIndex"] = {}
+GRID_CACHE: Dict[tuple, Tuple[np.ndarray, np.ndarray, str]] = {}
 CACHE_LOCK = threading.RLock()
-MAX_CACHE_SIZE = 3
-CACHE_TTL = 300
+
+# Открытые NetCDF файлы: не больше MAX_CACHE_SIZE, неиспользуемые дольше
+# CACHE_TTL секунд закрываются (фоновая задача expire_datasets), при
+# изменении mtime файл открывается заново. Датасет, который еще держит
+# запрос, xarray может переоткрыть сам - до конца этого запроса
+MAX_CACHE_SIZE = env.int("DATASET_CACHE_SIZE", 3)
+CACHE_TTL = env.int("DATASET_CACHE_TTL", 300)
+DATASET_CACHE = FileHandleCache(
+    lambda path: open_dataset_store(path), MAX_CACHE_SIZE, CACHE_TTL,
+    on_close=lambda path: forget_dataset(path),
+    on_invalidate=lambda path: forget_dataset_fields(path))
+
+# Перекладка файлов в Zarr с чанками под тайлы (пусто - выключено):
+# тайлы и легенда читают хранилище из ZARR_DIR вместо исходного .nc
+ZARR_DIR = env.str("ZARR_DIR", "")
+ZARR_CHUNK_SIZE = env.int("ZARR_CHUNK_SIZE", 256)
+
+# Каталог с .nc файлами и слежение за ним (inotify, без него - опрос)
+DATA_DIR = env.str("DATA_DIR", "./data")
+DATA_WATCH = env.bool("DATA_WATCH", True)
+DATA_POLL_SECONDS = env.int("DATA_POLL_SECONDS", 30)
+
+# Пул процессов для разбора файлов при индексации, создается при первом запуске
+INDEX_WORKERS = env.int("INDEX_WORKERS", os.cpu_count() or 4)
+INDEX_EXECUTOR = None
+INDEX_PROGRESS_SECONDS = 5
+
+# Пирамида обзорных уровней: каждый уровень - усреднение 2x2 предыдущего.
+# Строятся лениво из FIELD_CACHE, мелкие зумы читают самый грубый уровень,
+# на котором на пиксель приходится хотя бы один узел. 0 - выключено
+OVERVIEW_MAX_LEVEL = env.int("OVERVIEW_MAX_LEVEL", 5)
+OVERVIEW_GRIDS: Dict[tuple, Tuple[np.ndarray, np.ndarray, str]] = {}
+GRID_RESOLUTIONS: Dict[str, tuple] = {}
+
+# Декодированные 2D срезы (float32) по (файл, переменная, время, уровень),
+# общие для тайлов, легенды и расчета ветра. 0 - выключено
+FIELD_CACHE_BYTES = env.int("FIELD_CACHE_BYTES", 512 * 1024 * 1024)
+FIELD_CACHE = SizedLRUCache(FIELD_CACHE_BYTES, sizeof=lambda a: a.nbytes)
+
+# Срез Zarr хранилища декодируется в FIELD_CACHE целиком только с
+# FIELD_CACHE_ZARR_READS-го обращения к нему, до этого тайл читает лишь
+# покрывающие его чанки. 1 - сразу целиком (как для .nc)
+FIELD_CACHE_ZARR_READS = env.int("FIELD_CACHE_ZARR_READS", 2)
+FIELD_READS: "OrderedDict[tuple, int]" = OrderedDict()
+FIELD_READS_MAX = 4096
 DB_DSN = os.environ.get('DB_URL')
 
+# Пул потоков для чтения данных и рендера тайлов вне event loop
+RENDER_WORKERS = env.int("RENDER_WORKERS", os.cpu_count() or 4)
+RENDER_EXECUTOR = ThreadPoolExecutor(
+    max_workers=RENDER_WORKERS, thread_name_prefix="render")
+
+# Бэкенд рендера: "thread" (все в пуле потоков) или "process" (раскраска и
+# кодирование PNG в пуле процессов, срезы полей передаются воркерам через
+# разделяемую память /dev/shm, ее размер должен вмещать SHARED_FIELDS_BYTES)
+RENDER_BACKEND = env.str("RENDER_BACKEND", "thread")
+RENDER_PROCESSES = env.int("RENDER_PROCESSES", os.cpu_count() or 4)
+SHARED_FIELDS_BYTES = env.int("SHARED_FIELDS_BYTES", 256 * 1024 * 1024)
+RENDER_PROCESS_EXECUTOR = None
+SHARED_FIELDS: Optional[SharedArrayStore] = None
+
+# Кэш готовых PNG тайлов, ограниченный по суммарному размеру
+TILE_CACHE_BYTES = env.int("TILE_CACHE_BYTES", 256 * 1024 * 1024)
+TILE_CACHE = SizedLRUCache(TILE_CACHE_BYTES)
+
+# Постоянное хранилище тайлов (SQLite, MBTiles) - второй уровень после
+# TILE_CACHE, сюда же пишет seed_tiles.py. Пусто - выключено
+TILE_STORE_PATH = env.str("TILE_STORE_PATH", "")
+TILE_STORE_BYTES = env.int("TILE_STORE_BYTES", 4 * 1024 * 1024 * 1024)
+TILE_STORE: Optional[TileStore] = (
+    TileStore(TILE_STORE_PATH, TILE_STORE_BYTES) if TILE_STORE_PATH else None)
+
+# HTTP-кэширование /tile и /legend. Шаги времени старше
+# HTTP_IMMUTABLE_AFTER_DAYS считаются окончательными (ERA5T заменяется
+# финальным ERA5 в течение ~3 месяцев) и отдаются как immutable
+HTTP_MAX_AGE = env.int("HTTP_MAX_AGE", 300)
+HTTP_IMMUTABLE_MAX_AGE = env.int("HTTP_IMMUTABLE_MAX_AGE", 365 * 24 * 3600)
+HTTP_IMMUTABLE_AFTER_DAYS = env.int("HTTP_IMMUTABLE_AFTER_DAYS", 90)
+
+# Меняется при изменении рендера, чтобы сбросить ETag у клиентов
+RENDER_VERSION = "2"
+
+# Формат PNG тайлов: "rgba" (32 бита) или "palette" (8 бит, режим "P")
+TILE_PNG_MODE = env.str("TILE_PNG_MODE", "rgba")
+
+# Размер метатайла: запрос одного тайла рендерит блок n x n (1 - выключено)
+METATILE_SIZE = env.int("METATILE_SIZE", 1)
+
+# Хэш настроек, от которых зависят байты тайла. Входит в ETag и слой
+# TILE_STORE рядом с RENDER_VERSION: после смены настроек старые тайлы
+# не отдаются под прежним ETag (пирамида без FIELD_CACHE не строится)
+RENDER_SETTINGS = hashlib.blake2b(repr((
+    TILE_PNG_MODE, OVERVIEW_MAX_LEVEL if FIELD_CACHE_BYTES else 0,
+)).encode(), digest_size=4).hexdigest()
+
+# Индексы ближайших узлов сетки для тайлов: по одному на сигнатуру сетки.
+# Для CARRA опционально сохраняются на диск в REMAP_INDEX_DIR как .npy
+REMAP_CACHE_BYTES = env.int("REMAP_CACHE_BYTES", 256 * 1024 * 1024)
+REMAP_CACHE = SizedLRUCache(REMAP_CACHE_BYTES, sizeof=lambda a: a.nbytes)
+REMAP_TREES = SizedLRUCache(env.int("REMAP_TREE_CACHE_SIZE", 2), sizeof=lambda _: 1)
+REMAP_LOCK = threading.Lock()
+REMAP_INDEX_DIR = env.str("REMAP_INDEX_DIR", "")
+REMAP_MAX_DIST = 0.1
+
+# Пределы палитры (vmin, vmax), ограничение по числу записей
+STATS_CACHE_SIZE = env.int("STATS_CACHE_SIZE", 10000)
+STATS_CACHE = SizedLRUCache(STATS_CACHE_SIZE, sizeof=lambda _: 1)
+
 handler = OpenSearchHandler(
     index_name="netcdf-service",
     hosts=[os.environ.get('OPENSEARCH_URL')],
@@ -95,12 +245,39 @@ app.add_middleware(
 )
 
 
+async def run_in_render_pool(func, *args):
+    """Выполняет func в ограниченном пуле RENDER_EXECUTOR"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(RENDER_EXECUTOR, functools.partial(func, *args))
+
+
 @asynccontextmanager
 async def get_conn():
     async with pool.connection() as conn:
         yield conn
 
 
+class DatasetMatch(NamedTuple):
+    file_path: str
+    time_value: pd.Timestamp
+    time_diff: float
+    last_modified: float
+    time_index: Optional[int] = None
+    pressure_levels: Optional[List[float]] = None
+    zarr_path: Optional[str] = None
+
+    @property
+    def data_path(self) -> str:
+        """Откуда читать данные: Zarr хранилище, если файл переложен"""
+        return self.zarr_path or self.file_path
+
+
+class DatasetIndex(NamedTuple):
+    """Индекс времени и уровней открытого датасета"""
+    times: pd.DatetimeIndex
+    levels: np.ndarray
+
+
 async def init_database():
     logger.info("Инициализация бд")
     async with get_conn() as conn:
@@ -117,19 +294,57 @@ async def init_database():
                 last_modified DOUBLE PRECISION NOT NULL,
                 variable_count INTEGER,
                 variables JSONB,
+                pressure_levels JSONB,
+                zarr_path TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
             """)
 
+            await cur.execute("""
+            ALTER TABLE datasets ADD COLUMN IF NOT EXISTS pressure_levels JSONB
+            """)
+
+            await cur.execute("""
+            ALTER TABLE datasets ADD COLUMN IF NOT EXISTS zarr_path TEXT
+            """)
+
             await cur.execute("""
             CREATE TABLE IF NOT EXISTS dataset_times (
                 id BIGSERIAL PRIMARY KEY,
                 dataset_id BIGINT REFERENCES datasets(id) ON DELETE CASCADE,
+                dataset_type TEXT,
                 time_value TIMESTAMP NOT NULL,
                 time_index INTEGER NOT NULL
             )
             """)
 
+            # dataset_type дублируется в dataset_times, чтобы поиск
+            # ближайшего времени шёл по индексу (dataset_type, time_value)
+            await cur.execute("""
+            ALTER TABLE dataset_times ADD COLUMN IF NOT EXISTS dataset_type TEXT
+            """)
+
+            await cur.execute("""
+            UPDATE dataset_times dt
+            SET dataset_type = d.dataset_type
+            FROM datasets d
+            WHERE dt.dataset_id = d.id AND dt.dataset_type IS NULL
+            """)
+
+            await cur.execute("""
+            CREATE TABLE IF NOT EXISTS dataset_stats (
+                id BIGSERIAL PRIMARY KEY,
+                dataset_id BIGINT REFERENCES datasets(id) ON DELETE CASCADE,
+                variable TEXT NOT NULL,
+                time_index INTEGER NOT NULL,
+                level_index INTEGER NOT NULL,
+                pressure_level DOUBLE PRECISION,
+                vmin DOUBLE PRECISION NOT NULL,
+                vmax DOUBLE PRECISION NOT NULL,
+                UNIQUE (dataset_id, variable, time_index, level_index)
+            )
+            """)
+
             await cur.execute("""
             CREATE INDEX IF NOT EXISTS idx_dataset_type_time
             ON datasets(dataset_type, dataset_time)
@@ -140,198 +355,514 @@ async def init_database():
             ON dataset_times(dataset_id, time_value)
             """)
 
+            await cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_dataset_times_type_time
+            ON dataset_times(dataset_type, time_value)
+            INCLUDE (dataset_id, time_index)
+            """)
 
-def _extract_dataset_info(
-    file_path: str
-) -> Tuple[Optional[str], Optional[pd.Timestamp], List[str], List[pd.Timestamp]]:
-    """Извлекает информацию о датасете из NetCDF файла"""
 
-    try:
-        with xr.open_dataset(file_path, engine="netcdf4", decode_times=False) as ds:
-            file_name = Path(file_path).name.lower()
+def get_index_executor():
+    global INDEX_EXECUTOR
+
+    if INDEX_EXECUTOR is None:
+        INDEX_EXECUTOR = make_index_executor(INDEX_WORKERS)
+
+    return INDEX_EXECUTOR
+
+
+async def run_in_index_pool(func, *args):
+    """Выполняет func в пуле процессов индексации"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_index_executor(), functools.partial(func, *args))
+
+
+async def store_dataset_stats(cur, dataset_id: int, stats):
+    await cur.execute(
+        "DELETE FROM dataset_stats WHERE dataset_id=%s",
+        (dataset_id,)
+    )
+
+    await cur.executemany("""
+        INSERT INTO dataset_stats
+        (dataset_id, variable, time_index, level_index, pressure_level, vmin, vmax)
+        VALUES (%s,%s,%s,%s,%s,%s,%s)
+    """, [(dataset_id, *row) for row in stats])
+
+
+async def store_indexed_file(conn, dataset_id: Optional[int], indexed: IndexedFile):
+    """Запись файла в каталог одной транзакцией: датасет, времена, пределы"""
+    variables_json = json.dumps(indexed.variables)
+    levels_json = json.dumps(indexed.pressure_levels)
+
+    async with conn.transaction():
+        async with conn.cursor() as cur:
+
+            if dataset_id is not None:
+                await cur.execute("""
+                    UPDATE datasets
+                    SET dataset_type=%s,
+                        dataset_time=%s,
+                        file_size=%s,
+                        last_modified=%s,
+                        variable_count=%s,
+                        variables=%s,
+                        pressure_levels=%s,
+                        zarr_path=%s
+                    WHERE id=%s
+                """, (
+                    indexed.dataset_type,
+                    indexed.dataset_time,
+                    indexed.file_size,
+                    indexed.last_modified,
+                    len(indexed.variables),
+                    variables_json,
+                    levels_json,
+                    indexed.zarr_path,
+                    dataset_id
+                ))
+
+                await cur.execute(
+                    "DELETE FROM dataset_times WHERE dataset_id=%s",
+                    (dataset_id,)
+                )
 
-            if 'era5' in file_name:
-                dataset_type = 'era5'
-            elif 'carra' in file_name:
-                dataset_type = 'carra'
             else:
-                dataset_type = 'unknown'
+                await cur.execute("""
+                    INSERT INTO datasets
+                    (file_path, file_name, dataset_type, dataset_time,
+                     file_size, last_modified, variable_count, variables,
+                     pressure_levels, zarr_path)
+                    VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+                    RETURNING id
+                """, (
+                    indexed.file_path,
+                    Path(indexed.file_path).name,
+                    indexed.dataset_type,
+                    indexed.dataset_time,
+                    indexed.file_size,
+                    indexed.last_modified,
+                    len(indexed.variables),
+                    variables_json,
+                    levels_json,
+                    indexed.zarr_path
+                ))
+                row = await cur.fetchone()
+                dataset_id = row[0]
 
-            # --- Декодируем CF-время один раз ---
-            ds_decoded = xr.decode_cf(ds, decode_times=True)
+            async with cur.copy("""
+                COPY dataset_times (dataset_id, dataset_type, time_value, time_index)
+                FROM STDIN
+            """) as copy:
+                for i, t in enumerate(indexed.times):
+                    await copy.write_row((dataset_id, indexed.dataset_type, t, i))
 
-            time_values: List[pd.Timestamp] = []
+            await store_dataset_stats(cur, dataset_id, indexed.stats)
 
-            # --- Универсальная обработка time / valid_time ---
-            if 'time' in ds_decoded.coords:
-                time_values = pd.to_datetime(ds_decoded.time.values).to_list()
 
-            elif 'valid_time' in ds_decoded.coords:
-                time_values = pd.to_datetime(
-                    ds_decoded.valid_time.values
-                ).to_list()
+def invalidate_file_caches(file_path: str, zarr_path: Optional[str] = None):
+    """Сбрасывает все кэши, относящиеся к файлу"""
+    TILE_CACHE.invalidate(lambda key: key[0] == file_path)
+    STATS_CACHE.invalidate(lambda key: key[0] == file_path)
+    DATASET_CACHE.invalidate(file_path)
+    if zarr_path:
+        DATASET_CACHE.invalidate(zarr_path)
 
-            # --- fallback: дата из имени файла ---
-            if not time_values:
-                import re
-                match = re.search(
-                    r'(\d{4})[_-]?(\d{2})[_-]?(\d{2})', file_name)
-                if match:
-                    y, m, d = match.groups()
-                    time_values = [pd.Timestamp(f"{y}-{m}-{d}")]
+    if SHARED_FIELDS is not None:
+        SHARED_FIELDS.invalidate(lambda key: key[0] == file_path)
 
-            # --- fallback: mtime ---
-            if not time_values:
-                stat = os.stat(file_path)
-                time_values = [pd.Timestamp.fromtimestamp(stat.st_mtime)]
-                print(f"⚠ Используется mtime для {Path(file_path).name}")
 
-            dataset_time = time_values[0]  # репрезентативное
+async def index_files(conn, file_paths: List[str], dataset_ids: Dict[str, int]):
+    """
+    Разбор файлов в пуле процессов и запись в каталог по мере готовности.
+    Прогресс и скорость выводятся раз в INDEX_PROGRESS_SECONDS.
+    """
+    total = len(file_paths)
+    if not total:
+        return
 
-            variables = list(ds.data_vars.keys())
+    loop = asyncio.get_running_loop()
+    executor = get_index_executor()
 
-            return dataset_type, dataset_time, variables, time_values
+    futures = [
+        loop.run_in_executor(executor, index_file, file_path, ZARR_DIR, ZARR_CHUNK_SIZE)
+        for file_path in file_paths
+    ]
+
+    started = last_report = loop.time()
+    done = 0
+
+    for future in asyncio.as_completed(futures):
+        try:
+            indexed = await future
+        except Exception as e:
+            logger.error(f"Error in indexing: {e}")
+            indexed = None
+
+        if indexed is not None:
+            for error in indexed.errors:
+                logger.error(error)
+
+            if indexed.dataset_time is not None:
+                await store_indexed_file(
+                    conn, dataset_ids.get(indexed.file_path), indexed)
+
+        done += 1
+        now = loop.time()
+
+        if now - last_report >= INDEX_PROGRESS_SECONDS or done == total:
+            last_report = now
+            rate = done / max(now - started, 1e-6)
+            print(f"Индексация: {done}/{total} файлов, {rate:.1f} файлов/с")
+
+    logger.info(
+        f"Проиндексировано файлов: {total} за {loop.time() - started:.1f} с")
+
+
+def scan_data_dir() -> Dict[str, float]:
+    """Файлы .nc в DATA_DIR и их mtime"""
+    files = {}
+
+    for file_path in glob.glob(os.path.join(DATA_DIR, '*.nc')):
+        try:
+            files[str(Path(file_path).resolve())] = os.stat(file_path).st_mtime
+        except FileNotFoundError:
+            continue
+
+    return files
 
-    except Exception as e:
-        logger.error(f"Error in reading file {file_path}: {e}")
-        import traceback
-        traceback.print_exc()
-        return None, None, [], []
 
+async def sync_catalog(conn, file_paths: List[str]):
+    """
+    Приводит каталог в соответствие с файлами file_paths:
+    новые и измененные индексируются, исчезнувшие удаляются из каталога.
+    Сбрасываются кэши только затронутых файлов.
+    """
+    # Сохраненные mtime всех файлов одним запросом
+    async with conn.transaction():
+        cur = await conn.execute("""
+            SELECT file_path, id, last_modified, zarr_path
+            FROM datasets
+            WHERE file_path = ANY(%s)
+        """, (list(file_paths),))
+
+        known = {row[0]: row[1:] for row in await cur.fetchall()}
+
+    changed = []
+    deleted = []
+
+    for file_path in file_paths:
+        row = known.get(file_path)
+
+        try:
+            mtime = os.stat(file_path).st_mtime
+        except FileNotFoundError:
+            if row:
+                deleted.append(file_path)
+            continue
 
-async def extract_dataset_info(file_path: str):
-    return await run_in_threadpool(_extract_dataset_info, file_path)
+        if row and abs(row[1] - mtime) < 1:
+            continue
+
+        if row:
+            # Файл изменился - старые тайлы и пределы больше не актуальны
+            invalidate_file_caches(file_path, row[2])
+
+        changed.append(file_path)
+
+    if deleted:
+        # dataset_times и dataset_stats удаляются каскадно
+        async with conn.transaction():
+            await conn.execute(
+                "DELETE FROM datasets WHERE file_path = ANY(%s)", (deleted,))
+
+        for file_path in deleted:
+            invalidate_file_caches(file_path, known[file_path][2])
+            remove_zarr_store(known[file_path][2])
+
+        logger.info(f"Удалено из каталога файлов: {len(deleted)}")
+
+    await index_files(
+        conn, changed, {file_path: row[0] for file_path, row in known.items()})
 
 
 async def update_database_index():
-    nc_files = glob.glob('./data/*.nc')
+    nc_files = list(scan_data_dir())
 
     async with get_conn() as conn:
-        async with conn.cursor() as cur:
 
-            for file_path in nc_files:
-                file_path = str(Path(file_path).resolve())
-                stat = os.stat(file_path)
+        # Файлы из каталога, которых больше нет в DATA_DIR
+        async with conn.transaction():
+            cur = await conn.execute("SELECT file_path FROM datasets")
+            stale = [row[0] for row in await cur.fetchall()
+                     if not os.path.exists(row[0])]
 
-                await cur.execute(
-                    "SELECT id, last_modified FROM datasets WHERE file_path=%s",
-                    (file_path,)
+        await sync_catalog(conn, nc_files + stale)
+
+        # Файлы, проиндексированные до появления dataset_stats
+        async with conn.transaction():
+            cur = await conn.execute("""
+                SELECT d.id, d.file_path
+                FROM datasets d
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM dataset_stats s WHERE s.dataset_id = d.id
                 )
+            """)
 
-                row = await cur.fetchone()
+            missing = [row for row in await cur.fetchall()
+                       if os.path.exists(row[1])]
+
+        results = await asyncio.gather(*[
+            run_in_index_pool(compute_dataset_stats, file_path)
+            for _, file_path in missing
+        ], return_exceptions=True)
+
+        for (dataset_id, file_path), stats in zip(missing, results):
+            if isinstance(stats, Exception):
+                logger.error(f"Error in computing stats for {file_path}: {stats}")
+                continue
+
+            async with conn.transaction():
+                async with conn.cursor() as cur:
+                    await store_dataset_stats(cur, dataset_id, stats)
+
+        if not ZARR_DIR:
+            async with conn.transaction():
+                await conn.execute(
+                    "UPDATE datasets SET zarr_path=NULL WHERE zarr_path IS NOT NULL")
+            return
+
+        # Файлы, проиндексированные до включения ZARR_DIR
+        async with conn.transaction():
+            cur = await conn.execute(
+                "SELECT id, file_path, zarr_path FROM datasets")
+
+            missing = [
+                (dataset_id, file_path)
+                for dataset_id, file_path, zarr_path in await cur.fetchall()
+                if (not zarr_path or not os.path.isdir(zarr_path)) and os.path.exists(file_path)
+            ]
+
+        results = await asyncio.gather(*[
+            run_in_index_pool(ingest_zarr, file_path, ZARR_DIR, ZARR_CHUNK_SIZE)
+            for _, file_path in missing
+        ], return_exceptions=True)
+
+        for (dataset_id, file_path), zarr_path in zip(missing, results):
+            if isinstance(zarr_path, Exception):
+                logger.error(f"Error in Zarr ingest for {file_path}: {zarr_path}")
+                zarr_path = None
+
+            async with conn.transaction():
+                await conn.execute(
+                    "UPDATE datasets SET zarr_path=%s WHERE id=%s",
+                    (zarr_path, dataset_id)
+                )
+
+
+async def reindex_files(file_paths):
+    """Инкрементальная переиндексация изменившихся файлов"""
+    async with get_conn() as conn:
+        await sync_catalog(conn, sorted(file_paths))
+
+
+async def poll_data_dir():
+    """Опрос DATA_DIR раз в DATA_POLL_SECONDS, если inotify недоступен"""
+    seen = await run_in_threadpool(scan_data_dir)
+
+    while True:
+        await asyncio.sleep(DATA_POLL_SECONDS)
+
+        current = await run_in_threadpool(scan_data_dir)
+        changed = {
+            file_path for file_path in current.keys() | seen.keys()
+            if current.get(file_path) != seen.get(file_path)
+        }
+        seen = current
+
+        if changed:
+            try:
+                await reindex_files(changed)
+            except Exception as e:
+                logger.error(f"Error in reindexing {len(changed)} files: {e}")
+
+
+async def expire_datasets():
+    """
+    Закрытие файлов, не использовавшихся дольше CACHE_TTL. Без этой задачи
+    файлы закрывались бы только при следующем обращении к DATASET_CACHE
+    """
+    while True:
+        await asyncio.sleep(max(CACHE_TTL / 2, 1))
+
+        try:
+            closed = await run_in_threadpool(DATASET_CACHE.expire)
+            if closed:
+                logger.info(f"Закрыто неиспользуемых файлов: {closed}")
+        except Exception as e:
+            logger.error(f"Error in dataset expiry: {e}")
+
+
+async def watch_data_dir():
+    """
+    Фоновое слежение за DATA_DIR: новые, измененные и удаленные .nc файлы
+    переиндексируются без перезапуска сервиса. inotify через watchfiles,
+    без него - опрос каталога.
+    """
+    try:
+        from watchfiles import awatch
+    except ImportError:
+        logger.info("watchfiles не установлен, опрос каталога данных")
+        await poll_data_dir()
+        return
+
+    if not os.path.isdir(DATA_DIR):
+        logger.error(f"Каталог данных {DATA_DIR} не найден, опрос каталога")
+        await poll_data_dir()
+        return
+
+    async for changes in awatch(DATA_DIR, recursive=False,
+                                watch_filter=lambda change, path: path.endswith('.nc')):
+        changed = {str(Path(path).resolve()) for _, path in changes}
 
-                if row and abs(row[1] - stat.st_mtime) < 1:
-                    continue
-
-                dataset_type, dataset_time, variables, times = await extract_dataset_info(
-                    file_path)
-
-                if dataset_time is None:
-                    continue
-
-                variables_json = json.dumps(variables)
-
-                if row:
-                    dataset_id = row[0]
-
-                    await cur.execute("""
-                        UPDATE datasets
-                        SET dataset_type=%s,
-                            dataset_time=%s,
-                            file_size=%s,
-                            last_modified=%s,
-                            variable_count=%s,
-                            variables=%s
-                        WHERE id=%s
-                    """, (
-                        dataset_type,
-                        dataset_time,
-                        stat.st_size,
-                        stat.st_mtime,
-                        len(variables),
-                        variables_json,
-                        dataset_id
-                    ))
-
-                    await cur.execute(
-                        "DELETE FROM dataset_times WHERE dataset_id=%s",
-                        (dataset_id,)
-                    )
-
-                else:
-                    await cur.execute("""
-                        INSERT INTO datasets
-                        (file_path, file_name, dataset_type, dataset_time,
-                         file_size, last_modified, variable_count, variables)
-                        VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
-                        RETURNING id
-                    """, (
-                        file_path,
-                        Path(file_path).name,
-                        dataset_type,
-                        dataset_time,
-                        stat.st_size,
-                        stat.st_mtime,
-                        len(variables),
-                        variables_json
-                    ))
-                    row = await cur.fetchone()
-                    dataset_id = row[0]
-
-                for i, t in enumerate(times):
-                    await cur.execute("""
-                        INSERT INTO dataset_times(dataset_id, time_value, time_index)
-                        VALUES (%s,%s,%s)
-                    """, (dataset_id, t, i))
-
-
-async def find_matching_dataset_by_time(pmc_time, dataset_type="era5", time_tolerance_hours=3):
+        try:
+            await reindex_files(changed)
+        except Exception as e:
+            logger.error(f"Error in reindexing {len(changed)} files: {e}")
+
+
+async def find_datasets_in_range(dataset_type: str, time_from, time_to) -> List[DatasetMatch]:
+    """Все шаги времени файлов типа dataset_type в окне [time_from, time_to]"""
     async with get_conn() as conn:
         async with conn.cursor() as cur:
             await cur.execute("""
-                SELECT file_path, dataset_time
-                FROM datasets
-                WHERE dataset_type=%s
-                ORDER BY ABS(EXTRACT(EPOCH FROM (dataset_time - %s)))
-                LIMIT 1
-            """, (dataset_type, pmc_time))
+                SELECT d.file_path, t.time_value, d.last_modified,
+                       t.time_index, d.pressure_levels, d.zarr_path
+                FROM dataset_times t
+                JOIN datasets d ON d.id = t.dataset_id
+                WHERE t.dataset_type = %s
+                  AND t.time_value BETWEEN %s AND %s
+                ORDER BY t.time_value, d.file_path
+            """, (dataset_type, time_from, time_to))
 
-            row = await cur.fetchone()
+            rows = await cur.fetchall()
 
-            if row:
-                file_path, file_time = row
-                diff = abs((pmc_time - file_time).total_seconds() / 3600)
-                if diff <= time_tolerance_hours:
-                    return file_path, file_time, diff
+    return [
+        DatasetMatch(file_path, time_value, 0.0, last_modified,
+                     time_index, levels, zarr_path)
+        for file_path, time_value, last_modified, time_index, levels, zarr_path in rows
+    ]
 
+
+async def find_matching_dataset_by_time(pmc_time, dataset_type="era5", time_tolerance_hours=3) -> Optional[DatasetMatch]:
+    """
+    Ближайший по времени шаг среди всех файлов типа dataset_type.
+    Возвращает файл вместе с time_index этого шага и уровнями давления.
+    """
     return await find_in_times_table(pmc_time, dataset_type, time_tolerance_hours)
 
 
-async def find_in_times_table(pmc_time, dataset_type="era5", time_tolerance_hours=3):
+async def lookup_variable_stats(file_path, variable, time_index, level_index):
+    async with get_conn() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                SELECT s.vmin, s.vmax
+                FROM dataset_stats s
+                JOIN datasets d ON d.id = s.dataset_id
+                WHERE d.file_path=%s
+                  AND s.variable=%s
+                  AND s.time_index=%s
+                  AND s.level_index=%s
+            """, (file_path, variable, time_index, level_index))
+
+            return await cur.fetchone()
+
+
+async def get_variable_stats(ds_file: DatasetMatch, ds: xr.Dataset, variable: str,
+                             time_index: int, level_index: int) -> Tuple[float, float]:
+    """
+    Пределы палитры для (файл, переменная, время, уровень).
+    Берутся из dataset_stats, посчитанных при индексации,
+    и только при их отсутствии вычисляются по полю.
+    """
+    name = stats_variable(ds, variable)
+
+    cache_key = (ds_file.file_path, ds_file.last_modified,
+                 name, time_index, level_index)
+
+    cached = STATS_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    row = await lookup_variable_stats(
+        ds_file.file_path, name, time_index, level_index)
+
+    if row is None:
+        row = await run_in_render_pool(
+            compute_variable_stats, ds, name, time_index, level_index)
+
+    stats = (float(row[0]), float(row[1]))
+    STATS_CACHE.put(cache_key, stats)
+
+    return stats
+
+
+# Ближайшее время двумя индексными range-запросами по
+# idx_dataset_times_type_time: последний шаг <= t и первый шаг >= t
+# в пределах окна допуска
+NEAREST_TIME_SQL = """
+    SELECT d.file_path, c.time_value, d.last_modified,
+           c.time_index, d.pressure_levels, d.zarr_path
+    FROM (
+        (SELECT dataset_id, time_value, time_index
+         FROM dataset_times
+         WHERE dataset_type = %(dataset_type)s
+           AND time_value <= %(time)s
+           AND time_value >= %(time_from)s
+         ORDER BY time_value DESC
+         LIMIT 1)
+        UNION ALL
+        (SELECT dataset_id, time_value, time_index
+         FROM dataset_times
+         WHERE dataset_type = %(dataset_type)s
+           AND time_value >= %(time)s
+           AND time_value <= %(time_to)s
+         ORDER BY time_value ASC
+         LIMIT 1)
+    ) c
+    JOIN datasets d ON d.id = c.dataset_id
+"""
+
+
+async def find_in_times_table(pmc_time, dataset_type="era5", time_tolerance_hours=3) -> Optional[DatasetMatch]:
+    tolerance = pd.Timedelta(hours=time_tolerance_hours)
 
     async with get_conn() as conn:
         async with conn.cursor() as cur:
 
-            await cur.execute("""
-                SELECT d.file_path, dt.time_value
-                FROM datasets d
-                JOIN dataset_times dt ON d.id = dt.dataset_id
-                WHERE d.dataset_type=%s
-            """, (dataset_type,))
+            await cur.execute(NEAREST_TIME_SQL, {
+                "dataset_type": dataset_type,
+                "time": pmc_time,
+                "time_from": pmc_time - tolerance,
+                "time_to": pmc_time + tolerance,
+            })
 
             rows = await cur.fetchall()
-            best = None
-            best_diff = 1e9
 
-            for file_path, file_time in rows:
-                diff = abs((pmc_time - file_time).total_seconds() / 3600)
+    best = None
+    best_diff = 1e9
+
+    for row in rows:
+        diff = abs((pmc_time - row[1]).total_seconds() / 3600)
 
-                if diff <= time_tolerance_hours and diff < best_diff:
-                    best = (file_path, file_time)
-                    best_diff = diff
+        if diff < best_diff:
+            best = row
+            best_diff = diff
 
-            if best:
-                return best[0], best[1], best_diff
+    if best:
+        file_path, file_time, last_modified, time_index, levels, zarr_path = best
+        return DatasetMatch(file_path, file_time, best_diff,
+                            last_modified, time_index, levels, zarr_path)
 
     return None
 
@@ -375,34 +906,6 @@ async def startup_event():
         traceback.print_exc()
 
 
-def open_nc_with_stats(dataset_path: str, variable: str) -> Tuple[xr.Dataset, float, float]:
-    """Открывает датасет и вычисляет статистики с кэшированием"""
-
-    cache_key = f"{dataset_path}:{variable}"
-    if cache_key in STATS_CACHE:
-        vmin, vmax = STATS_CACHE[cache_key]
-        dataset = get_cached_dataset(dataset_path)
-        return dataset, vmin, vmax
-
-    dataset = get_cached_dataset(dataset_path)
-    arr = dataset[variable].values
-
-    if arr.ndim == 3:
-        arr = arr[0]
-
-    valid = arr[~np.isnan(arr)]
-
-    if len(valid) == 0:
-        vmin = vmax = 0.0
-    else:
-        vmin = np.percentile(valid, 2)
-        vmax = np.percentile(valid, 98)
-
-    STATS_CACHE[cache_key] = (float(vmin), float(vmax))
-
-    return dataset, float(vmin), float(vmax)
-
-
 def open_nc_dataset(path: str) -> xr.Dataset:
     """Open NetCDF dataset with lazy loading."""
     path = str(Path(path).resolve())
@@ -512,421 +1015,974 @@ def open_nc_dataset(path: str) -> xr.Dataset:
     return ds
 
 
+def open_dataset_store(path: str) -> xr.Dataset:
+    # mtime до открытия: если файл перезапишут позже, ключи срезов разойдутся
+    mtime = os.path.getmtime(path)
+
+    if path.endswith(ZARR_SUFFIX):
+        ds = open_zarr_dataset(path)
+    else:
+        ds = open_nc_dataset(path)
+
+    for var in ds.variables.values():
+        var.encoding["mtime"] = mtime
+
+    return ds
+
+
 def get_cached_dataset(path):
-    if path not in DATASET_CACHE:
-        DATASET_CACHE[path] = open_nc_dataset(path)
-    return DATASET_CACHE[path]
+    return DATASET_CACHE.get(path)
 
 
-def remap_carra_data(data, lats, lons, target_lat_grid, target_lon_grid):
-    """
-    Пересчет данных CARRA с исходной сетки на целевую
+def forget_dataset(path: str):
+    """Сбрасывает производные кэши закрытого датасета"""
+    source = str(Path(path).resolve())
 
-    Parameters:
-    - data: 2D массив данных (original_y, original_x)
-    - lats: 2D массив широт (original_y, original_x)
-    - lons: 2D массив долгот (original_y, original_x)
-    - target_lat_grid: 2D массив целевых широт (256, 256)
-    - target_lon_grid: 2D массив целевых долгот (256, 256)
+    with CACHE_LOCK:
+        DATASET_INDEX_CACHE.pop(path, None)
+        for key in [key for key in GRID_CACHE if key[0] == source]:
+            GRID_CACHE.pop(key)
 
-    Returns:
-    - 2D массив (256, 256) с пересчитанными данными
-    """
-    # Расплющиваем исходные данные
-    from scipy.spatial import cKDTree
-    points = np.column_stack((lats.ravel(), lons.ravel()))
-    values = data.ravel()
 
-    tree = cKDTree(points)
+def forget_dataset_fields(path: str):
+    """Сбрасывает закэшированные срезы изменившегося файла"""
+    source = str(Path(path).resolve())
+    FIELD_CACHE.invalidate(lambda key: key[0] == source)
 
-    query = np.column_stack((target_lat_grid.ravel(), target_lon_grid.ravel()))
 
-    dist, idx = tree.query(query)
+def get_dataset_index(path: str, ds: xr.Dataset) -> DatasetIndex:
+    """
+    Индекс времени/уровней открытого датасета, строится один раз.
+    path - путь, по которому датасет открыт (data_path): по нему же
+    индекс сбрасывается в forget_dataset при закрытии файла
+    """
+    index = DATASET_INDEX_CACHE.get(path)
+    if index is not None:
+        return index
+
+    times = pd.DatetimeIndex([])
+    for name in ('valid_time', 'time'):
+        if name in ds.coords:
+            times = pd.DatetimeIndex(np.atleast_1d(ds[name].values))
+            break
 
-    tile = values[idx].reshape(256, 256)
+    levels = np.array([], dtype=float)
+    if 'pressure_level' in ds.coords:
+        levels = np.atleast_1d(ds.pressure_level.values).astype(float)
 
-    tile[dist.reshape(256, 256) > 0.1] = np.nan
+    index = DatasetIndex(times, levels)
 
-    # Возвращаем в исходную форму тайла
-    return tile
+    with CACHE_LOCK:
+        DATASET_INDEX_CACHE[path] = index
 
+    return index
 
-def get_tile_data(dataset, variable, x, y, z, time_idx=0, level_index=0):
-    ds = dataset
-    var = ds[variable]
 
-    # Извлечение данных
-    if 'pressure_level' in var.dims:
-        data = var.isel(valid_time=time_idx, pressure_level=level_index).values
-    else:
-        if 'valid_time' in var.dims:
-            data = var.isel(valid_time=time_idx).values
-        else:
-            data = var.values
+def resolve_time_index(ds_file: DatasetMatch, ds: xr.Dataset, time) -> int:
+    """time_index из каталога, иначе ближайший шаг по индексу датасета"""
+    if ds_file.time_index is not None:
+        return ds_file.time_index
 
-    # Приводим к 2D
-    if data.ndim != 2:
-        data = data.squeeze()
-        if data.ndim != 2:
-            data = data.reshape(-1, data.shape[-2], data.shape[-1])[0]
+    times = get_dataset_index(ds_file.data_path, ds).times
+    if len(times) == 0:
+        return 0
 
-    # Получаем координаты
-    lats = var.latitude.values
-    lons = var.longitude.values
+    return int(times.get_indexer([time], method="nearest")[0])
 
-    # Получаем целевую сетку тайла
-    lon_grid, lat_grid = tile_lonlat_grid(z, x, y)
 
-    # Для CARRA (2D координаты) используем remap
-    if lats.ndim == 2 and lons.ndim == 2:
-        tile = remap_carra_data(data, lats, lons, lat_grid, lon_grid)
-    else:
-        # Для ERA5 (1D координаты) используем RegularGridInterpolator
-        from scipy.interpolate import RegularGridInterpolator
-        from scipy.spatial import cKDTree
-
-        if lats[0] > lats[-1]:
-            lats = lats[::-1]
-            data = data[::-1, :]
-
-        if lons[0] > lons[-1]:
-            lons = lons[::-1]
-            data = data[:, ::-1]
-
-        interp = RegularGridInterpolator(
-            (lats, lons),
-            data,
-            method="nearest",
-            bounds_error=False,
-            fill_value=np.nan
-        )
+def resolve_level_index(ds_file: DatasetMatch, ds: xr.Dataset, var: xr.DataArray,
+                        pressure_level) -> int:
+    """Индекс ближайшего уровня давления: уровни из каталога или из датасета"""
+    if 'pressure_level' not in var.dims:
+        return 0
 
-        pts = np.stack([lat_grid.ravel(), lon_grid.ravel()], axis=-1)
-        tile = interp(pts).reshape(256, 256)
+    levels = ds_file.pressure_levels
+    if not levels:
+        levels = get_dataset_index(ds_file.data_path, ds).levels
 
-    return tile
+    return nearest_level_index(levels, float(pressure_level))
 
 
-def compute_variable_stats(ds, variable, time_index, pressure_level):
-    var = ds[variable]
+def get_remap_tree(signature: str, lats: np.ndarray, lons: np.ndarray) -> cKDTree:
+    """KD-дерево по всем узлам CARRA, одно на сигнатуру сетки"""
+    tree = REMAP_TREES.get(signature)
+    if tree is not None:
+        return tree
 
-    level_index = 0
+    with REMAP_LOCK:
+        tree = REMAP_TREES.get(signature)
+        if tree is None:
+            points = np.column_stack((lats.ravel(), lons.ravel()))
+            tree = cKDTree(points)
+            REMAP_TREES.put(signature, tree)
 
-    if 'pressure_level' in var.dims:
-        levels = var.pressure_level.values
-        level_index = int(
-            np.argmin(np.abs(levels.astype(float) - float(pressure_level))))
-
-    if 'valid_time' in var.dims and 'pressure_level' in var.dims:
-        data = var.isel(valid_time=time_index,
-                        pressure_level=level_index).values
-    elif 'valid_time' in var.dims:
-        data = var.isel(valid_time=time_index).values
-    else:
-        data = var.values
+    return tree
 
-    vmin = float(np.nanpercentile(data, 2))
-    vmax = float(np.nanpercentile(data, 98))
 
-    return vmin, vmax
+def get_remap_index(signature: str, lats: np.ndarray, lons: np.ndarray,
+                    z: int, x: int, y: int, max_dist: float = REMAP_MAX_DIST) -> np.ndarray:
+    cache_key = (signature, z, x, y)
 
-# variable: str, t: int = 0
+    index = REMAP_CACHE.get(cache_key)
+    if index is not None:
+        return index
 
+    index = read_remap_index(REMAP_INDEX_DIR, signature, z, x, y)
 
-def make_no_data_tile(text: str = "Нет данных") -> bytes:
-    img = Image.new("RGBA", (256, 256), (240, 240, 240, 255))
-    draw = ImageDraw.Draw(img)
+    if index is None:
+        tree = get_remap_tree(signature, lats, lons)
+        index = remap_tile_index(tree, z, x, y, max_dist)
+        write_remap_index(REMAP_INDEX_DIR, signature, z, x, y, index)
 
-    font = get_font()
+    REMAP_CACHE.put(cache_key, index)
 
-    bbox = draw.textbbox((0, 0), text, font=font)
-    w, h = bbox[2] - bbox[0], bbox[3] - bbox[1]
+    return index
 
-    draw.text(((256 - w) / 2, (256 - h) / 2),
-              text, fill=(80, 80, 80), font=font)
 
-    buf = io.BytesIO()
-    img.save(buf, "PNG")
-    return buf.getvalue()
+def remap_carra_data(var: xr.DataArray, indexers: dict, index: np.ndarray, shape) -> np.ndarray:
+    """
+    Пересчет данных CARRA с исходной сетки на тайл по готовому индексу.
+    Читается только прямоугольник сетки, покрывающий узлы из индекса.
 
+    Parameters:
+    - var: переменная с 2D координатами (y, x)
+    - indexers: индексы по времени/уровню
+    - index: плоские индексы узлов (256, 256) или блока тайлов, -1 - нет данных
+    - shape: форма исходной сетки (ny, nx)
 
-def draw_arrow_polygon(draw, x, y, u, v, length, width, head_len, head_width, color):
-    angle = np.arctan2(-v, u)
+    Returns:
+    - 2D массив формы index с пересчитанными данными
+    """
+    valid = index >= 0
+    if not valid.any():
+        return np.full(index.shape, np.nan)
 
-    cos_a = np.cos(angle)
-    sin_a = np.sin(angle)
+    rows, cols = np.divmod(index[valid], shape[1])
+    r0, r1 = int(rows.min()), int(rows.max()) + 1
+    c0, c1 = int(cols.min()), int(cols.max()) + 1
 
-    x_end = x + cos_a * length
-    y_end = y + sin_a * length
+    y_dim, x_dim = var.latitude.dims
+    data = var.isel(**indexers, **{y_dim: slice(r0, r1),
+                    x_dim: slice(c0, c1)}).values
 
-    x_body = x + cos_a * (length - head_len)
-    y_body = y + sin_a * (length - head_len)
+    if data.ndim != 2:
+        data = data.reshape(-1, data.shape[-2], data.shape[-1])[0]
 
-    px = -sin_a
-    py = cos_a
+    tile = np.full(index.shape, np.nan, dtype=data.dtype)
+    tile[valid] = data[rows - r0, cols - c0]
 
-    p1 = (x + px * width/2, y + py * width/2)
-    p2 = (x - px * width/2, y - py * width/2)
-    p3 = (x_body - px * width/2, y_body - py * width/2)
-    p4 = (x_body + px * width/2, y_body + py * width/2)
+    return tile
 
-    tip = (x_end, y_end)
-    left = (x_body + px * head_width/2, y_body + py * head_width/2)
-    right = (x_body - px * head_width/2, y_body - py * head_width/2)
 
-    polygon = [p1, p2, p3, right, tip, left, p4]
+def get_regular_index(signature: str, lats: np.ndarray, lons: np.ndarray,
+                      z: int, x: int, y: int) -> np.ndarray:
+    """
+    Индексы ближайших строк и столбцов регулярной сетки (ERA5)
+    для строк и столбцов тайла: массив (2, 256), -1 - вне сетки
+    """
+    cache_key = (signature, z, x, y)
 
-    draw.polygon(polygon, fill=color)
+    index = REMAP_CACHE.get(cache_key)
+    if index is not None:
+        return index
 
+    index = regular_tile_index(lats, lons, z, x, y)
 
-def draw_wind_arrows(img, u, v, step=32, scale=2.5, fixed_length=10):
-    upscale = 2
-    big = img.resize((img.width*upscale, img.height*upscale), Image.NEAREST)
-    draw = ImageDraw.Draw(big)
+    REMAP_CACHE.put(cache_key, index)
 
-    h, w = u.shape
+    return index
 
-    for j in range(0, h, step):
-        for i in range(0, w, step):
-            uu = u[j, i]
-            vv = v[j, i]
 
-            if np.isnan(uu) or np.isnan(vv):
-                continue
+def resample_regular_data(var: xr.DataArray, indexers: dict, index: np.ndarray) -> np.ndarray:
+    """
+    Nearest-выборка регулярной сетки на тайл (или блок тайлов)
+    по индексам строк/столбцов.
+    Читается только прямоугольник сетки, покрывающий эти индексы.
+    """
+    rows, cols = index
+    valid_rows = rows >= 0
+    valid_cols = cols >= 0
 
-            speed = np.sqrt(uu**2 + vv**2)
-            if speed < 0.1:
-                continue
+    if not valid_rows.any() or not valid_cols.any():
+        return np.full((len(rows), len(cols)), np.nan)
 
-            x = i * upscale
-            y = j * upscale
-
-            draw_arrow_polygon(
-                draw,
-                x, y,
-                uu, vv,
-                length=20.0,
-                width=3.0,
-                head_len=12.0,
-                head_width=12.0,
-                color="#000000"
-            )
+    r0, r1 = int(rows[valid_rows].min()), int(rows[valid_rows].max()) + 1
+    c0, c1 = int(cols[valid_cols].min()), int(cols[valid_cols].max()) + 1
 
-    return big.resize(img.size, Image.LANCZOS)
+    data = var.isel(**indexers, **{
+        var.latitude.dims[0]: slice(r0, r1),
+        var.longitude.dims[0]: slice(c0, c1),
+    }).values
 
+    if data.ndim != 2:
+        data = data.reshape(-1, data.shape[-2], data.shape[-1])[0]
 
-@app.get("/tile/{z}/{x}/{y}")
-async def tile(variable: str, time: str, z: int, x: int, y: int, pressure_level: int = 850, type: str = "era5", u_vmin: Optional[float] = None,
-               u_vmax: Optional[float] = None):
-    logger.info(
-        f"[Tile]: variable={variable}, time={time}, pressure_level={pressure_level}, type={type}")
+    tile = data[np.ix_(np.where(valid_rows, rows - r0, 0),
+                       np.where(valid_cols, cols - c0, 0))]
 
-    if (is_tile_allowed(z, x, y) == False):
-        return Response(
+    if not (valid_rows.all() and valid_cols.all()):
+        tile = tile.astype(np.result_type(tile.dtype, np.float32))
+        tile[~valid_rows, :] = np.nan
+        tile[:, ~valid_cols] = np.nan
 
-        )
+    return tile
 
-    time = pd.to_datetime(time, format='%m/%d/%Y %H:%M')
 
-    time_tolerance_hours = 1
+def get_grid(var: xr.DataArray) -> Tuple[np.ndarray, np.ndarray, str]:
+    """Координаты latitude/longitude и сигнатура сетки, закэшированные по файлу"""
+    source = var.encoding.get("source")
+    cache_key = (source, var.latitude.dims, var.longitude.dims)
 
-    if type == "carra":
-        time_tolerance_hours = 3
+    if source is not None and cache_key in GRID_CACHE:
+        return GRID_CACHE[cache_key]
 
-    ds_file = await find_matching_dataset_by_time(
-        time, dataset_type=type, time_tolerance_hours=time_tolerance_hours)
+    lats, lons = var.latitude.values, var.longitude.values
+    grid = (lats, lons, grid_signature(lats, lons))
 
-    if ds_file is None or variable is None:
-        logger.error(
-            f"[Tile] No data found: variable={variable}, time={time}, pressure_level={pressure_level}, type={type}")
-        return Response(
-            content=make_no_data_tile(),
-            media_type="image/png"
-        )
+    if source is not None:
+        with CACHE_LOCK:
+            GRID_CACHE[cache_key] = grid
 
-    filename, dataset, time_diff = ds_file
+    return grid
 
-    async with nc_lock:
-        ds, global_vmin, global_vmax = await run_in_threadpool(
-            open_nc_with_stats, filename, variable
-        )
 
+def get_block_data(dataset, variable, z, xs, ys, time_idx=0, level_index=0):
+    """
+    Данные переменной для прямоугольного блока тайлов (xs x ys) одного зума:
+    массив (len(ys) * 256, len(xs) * 256)
+    """
+    ds = dataset
     var = ds[variable]
 
-    times = var.valid_time.values
-    time_index = 0
+    indexers = {}
+    if 'valid_time' in var.dims:
+        indexers['valid_time'] = time_idx
+    if 'pressure_level' in var.dims:
+        indexers['pressure_level'] = level_index
 
-    for i, time_val in enumerate(times):
-        time_val = pd.to_datetime(time_val, format='%m/%d/%Y %H:%M')
-        time_diff = abs((time_val - time).total_seconds() / 3600)
-        if time_diff <= 1:
-            time_index = i
-            print(f"✓ Found {time} at index {i}")
-            break
+    # Получаем координаты
+    lats, lons, signature = get_grid(var)
+
+    # На мелких зумах - координаты и поле уровня пирамиды.
+    # Строки тайлов с разными уровнями собираются по отдельности
+    runs = overview_runs(ys, select_overview(lats, lons, signature, z, ys))
+    if len(runs) > 1:
+        return np.vstack([
+            get_block_data(dataset, variable, z, xs, run, time_idx, level_index)
+            for _, run in runs
+        ])
+
+    overview = runs[0][0]
+    if overview:
+        lats, lons, signature = get_overview_grid(lats, lons, signature, overview)
+
+    # Для CARRA (2D координаты) используем remap по индексу ближайших узлов
+    if lats.ndim == 2 and lons.ndim == 2:
+        # Узлы уровня пирамиды реже в 2^overview раз
+        max_dist = REMAP_MAX_DIST * 2 ** overview
 
-    if variable == 'wind_speed' or variable == 'u' or variable == 'v':
-        var = ds[variable]
+        index = np.block([
+            [get_remap_index(signature, lats, lons, z, x, y, max_dist) for x in xs]
+            for y in ys
+        ])
 
-        if 'u' in ds and 'v' in ds and 'pressure_level' in var.dims:
-            levels = var.pressure_level.values
-            level_index = None
+        if overview or use_field_cache(ds, variable, time_idx, level_index):
+            return gather_remap(
+                get_overview_field(ds, variable, time_idx, level_index, overview), index)
 
-            for i, level in enumerate(levels):
-                if float(level) == float(pressure_level):
-                    level_index = i
-                    print(f"✓ Found {pressure_level} hPa at index {i}")
-                    break
+        return remap_carra_data(var, indexers, index, lats.shape)
 
-            if level_index is None:
-                level_index = np.argmin(
-                    np.abs(levels.astype(float) - float(pressure_level)))
-                print(
-                    f"! Using closest: index {level_index}, level {levels[level_index]} hPa")
+    # Для ERA5 (1D координаты) - прямая выборка по индексам строк/столбцов
+    rows = np.concatenate([
+        get_regular_index(signature, lats, lons, z, xs[0], y)[0] for y in ys
+    ])
+    cols = np.concatenate([
+        get_regular_index(signature, lats, lons, z, x, ys[0])[1] for x in xs
+    ])
 
-            u_data = get_tile_data(
-                ds, 'u', x, y, z, time_idx=time_index, level_index=level_index)
-            v_data = get_tile_data(
-                ds, 'v', x, y, z, time_idx=time_index, level_index=level_index)
+    if overview or use_field_cache(ds, variable, time_idx, level_index):
+        return gather_regular(
+            get_overview_field(ds, variable, time_idx, level_index, overview), rows, cols)
 
-            tile_data = np.sqrt(u_data**2 + v_data**2)
+    # Без кэша срезов (или при первом обращении к срезу Zarr) читается
+    # только окно сетки под блоком
+    return resample_regular_data(var, indexers, np.stack((rows, cols)))
 
-            if 'valid_time' in ds['u'].dims:
-                u_global = ds['u'].isel(valid_time=time_index).values
-                v_global = ds['v'].isel(valid_time=time_index).values
-            else:
-                u_global = ds['u'].values
-                v_global = ds['v'].values
 
-            wind_global = np.sqrt(u_global**2 + v_global**2)
-            vmin = np.nanpercentile(wind_global, 2)
-            vmax = np.nanpercentile(wind_global, 98)
+def use_field_cache(ds: xr.Dataset, variable: str, time_index: int, level_index: int) -> bool:
+    """
+    Брать ли блок из целого среза в FIELD_CACHE. Для Zarr срез декодируется
+    целиком, только когда к нему обращаются повторно: разовый холодный тайл
+    дешевле прочитать по чанкам, чем распаковывать весь срез
+    """
+    if not FIELD_CACHE.max_bytes:
+        return False
 
-            cmap = get_panoply_colormap("NEO_modis_sst_45")
-        else:
-            tile_data = get_tile_data(ds, variable, x, y, z, time_idx=0)
-            vmin, vmax = global_vmin, global_vmax
-            cmap = get_panoply_colormap("NEO_modis_sst_45")
+    source = field_source(ds, variable)
+    if source is None or not source[0].endswith(ZARR_SUFFIX) or FIELD_CACHE_ZARR_READS <= 1:
+        return True
 
-    if variable == 'u10' or variable == 'v10':
-        var = ds[variable]
-        if 'u10' in ds and 'v10' in ds:
+    key = source + (variable, int(time_index), int(level_index))
+    if key in FIELD_CACHE:
+        return True
 
-            u_data = get_tile_data(
-                ds, 'u', x, y, z, time_idx=time_index)
-            v_data = get_tile_data(
-                ds, 'v', x, y, z, time_idx=time_index)
+    with CACHE_LOCK:
+        reads = FIELD_READS.pop(key, 0) + 1
+        if reads >= FIELD_CACHE_ZARR_READS:
+            return True
 
-            tile_data = np.sqrt(u_data**2 + v_data**2)
+        FIELD_READS[key] = reads
+        while len(FIELD_READS) > FIELD_READS_MAX:
+            FIELD_READS.popitem(last=False)
 
-            if 'valid_time' in ds['u'].dims:
-                u_global = ds['u'].isel(valid_time=time_index).values
-                v_global = ds['v'].isel(valid_time=time_index).values
-            else:
-                u_global = ds['u'].values
-                v_global = ds['v'].values
+    return False
 
-            wind_global = np.sqrt(u_global**2 + v_global**2)
-            vmin = np.nanpercentile(wind_global, 2)
-            vmax = np.nanpercentile(wind_global, 98)
 
-            cmap = get_panoply_colormap("NEO_modis_sst_45")
-        else:
-            tile_data = get_tile_data(
-                ds, variable, x, y, z, time_idx=0)
-            vmin, vmax = global_vmin, global_vmax
-            cmap = get_panoply_colormap("NEO_modis_sst_45")
+def select_overview(lats, lons, signature: str, z: int, ys) -> List[int]:
+    """Уровень пирамиды для каждой строки тайлов ys (0 - исходная сетка)"""
+    if not OVERVIEW_MAX_LEVEL or not FIELD_CACHE.max_bytes:
+        return [0] * len(ys)
 
-    elif variable == 'z':
-        var = ds[variable]
+    resolution = GRID_RESOLUTIONS.get(signature)
+    if resolution is None:
+        resolution = grid_resolution(lats, lons)
+        with CACHE_LOCK:
+            GRID_RESOLUTIONS[signature] = resolution
 
-        if 'pressure_level' in var.dims:
-            levels = var.pressure_level.values
-            level_index = None
+    # Уровень не грубее сетки 2x2 узла
+    max_level = min(OVERVIEW_MAX_LEVEL, int(np.log2(min(lats.shape[0], lons.shape[-1]))) - 1)
 
-            for i, level in enumerate(levels):
-                if float(level) == float(pressure_level):
-                    level_index = i
-                    print(f"✓ Found {pressure_level} hPa at index {i}")
-                    break
+    return [overview_level(z, y, resolution, max_level) for y in ys]
 
-            if level_index is None:
-                level_index = np.argmin(
-                    np.abs(levels.astype(float) - float(pressure_level)))
-                print(
-                    f"! Using closest: index {level_index}, level {levels[level_index]} hPa")
 
-            tile_data = get_tile_data(
-                ds, variable, x, y, z, time_idx=time_index, level_index=level_index,)
+def overview_runs(ys, levels) -> List[Tuple[int, List[int]]]:
+    """Подряд идущие строки тайлов с одинаковым уровнем пирамиды: [(уровень, ys)]"""
+    runs: List[Tuple[int, List[int]]] = []
 
-            if 'valid_time' in var.dims:
-                level_data = var.isel(
-                    valid_time=time_index, pressure_level=level_index).values
-            else:
-                level_data = var.isel(pressure_level=level_index).values
+    for y, level in zip(ys, levels):
+        if runs and runs[-1][0] == level:
+            runs[-1][1].append(y)
+        else:
+            runs.append((level, [y]))
 
-            vmin = np.nanpercentile(level_data, 2)
-            vmax = np.nanpercentile(level_data, 98)
+    return runs
 
-            print(
-                f"Geopotential at {pressure_level}hPa: {vmin:.2f} - {vmax:.2f}")
-            cmap = get_panoply_colormap("NEO_modis_sst_45")
-        else:
-            tile_data = get_tile_data(
-                ds, variable, x, y, z, time_idx=time_index, type=type)
-            vmin, vmax = global_vmin, global_vmax
-            cmap = get_panoply_colormap("NEO_modis_sst_45")
 
-    mask = np.isnan(tile_data)
+def get_overview_grid(lats, lons, signature: str, level: int) -> Tuple[np.ndarray, np.ndarray, str]:
+    """Координаты уровня пирамиды: усреднение 2x2 координат предыдущего уровня"""
+    if level == 0:
+        return lats, lons, signature
 
-    if mask.all():
-        img = Image.new("RGBA", (256, 256), (0, 0, 0, 0))
-    else:
+    grid = OVERVIEW_GRIDS.get((signature, level))
+    if grid is not None:
+        return grid
 
-        if u_vmin is not None:
+    prev_lats, prev_lons, _ = get_overview_grid(lats, lons, signature, level - 1)
+
+    ov_lats, ov_lons = block_average(prev_lats), block_average(prev_lons)
+    grid = (ov_lats, ov_lons, grid_signature(ov_lats, ov_lons))
+
+    with CACHE_LOCK:
+        OVERVIEW_GRIDS[(signature, level)] = grid
+
+    return grid
+
+
+def get_overview_field(ds: xr.Dataset, variable: str, time_index: int, level_index: int,
+                       level: int) -> np.ndarray:
+    """2D срез уровня пирамиды, строится лениво из предыдущего уровня"""
+    if level == 0:
+        return get_field(ds, variable, time_index, level_index)
+
+    def build():
+        data = block_average(
+            get_overview_field(ds, variable, time_index, level_index, level - 1))
+        data.flags.writeable = False
+        return data
+
+    source = field_source(ds, variable)
+    if source is None:
+        return build()
+
+    return FIELD_CACHE.get_or_load(
+        source + (variable, int(time_index), int(level_index), level), build)
+
+
+def stats_variable(ds: xr.Dataset, variable: str) -> str:
+    """Имя переменной, по которой считаются пределы палитры"""
+    for name, (u_name, v_name) in WIND_COMPONENTS.items():
+        if variable in (name, u_name, v_name) and u_name in ds and v_name in ds:
+            return name
+
+    return variable
+
+
+def read_field(ds: xr.Dataset, variable: str, time_index: int = 0, level_index: int = 0,
+               cached: bool = True) -> np.ndarray:
+    """
+    Читает 2D поле переменной, в т.ч. производной скорости ветра.
+    cached=False - мимо FIELD_CACHE (разовый проход по файлу при индексации)
+    """
+    read = get_field if cached else decode_field
+
+    if variable in WIND_COMPONENTS:
+        u_name, v_name = WIND_COMPONENTS[variable]
+        u = read(ds, u_name, time_index, level_index)
+        v = read(ds, v_name, time_index, level_index)
+        return np.sqrt(u**2 + v**2)
+
+    return read(ds, variable, time_index, level_index)
+
+
+def get_field(ds: xr.Dataset, variable: str, time_index: int = 0, level_index: int = 0) -> np.ndarray:
+    """
+    Декодированный 2D срез переменной из FIELD_CACHE.
+    Параллельные промахи по одному срезу читают файл один раз.
+    """
+    source = field_source(ds, variable)
+
+    if source is None or not FIELD_CACHE.max_bytes:
+        return decode_field(ds, variable, time_index, level_index)
+
+    return FIELD_CACHE.get_or_load(
+        source + (variable, int(time_index), int(level_index)),
+        functools.partial(decode_field, ds, variable, time_index, level_index))
+
+
+def field_source(ds: xr.Dataset, variable: str) -> Optional[Tuple[str, float]]:
+    """
+    Начало ключа FIELD_CACHE: файл и его mtime при открытии. Файл мог быть
+    закрыт вытеснением и перезаписан - тогда срезы старой версии уже не
+    совпадут по ключу, даже если on_invalidate для них не вызывался
+    """
+    encoding = ds[variable].encoding
+    source = encoding.get("source")
+    if source is None:
+        return None
+
+    return source, encoding.get("mtime")
+
+
+def compute_variable_stats(ds, variable, time_index, level_index):
+    return field_percentiles(
+        read_field(ds, stats_variable(ds, variable), time_index, level_index))
+
+
+def make_no_data_tile(text: str = "Нет данных") -> bytes:
+    img = Image.new("RGBA", (256, 256), (240, 240, 240, 255))
+    draw = ImageDraw.Draw(img)
+
+    font = get_font()
+
+    bbox = draw.textbbox((0, 0), text, font=font)
+    w, h = bbox[2] - bbox[0], bbox[3] - bbox[1]
+
+    draw.text(((256 - w) / 2, (256 - h) / 2),
+              text, fill=(80, 80, 80), font=font)
+
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
+
+
+def tile_cache_key(ds_file: DatasetMatch, variable, time_index, pressure_level,
+                   z, x, y, u_vmin=None, u_vmax=None) -> tuple:
+    return (ds_file.file_path, ds_file.last_modified, variable, time_index,
+            pressure_level, z, x, y, u_vmin, u_vmax)
+
+
+def make_etag(ds_file: DatasetMatch, *params) -> str:
+    """
+    ETag по версии файла, шагу времени из каталога и параметрам рендера.
+    Считается без чтения данных: уровень и пределы входят как в запросе
+    """
+    time_key = ds_file.time_index if ds_file.time_index is not None else str(ds_file.time_value)
+    key = repr((RENDER_VERSION, RENDER_SETTINGS, ds_file.file_path, ds_file.last_modified,
+                time_key) + params)
+
+    return '"' + hashlib.blake2b(key.encode(), digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def cache_headers(ds_file: DatasetMatch, etag: str) -> Dict[str, str]:
+    """ETag и Cache-Control: исторические шаги времени неизменны"""
+    age = pd.Timestamp.now() - pd.Timestamp(ds_file.time_value)
+
+    if age > pd.Timedelta(days=HTTP_IMMUTABLE_AFTER_DAYS):
+        cache_control = f"public, max-age={HTTP_IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        cache_control = f"public, max-age={HTTP_MAX_AGE}"
+
+    return {"ETag": etag, "Cache-Control": cache_control}
+
+
+def tile_layer(ds_file: DatasetMatch, variable, time_index, pressure_level,
+               u_vmin=None, u_vmax=None) -> str:
+    """
+    Слой в TILE_STORE: версия и настройки рендера, полный путь и версия
+    файла, переменная, время, уровень и пределы палитры
+    """
+    version = (f"v{RENDER_VERSION}-{RENDER_SETTINGS}:"
+               f"{ds_file.file_path}@{ds_file.last_modified:.0f}")
+    limits = f"{'' if u_vmin is None else u_vmin}:{'' if u_vmax is None else u_vmax}"
+
+    return f"{version}/{variable}/{time_index}/{pressure_level}/{limits}"
+
+
+def metatile_block(z: int, x: int, y: int) -> Tuple[List[int], List[int]]:
+    """Блок n x n (n = METATILE_SIZE), содержащий тайл, без запрещенных столбцов"""
+    n = min(METATILE_SIZE, 2 ** z)
+    x0, y0 = x - x % n, y - y % n
+
+    xs = [tx for tx in range(x0, x0 + n) if is_tile_allowed(z, tx, y)]
+    ys = list(range(y0, y0 + n))
+
+    return xs, ys
+
+
+def render_tiles(ds, variable, z, xs, ys, time_index, level_index,
+                 vmin, vmax) -> Dict[Tuple[int, int], bytes]:
+    """
+    Рендер блока тайлов xs x ys одного зума за один проход:
+    одно чтение окна, одна выборка и одна раскраска, затем нарезка на PNG
+    """
+    wind = stats_variable(ds, variable)
+    u_data = v_data = None
+
+    if wind in WIND_COMPONENTS:
+        u_name, v_name = WIND_COMPONENTS[wind]
+
+        u_data = get_block_data(
+            ds, u_name, z, xs, ys, time_idx=time_index, level_index=level_index)
+        v_data = get_block_data(
+            ds, v_name, z, xs, ys, time_idx=time_index, level_index=level_index)
+
+        block = np.sqrt(u_data**2 + v_data**2)
+    else:
+        block = get_block_data(
+            ds, variable, z, xs, ys, time_idx=time_index, level_index=level_index)
+
+    draw_arrows = variable in ["u", "u10"]
+
+    return encode_block_tiles(
+        block, xs, ys, vmin, vmax,
+        u_data=u_data if draw_arrows else None,
+        v_data=v_data if draw_arrows else None,
+        palette_mode=TILE_PNG_MODE == "palette")
+
+
+def render_tiles_in_process(ds_file: DatasetMatch, ds, variable, z, xs, ys,
+                            time_index, level_index, vmin, vmax) -> Dict[Tuple[int, int], bytes]:
+    """
+    Рендер блока тайлов в пуле процессов: полные срезы полей и координаты
+    сетки кладутся в разделяемую память и закрепляются на время рендера
+    """
+    wind = stats_variable(ds, variable)
+    names = WIND_COMPONENTS[wind] if wind in WIND_COMPONENTS else (variable,)
+
+    lats, lons, signature = get_grid(ds[names[0]])
+
+    runs = overview_runs(ys, select_overview(lats, lons, signature, z, ys))
+    if len(runs) > 1:
+        tiles = {}
+        for _, run in runs:
+            tiles.update(render_tiles_in_process(
+                ds_file, ds, variable, z, xs, run, time_index, level_index, vmin, vmax))
+        return tiles
+
+    overview = runs[0][0]
+    if overview:
+        lats, lons, signature = get_overview_grid(lats, lons, signature, overview)
+
+    acquired = []
+
+    def acquire(key, loader):
+        desc = SHARED_FIELDS.acquire(key, loader)
+        acquired.append(key)
+        return desc
+
+    try:
+        fields = tuple(
+            acquire((ds_file.file_path, ds_file.last_modified, name, time_index, level_index, overview),
+                    functools.partial(get_overview_field, ds, name, time_index, level_index, overview))
+            for name in names
+        )
+
+        task = RenderTask(
+            fields=fields,
+            lats=acquire(("grid", signature, "latitude"), lambda: lats),
+            lons=acquire(("grid", signature, "longitude"), lambda: lons),
+            signature=signature,
+            z=z, xs=xs, ys=ys,
+            vmin=vmin, vmax=vmax,
+            draw_arrows=variable in ["u", "u10"],
+            palette_mode=TILE_PNG_MODE == "palette",
+            remap_max_dist=REMAP_MAX_DIST * 2 ** overview,
+            remap_index_dir=REMAP_INDEX_DIR,
+        )
+
+        return RENDER_PROCESS_EXECUTOR.submit(render_block, task).result()
+    finally:
+        for key in acquired:
+            SHARED_FIELDS.release(key)
+
+
+def render_tile_block(ds_file: DatasetMatch, ds, variable, z, xs, ys,
+                      time_index, level_index, vmin, vmax) -> Dict[Tuple[int, int], bytes]:
+    """Рендер блока тайлов выбранным в RENDER_BACKEND бэкендом"""
+    if RENDER_PROCESS_EXECUTOR is not None:
+        return render_tiles_in_process(ds_file, ds, variable, z, xs, ys,
+                                       time_index, level_index, vmin, vmax)
+
+    return render_tiles(ds, variable, z, xs, ys, time_index, level_index, vmin, vmax)
+
+
+async def render_and_store_tiles(ds_file: DatasetMatch, ds, variable, z, xs, ys,
+                                 time_index, level_index, pressure_level, vmin, vmax,
+                                 u_vmin=None, u_vmax=None,
+                                 memory_cache=True) -> Dict[Tuple[int, int], bytes]:
+    """Рендер блока тайлов и запись в TILE_CACHE и TILE_STORE"""
+    tiles = await run_in_render_pool(
+        render_tile_block, ds_file, ds, variable, z, xs, ys,
+        time_index, level_index, vmin, vmax)
+
+    if memory_cache:
+        for (tx, ty), png in tiles.items():
+            TILE_CACHE.put(
+                tile_cache_key(ds_file, variable, time_index, pressure_level,
+                               z, tx, ty, u_vmin, u_vmax),
+                png
+            )
+
+    if TILE_STORE is not None:
+        await run_in_render_pool(
+            TILE_STORE.put_many,
+            tile_layer(ds_file, variable, time_index, pressure_level, u_vmin, u_vmax),
+            z, tiles)
+
+    return tiles
+
+
+# Блоки тайлов в рендере: (слой, z, x0, y0) -> задача рендера
+BLOCK_RENDERS: Dict[tuple, asyncio.Future] = {}
+
+
+async def render_block_once(key: tuple, render) -> Dict[Tuple[int, int], bytes]:
+    """
+    Рендер блока, общий для одновременных запросов: первый запрос запускает
+    render(), остальные ждут его результат. Отключение одного клиента
+    не отменяет рендер для остальных
+    """
+    task = BLOCK_RENDERS.get(key)
+
+    if task is None:
+        task = asyncio.ensure_future(render())
+        BLOCK_RENDERS[key] = task
+        task.add_done_callback(lambda _: BLOCK_RENDERS.pop(key, None))
+
+    return await asyncio.shield(task)
+
+
+@app.get("/tile/{z}/{x}/{y}")
+async def tile(variable: str, time: str, z: int, x: int, y: int, pressure_level: int = 850, type: str = "era5", u_vmin: Optional[float] = None,
+               u_vmax: Optional[float] = None, if_none_match: Optional[str] = Header(None)):
+    logger.info(
+        f"[Tile]: variable={variable}, time={time}, pressure_level={pressure_level}, type={type}")
+
+    if (is_tile_allowed(z, x, y) == False):
+        return Response(
+
+        )
+
+    time = pd.to_datetime(time, format='%m/%d/%Y %H:%M')
+
+    time_tolerance_hours = 1
+
+    if type == "carra":
+        time_tolerance_hours = 3
+
+    ds_file = await find_matching_dataset_by_time(
+        time, dataset_type=type, time_tolerance_hours=time_tolerance_hours)
+
+    if ds_file is None or variable is None:
+        logger.error(
+            f"[Tile] No data found: variable={variable}, time={time}, pressure_level={pressure_level}, type={type}")
+        return Response(
+            content=make_no_data_tile(),
+            media_type="image/png"
+        )
+
+    headers = cache_headers(ds_file, make_etag(
+        ds_file, "tile", variable, pressure_level, z, x, y, u_vmin, u_vmax))
+
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    filename = ds_file.data_path
+
+    ds = await run_in_render_pool(get_cached_dataset, filename)
+
+    if variable in WIND_COMPONENTS:
+        var = ds[WIND_COMPONENTS[variable][0]]
+    else:
+        var = ds[variable]
+
+    time_index = resolve_time_index(ds_file, ds, time)
+    level_index = resolve_level_index(ds_file, ds, var, pressure_level)
+
+    # Уровень не влияет на тайл переменной без уровней давления
+    if 'pressure_level' not in var.dims:
+        pressure_level = None
+
+    cache_key = tile_cache_key(ds_file, variable, time_index, pressure_level,
+                               z, x, y, u_vmin, u_vmax)
+
+    cached = TILE_CACHE.get(cache_key)
+    if cached is not None:
+        return Response(cached, media_type="image/png", headers=headers)
+
+    if TILE_STORE is not None:
+        stored = await run_in_render_pool(
+            TILE_STORE.get,
+            tile_layer(ds_file, variable, time_index, pressure_level, u_vmin, u_vmax),
+            z, x, y)
+
+        if stored is not None:
+            TILE_CACHE.put(cache_key, stored)
+            return Response(stored, media_type="image/png", headers=headers)
+
+    vmin, vmax = await get_variable_stats(
+        ds_file, ds, variable, time_index, level_index)
+
+    if u_vmin is not None:
+        vmin = float(u_vmin)
+
+    if u_vmax is not None:
+        vmax = float(u_vmax)
+
+    # В режиме метатайлов рендерится весь блок n x n, содержащий тайл.
+    # Соседние тайлы, запрошенные одновременно, ждут тот же рендер
+    xs, ys = metatile_block(z, x, y)
+    block_key = (tile_layer(ds_file, variable, time_index, pressure_level, u_vmin, u_vmax),
+                 z, xs[0], ys[0])
+
+    tiles = await render_block_once(block_key, lambda: render_and_store_tiles(
+        ds_file, ds, variable, z, xs, ys, time_index, level_index,
+        pressure_level, vmin, vmax, u_vmin, u_vmax))
+
+    return Response(tiles[(x, y)], media_type="image/png", headers=headers)
+
+
+class TileBatchRequest(BaseModel):
+    variable: str
+    time: str
+    pressure_level: int = 850
+    type: str = "era5"
+    u_vmin: Optional[float] = None
+    u_vmax: Optional[float] = None
+    # [[z, x, y], ...]
+    tiles: List[Tuple[int, int, int]]
+
+
+# Заголовок записи ответа /tiles: z, x, y и длина PNG (little-endian).
+# Длина 0 - тайл вне разрешенной области
+TILE_RECORD = struct.Struct("<BIII")
+
+# Максимум тайлов в одном запросе /tiles
+TILE_BATCH_MAX = env.int("TILE_BATCH_MAX", 256)
+
+# Тайлы запроса группируются в блоки n x n, рендерящиеся за раз
+TILE_BATCH_BLOCK = env.int("TILE_BATCH_BLOCK", 4)
+
+# Наибольший масштаб тайла в /tiles (x и y должны помещаться в uint32 TILE_RECORD)
+TILE_MAX_ZOOM = env.int("TILE_MAX_ZOOM", 22)
+
+
+def tile_record(z: int, x: int, y: int, png: bytes) -> bytes:
+    return TILE_RECORD.pack(z, x, y, len(png)) + png
+
+
+def is_valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= TILE_MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def batch_render_groups(tiles) -> Dict[Tuple[int, Tuple[int, ...], Tuple[int, ...]], List[Tuple[int, int, int]]]:
+    """
+    Прямоугольники (z, xs, ys) для рендера тайлов tiles. Внутри блока
+    TILE_BATCH_BLOCK x TILE_BATCH_BLOCK строки с одинаковым набором x
+    объединяются, поэтому рендерятся только запрошенные тайлы
+    """
+    rows: Dict[Tuple[int, int, int, int], set] = {}
+    for z, x, y in tiles:
+        rows.setdefault((z, x // TILE_BATCH_BLOCK, y // TILE_BATCH_BLOCK, y), set()).add(x)
+
+    rects: Dict[Tuple[int, int, int, Tuple[int, ...]], List[int]] = {}
+    for (z, bx, by, y), xs in rows.items():
+        rects.setdefault((z, bx, by, tuple(sorted(xs))), []).append(y)
+
+    return {
+        (z, xs, tuple(sorted(ys))): [(z, x, y) for y in ys for x in xs]
+        for (z, _, _, xs), ys in rects.items()
+    }
+
+
+@app.post("/tiles")
+async def tiles_batch(request: TileBatchRequest):
+    """
+    Пакет тайлов одной переменной, времени и уровня.
+    Датасет и пределы палитры определяются один раз, недостающие тайлы
+    рендерятся блоками. Ответ - поток записей TILE_RECORD + PNG в порядке
+    запроса
+    """
+    logger.info(
+        f"[Tiles]: variable={request.variable}, time={request.time}, "
+        f"pressure_level={request.pressure_level}, type={request.type}, tiles={len(request.tiles)}")
+
+    if len(request.tiles) > TILE_BATCH_MAX:
+        raise HTTPException(
+            status_code=413, detail=f"Не более {TILE_BATCH_MAX} тайлов в запросе")
+
+    # Проверка до начала ответа: неверный тайл не должен обрывать поток
+    invalid = [list(tile) for tile in request.tiles if not is_valid_tile(*tile)]
+    if invalid:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Тайлы вне сетки (0 <= z <= {TILE_MAX_ZOOM}, 0 <= x, y < 2^z): {invalid[:10]}")
+
+    variable = request.variable
+    u_vmin, u_vmax = request.u_vmin, request.u_vmax
+    pressure_level = request.pressure_level
+
+    time = pd.to_datetime(request.time, format='%m/%d/%Y %H:%M')
+
+    ds_file = await find_matching_dataset_by_time(
+        time, dataset_type=request.type,
+        time_tolerance_hours=3 if request.type == "carra" else 1)
+
+    requested = [(z, x, y) for z, x, y in request.tiles]
+    allowed = [tile for tile in requested if is_tile_allowed(*tile)]
+
+    if ds_file is None:
+        logger.error(
+            f"[Tiles] No data found: variable={variable}, time={time}, type={request.type}")
+        no_data = make_no_data_tile()
+        tiles = {tile: no_data for tile in allowed}
+
+        return StreamingResponse(
+            iter([tile_record(*tile, tiles.get(tile, b"")) for tile in requested]),
+            media_type="application/octet-stream")
+
+    ds = await run_in_render_pool(get_cached_dataset, ds_file.data_path)
+
+    if variable in WIND_COMPONENTS:
+        var = ds[WIND_COMPONENTS[variable][0]]
+    else:
+        var = ds[variable]
+
+    time_index = resolve_time_index(ds_file, ds, time)
+    level_index = resolve_level_index(ds_file, ds, var, pressure_level)
+
+    # Уровень не влияет на тайл переменной без уровней давления
+    if 'pressure_level' not in var.dims:
+        pressure_level = None
+
+    # Готовые тайлы: TILE_CACHE, затем TILE_STORE
+    tiles: Dict[Tuple[int, int, int], bytes] = {}
+    for z, x, y in allowed:
+        cached = TILE_CACHE.get(tile_cache_key(
+            ds_file, variable, time_index, pressure_level, z, x, y, u_vmin, u_vmax))
+        if cached is not None:
+            tiles[(z, x, y)] = cached
+
+    if TILE_STORE is not None:
+        layer = tile_layer(ds_file, variable, time_index, pressure_level, u_vmin, u_vmax)
+        missing_by_zoom: Dict[int, List[Tuple[int, int]]] = {}
+        for z, x, y in allowed:
+            if (z, x, y) not in tiles:
+                missing_by_zoom.setdefault(z, []).append((x, y))
+
+        for z, coords in missing_by_zoom.items():
+            stored = await run_in_render_pool(TILE_STORE.get_many, layer, z, coords)
+            for (x, y), png in stored.items():
+                tiles[(z, x, y)] = png
+                TILE_CACHE.put(tile_cache_key(
+                    ds_file, variable, time_index, pressure_level, z, x, y, u_vmin, u_vmax), png)
+
+    # Недостающие тайлы - прямоугольниками внутри блоков TILE_BATCH_BLOCK x TILE_BATCH_BLOCK
+    groups = batch_render_groups(
+        dict.fromkeys(tile for tile in allowed if tile not in tiles))
+
+    renders: Dict[Tuple[int, int, int], asyncio.Task] = {}
+
+    if groups:
+        vmin, vmax = await get_variable_stats(
+            ds_file, ds, variable, time_index, level_index)
+
+        if u_vmin is not None:
             vmin = float(u_vmin)
 
         if u_vmax is not None:
             vmax = float(u_vmax)
 
-        # защита от деления на 0
-        if vmax <= vmin:
-            vmax = vmin + 1e-6
+        for (z, xs, ys), group in groups.items():
+            task = asyncio.ensure_future(render_and_store_tiles(
+                ds_file, ds, variable, z, list(xs), list(ys), time_index,
+                level_index, pressure_level, vmin, vmax, u_vmin, u_vmax))
+            for tile in group:
+                renders[tile] = task
+
+    async def stream():
+        try:
+            for z, x, y in requested:
+                png = tiles.get((z, x, y))
+
+                if png is None and is_tile_allowed(z, x, y):
+                    block = await renders[(z, x, y)]
+                    png = block[(x, y)]
 
-        norm = (tile_data - vmin) / (vmax - vmin)
-        norm = np.clip(norm, 0, 0.999)
+                yield tile_record(z, x, y, png or b"")
+        finally:
+            # Клиент отключился - недорендеренные блоки не нужны
+            for task in renders.values():
+                task.cancel()
 
-        n_levels = len(cmap.colors)
-        color_indices = np.floor(norm * n_levels).astype(int)
-        color_indices = np.clip(color_indices, 0, n_levels - 1)
+    return StreamingResponse(stream(), media_type="application/octet-stream")
 
-        h, w = tile_data.shape
-        rgba = np.zeros((h, w, 4), dtype=np.uint8)
 
-        for i in range(n_levels):
-            mask_level = (color_indices == i)
-            if np.any(mask_level):
-                color = mcolors.to_rgba(cmap.colors[i])
-                rgba[mask_level] = np.array(color) * 255
+@app.get("/cache/stats")
+async def cache_stats():
+    stats = {
+        "tile": TILE_CACHE.stats(),
+        "datasets": DATASET_CACHE.stats(),
+        "fields": FIELD_CACHE.stats(),
+    }
 
-        rgba[..., 3] = (~mask) * 255
-        img = Image.fromarray(rgba, "RGBA")
+    if TILE_STORE is not None:
+        stats["tile_store"] = TILE_STORE.stats()
 
-    if variable in ["u", "u10"]:
-        img = draw_wind_arrows(img, u_data, v_data, scale=0.7, step=24)
+    if SHARED_FIELDS is not None:
+        stats["shared_fields"] = SHARED_FIELDS.stats()
 
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    return Response(buf.getvalue(), media_type="image/png")
+    return stats
 
 
 @app.get("/legend")
 async def legend(
+    response: Response,
     variable: str,
     time: str,
     pressure_level: int = 850,
     type: str = "era5",
     vmin: Optional[float] = None,
-    vmax: Optional[float] = None
+    vmax: Optional[float] = None,
+    if_none_match: Optional[str] = Header(None)
 ):
     logger.info(
         f"[Legend]: variable={variable}, time={time}, pressure_level={pressure_level}, type={type}, vmin={vmin}, vmax={vmax}")
@@ -939,53 +1995,28 @@ async def legend(
     if ds_file is None:
         return {}
 
-    filename, dataset, _ = ds_file
+    headers = cache_headers(ds_file, make_etag(
+        ds_file, "legend", variable, pressure_level, vmin, vmax))
 
-    async with nc_lock:
-        ds = get_cached_dataset(filename)
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
 
-    # ---- найти time_index ----
-    times = ds[variable].valid_time.values
-    time_index = 0
-    for i, t in enumerate(times):
-        if abs((pd.to_datetime(t) - time).total_seconds()) <= 3600:
-            time_index = i
-            break
-
-    if variable in ["u", "v"] and "u" in ds and "v" in ds:
-
-        if "pressure_level" in ds["u"].dims:
-            levels = ds["u"].pressure_level.values
-            level_index = np.argmin(
-                np.abs(levels.astype(float) - float(pressure_level)))
-
-            u = ds["u"].isel(valid_time=time_index,
-                             pressure_level=level_index).values
-            v = ds["v"].isel(valid_time=time_index,
-                             pressure_level=level_index).values
-        else:
-            u = ds["u"].isel(valid_time=time_index).values
-            v = ds["v"].isel(valid_time=time_index).values
-
-        wind = np.sqrt(u**2 + v**2)
+    response.headers.update(headers)
 
-        auto_vmin = float(np.nanpercentile(wind, 2))
-        auto_vmax = float(np.nanpercentile(wind, 98))
+    filename = ds_file.data_path
 
-    elif variable in ["u10", "v10"] and "u10" in ds and "v10" in ds:
+    ds = await run_in_render_pool(get_cached_dataset, filename)
 
-        u = ds["u10"].isel(valid_time=time_index).values
-        v = ds["v10"].isel(valid_time=time_index).values
-
-        wind = np.sqrt(u**2 + v**2)
+    if variable in WIND_COMPONENTS:
+        var = ds[WIND_COMPONENTS[variable][0]]
+    else:
+        var = ds[variable]
 
-        auto_vmin = float(np.nanpercentile(wind, 2))
-        auto_vmax = float(np.nanpercentile(wind, 98))
+    time_index = resolve_time_index(ds_file, ds, time)
+    level_index = resolve_level_index(ds_file, ds, var, pressure_level)
 
-    else:
-        auto_vmin, auto_vmax = compute_variable_stats(
-            ds, variable, time_index, pressure_level
-        )
+    auto_vmin, auto_vmax = await get_variable_stats(
+        ds_file, ds, variable, time_index, level_index)
 
     # ---- пользовательские пределы имеют приоритет ----
     vmin = float(vmin) if vmin is not None else auto_vmin
@@ -1029,3 +2060,722 @@ async def legend(
         "overflow_color": colors[-1],
         "unit": unit_map.get(variable, "")
     }
+
+
+def sample_point_index(var: xr.DataArray, lat: float, lon: float
+                       ) -> Optional[Tuple[Dict[str, int], Tuple[float, float]]]:
+    """
+    Индексы (для isel) и координаты ближайшего к точке узла сетки:
+    ERA5 - по 1D координатам, CARRA - по KD-дереву узлов.
+    None, если точка вне сетки
+    """
+    lats, lons, signature = get_grid(var)
+
+    if lats.ndim == 2 and lons.ndim == 2:
+        tree = get_remap_tree(signature, lats, lons)
+        dist, idx = tree.query([lat, lon], distance_upper_bound=REMAP_MAX_DIST)
+
+        if not np.isfinite(dist):
+            return None
+
+        row, col = np.unravel_index(idx, lats.shape)
+        return ({var.latitude.dims[0]: int(row), var.latitude.dims[1]: int(col)},
+                (float(lats[row, col]), float(lons[row, col])))
+
+    row = nearest_axis_index(lats, np.array([lat]))[0]
+    col = nearest_axis_index(lons, np.array([lon]))[0]
+
+    if row < 0 or col < 0:
+        return None
+
+    return ({var.latitude.dims[0]: int(row), var.longitude.dims[0]: int(col)},
+            (float(lats[row]), float(lons[col])))
+
+
+def read_point_series(ds: xr.Dataset, variable: str, point: Dict[str, int],
+                      time_indices: List[int], level_index: int) -> np.ndarray:
+    """Значения переменной в узле point на шагах time_indices одним чтением"""
+    var = ds[variable]
+
+    indexers = dict(point)
+    if 'valid_time' in var.dims:
+        indexers['valid_time'] = time_indices
+    if 'pressure_level' in var.dims:
+        indexers['pressure_level'] = level_index
+
+    values = np.asarray(var.isel(indexers).values, dtype=np.float64).ravel()
+
+    if 'valid_time' not in var.dims:
+        values = np.repeat(values, len(time_indices))
+
+    return values
+
+
+def sample_file(ds_file: DatasetMatch, time_indices: List[int], variables: List[str],
+                lat: float, lon: float, pressure_level) -> Tuple[Optional[Tuple[float, float]], Dict[str, np.ndarray]]:
+    """
+    Значения переменных файла в ближайшем к (lat, lon) узле на шагах
+    time_indices. Возвращает координаты узла и {переменная: значения}
+    """
+    ds = get_cached_dataset(ds_file.data_path)
+
+    node = None
+    values: Dict[str, np.ndarray] = {}
+
+    for variable in variables:
+        names = WIND_COMPONENTS.get(variable, (variable,))
+        if not all(name in ds for name in names):
+            continue
+
+        var = ds[names[0]]
+        nearest = sample_point_index(var, lat, lon)
+
+        if nearest is None:
+            values[variable] = np.full(len(time_indices), np.nan)
+            continue
+
+        point, node = nearest
+
+        level_index = resolve_level_index(ds_file, ds, var, pressure_level)
+        series = [read_point_series(ds, name, point, time_indices, level_index) for name in names]
+
+        if len(series) == 2:
+            values[variable] = np.sqrt(series[0]**2 + series[1]**2)
+        else:
+            values[variable] = series[0]
+
+    return node, values
+
+
+def arrow_stream_bytes(columns: Dict[str, list], metadata: Optional[Dict[str, str]] = None) -> bytes:
+    """Таблица в формате Arrow IPC stream"""
+    import pyarrow as pa
+
+    table = pa.table(columns).replace_schema_metadata(metadata)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return sink.getvalue().to_pybytes()
+
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+@app.get("/sample")
+async def sample(
+    lat: float,
+    lon: float,
+    variables: str = "z,u,v,wind_speed",
+    time: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    pressure_level: int = 850,
+    type: str = "era5",
+    format: str = "json"
+):
+    """
+    Значения переменных в ближайшем к точке узле сетки на шаге time
+    или на всех шагах каталога в [start, end]. format: json или arrow
+    """
+    logger.info(
+        f"[Sample]: lat={lat}, lon={lon}, variables={variables}, time={time}, "
+        f"start={start}, end={end}, pressure_level={pressure_level}, type={type}")
+
+    if format not in ("json", "arrow"):
+        raise HTTPException(status_code=400, detail="format: json или arrow")
+
+    names = [v.strip() for v in variables.split(",") if v.strip()]
+
+    if time is not None:
+        time = pd.to_datetime(time, format='%m/%d/%Y %H:%M')
+        tolerance = pd.Timedelta(hours=3 if type == "carra" else 1)
+
+        matches = await find_datasets_in_range(type, time - tolerance, time + tolerance)
+
+        # Ближайший шаг времени (в ERA5 у него может быть несколько файлов)
+        if matches:
+            nearest = min(abs(m.time_value - time) for m in matches)
+            matches = [m for m in matches if abs(m.time_value - time) == nearest]
+    elif start is not None and end is not None:
+        matches = await find_datasets_in_range(
+            type,
+            pd.to_datetime(start, format='%m/%d/%Y %H:%M'),
+            pd.to_datetime(end, format='%m/%d/%Y %H:%M'))
+    else:
+        raise HTTPException(status_code=400, detail="Нужен time или start и end")
+
+    # Шаги времени каждого файла читаются одним запросом к файлу
+    by_file: Dict[str, List[DatasetMatch]] = {}
+    for match in matches:
+        by_file.setdefault(match.file_path, []).append(match)
+
+    results = await asyncio.gather(*[
+        run_in_render_pool(
+            sample_file, rows[0], [m.time_index for m in rows], names, lat, lon, pressure_level)
+        for rows in by_file.values()
+    ])
+
+    node = None
+    series: Dict[pd.Timestamp, Dict[str, float]] = {}
+
+    for rows, (file_node, values) in zip(by_file.values(), results):
+        node = node or file_node
+        for variable, column in values.items():
+            for match, value in zip(rows, column):
+                series.setdefault(match.time_value, {})[variable] = float(value)
+
+    times = sorted(series)
+    columns = {
+        variable: [series[t].get(variable, np.nan) for t in times]
+        for variable in names
+    }
+
+    if format == "arrow":
+        metadata = {"lat": str(lat), "lon": str(lon), "type": type,
+                    "pressure_level": str(pressure_level)}
+        if node is not None:
+            metadata.update(grid_lat=str(node[0]), grid_lon=str(node[1]))
+
+        content = arrow_stream_bytes(
+            {"time": pd.DatetimeIndex(times).values if times else np.array([], "datetime64[ns]"),
+             **{k: np.array(v, dtype=np.float64) for k, v in columns.items()}},
+            metadata)
+        return Response(content, media_type=ARROW_MEDIA_TYPE)
+
+    return {
+        "lat": lat,
+        "lon": lon,
+        "grid_lat": node[0] if node else None,
+        "grid_lon": node[1] if node else None,
+        "pressure_level": pressure_level,
+        "type": type,
+        "times": [t.isoformat() for t in times],
+        "values": {
+            variable: [None if np.isnan(v) else v for v in column]
+            for variable, column in columns.items()
+        },
+    }
+
+
+# Треки ПМЦ: максимум точек в запросе /track и число шагов времени,
+# читающихся одновременно
+TRACK_MAX_POINTS = env.int("TRACK_MAX_POINTS", 100000)
+TRACK_CONCURRENCY = env.int("TRACK_CONCURRENCY", RENDER_WORKERS)
+
+
+def grid_points_index(var: xr.DataArray, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Плоские индексы ближайших к точкам узлов сетки переменной, -1 - вне сетки"""
+    grid_lats, grid_lons, signature = get_grid(var)
+
+    if grid_lats.ndim == 2 and grid_lons.ndim == 2:
+        tree = get_remap_tree(signature, grid_lats, grid_lons)
+        dist, index = tree.query(
+            np.column_stack((lats, lons)), distance_upper_bound=REMAP_MAX_DIST)
+        index[~np.isfinite(dist)] = -1
+        return index
+
+    rows = nearest_axis_index(grid_lats, lats)
+    cols = nearest_axis_index(grid_lons, lons)
+
+    index = rows * len(grid_lons) + cols
+    index[(rows < 0) | (cols < 0)] = -1
+
+    return index
+
+
+async def group_track_points(dataset_type: str, times: pd.DatetimeIndex
+                             ) -> Tuple[List[List[DatasetMatch]], np.ndarray]:
+    """
+    Сопоставляет точкам ближайший шаг времени каталога (в пределах допуска /tile).
+    Возвращает файлы каждого шага и номер шага для каждой точки (-1 - нет данных).
+    Шаги пронумерованы в порядке первой точки
+    """
+    tolerance = pd.Timedelta(hours=3 if dataset_type == "carra" else 1)
+
+    # Без точек (или без валидного времени) окно каталога не определено
+    if not times.notna().any():
+        return [], np.full(len(times), -1)
+
+    matches = await find_datasets_in_range(
+        dataset_type, times.min() - tolerance, times.max() + tolerance)
+
+    files_by_time: Dict[pd.Timestamp, List[DatasetMatch]] = {}
+    for match in matches:
+        files_by_time.setdefault(pd.Timestamp(match.time_value), []).append(match)
+
+    if not files_by_time:
+        return [], np.full(len(times), -1)
+
+    step_times = pd.DatetimeIndex(sorted(files_by_time))
+    nearest = step_times.get_indexer(times, method="nearest", tolerance=tolerance)
+
+    # Перенумерация шагов в порядке первой точки
+    order: Dict[int, int] = {}
+    steps = np.array([
+        order.setdefault(s, len(order)) if s >= 0 else -1 for s in nearest])
+
+    groups = [files_by_time[step_times[s]] for s in order]
+
+    return groups, steps
+
+
+def gather_track_step(files: List[DatasetMatch], variables: List[str],
+                      lats: np.ndarray, lons: np.ndarray, pressure_level,
+                      cached: bool = True) -> np.ndarray:
+    """
+    Значения переменных в точках одного шага времени: по одному
+    срезу на переменную и одна векторная выборка. Массив (точки, переменные).
+    cached=False - срезы читаются мимо FIELD_CACHE
+    """
+    values = np.full((len(lats), len(variables)), np.nan)
+
+    for j, variable in enumerate(variables):
+        names = WIND_COMPONENTS.get(variable, (variable,))
+
+        for ds_file in files:
+            ds = get_cached_dataset(ds_file.data_path)
+            if not all(name in ds for name in names):
+                continue
+
+            var = ds[names[0]]
+            level_index = resolve_level_index(ds_file, ds, var, pressure_level)
+
+            field = read_field(ds, variable, ds_file.time_index, level_index, cached)
+            values[:, j] = gather_remap(field, grid_points_index(var, lats, lons))
+            break
+
+    return values
+
+
+def parse_track_times(values) -> pd.DatetimeIndex:
+    """
+    Время точек трека (ISO 8601) в наивном UTC, как в каталоге.
+    Время с зоной (в т.ч. "Z") переводится в UTC, без зоны - считается UTC.
+    ValueError - если время не разбирается
+    """
+    values = list(values)
+
+    try:
+        times = pd.DatetimeIndex(pd.to_datetime(values, format="ISO8601", utc=True))
+    except (ValueError, TypeError):
+        times = None
+
+    if times is None or times.isna().any():
+        for i, value in enumerate(values):
+            try:
+                if pd.isna(pd.to_datetime(value, format="ISO8601", utc=True)):
+                    raise ValueError
+            except (ValueError, TypeError):
+                raise ValueError(f"точка {i}: {value!r}") from None
+
+        if times is None:
+            raise ValueError("разный формат времени у точек")
+
+    return times.tz_convert(None)
+
+
+async def extract_track(dataset_type: str, times: pd.DatetimeIndex, lats: np.ndarray,
+                        lons: np.ndarray, variables: List[str], pressure_level,
+                        cached: bool = True):
+    """
+    Значения переменных вдоль трека. Точки группируются по шагу времени
+    каталога, каждый шаг читается один раз. Отдает (номер точки, время
+    шага или None, значения) строго в порядке входа, по мере готовности.
+    cached=False - мимо FIELD_CACHE (массовая выгрузка, срезы разовые)
+    """
+    groups, steps = await group_track_points(dataset_type, times)
+
+    async for item in track_values(groups, steps, lats, lons, variables, pressure_level, cached):
+        yield item
+
+
+async def track_values(groups: List[List[DatasetMatch]], steps: np.ndarray, lats: np.ndarray,
+                       lons: np.ndarray, variables: List[str], pressure_level,
+                       cached: bool = True):
+    """Значения по уже сгруппированным точкам (см. extract_track)"""
+    members = [np.flatnonzero(steps == s) for s in range(len(groups))]
+    done = steps < 0
+    values = np.full((len(steps), len(variables)), np.nan)
+
+    def start(s):
+        index = members[s]
+        return asyncio.ensure_future(run_in_render_pool(
+            gather_track_step, groups[s], variables, lats[index], lons[index], pressure_level,
+            cached))
+
+    pending = [start(s) for s in range(min(TRACK_CONCURRENCY, len(groups)))]
+    cursor = 0
+
+    try:
+        for s in range(len(groups)):
+            result = await pending[s]
+
+            if s + TRACK_CONCURRENCY < len(groups):
+                pending.append(start(s + TRACK_CONCURRENCY))
+
+            values[members[s]] = result
+            done[members[s]] = True
+
+            # Шаги идут в порядке первой точки: готов весь префикс до cursor
+            while cursor < len(steps) and done[cursor]:
+                step = steps[cursor]
+                yield cursor, groups[step][0].time_value if step >= 0 else None, values[cursor]
+                cursor += 1
+
+        while cursor < len(steps):
+            yield cursor, None, values[cursor]
+            cursor += 1
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+class TrackRequest(BaseModel):
+    variables: List[str] = ["z", "u", "v", "wind_speed"]
+    pressure_level: int = 850
+    type: str = "era5"
+    # [[time, lat, lon], ...], time в ISO 8601
+    points: List[Tuple[str, float, float]]
+
+
+@app.post("/track")
+async def track(request: TrackRequest):
+    """
+    Значения переменных в точках трека ПМЦ, поток NDJSON
+    (строка на точку, в порядке запроса)
+    """
+    logger.info(
+        f"[Track]: variables={request.variables}, pressure_level={request.pressure_level}, "
+        f"type={request.type}, points={len(request.points)}")
+
+    if len(request.points) > TRACK_MAX_POINTS:
+        raise HTTPException(
+            status_code=413, detail=f"Не более {TRACK_MAX_POINTS} точек в запросе")
+
+    if not request.points:
+        return Response(b"", media_type="application/x-ndjson")
+
+    try:
+        times = parse_track_times(p[0] for p in request.points)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=422, detail=f"Неверное время (ISO 8601): {e}")
+
+    lats = np.array([p[1] for p in request.points], dtype=np.float64)
+    lons = np.array([p[2] for p in request.points], dtype=np.float64)
+
+    # Каталог запрашивается до ответа: ошибка здесь - код ошибки, а не оборванный поток
+    groups, steps = await group_track_points(request.type, times)
+
+    async def stream():
+        async for i, data_time, row in track_values(
+                groups, steps, lats, lons, request.variables, request.pressure_level):
+            record = {
+                "time": request.points[i][0],
+                "lat": lats[i],
+                "lon": lons[i],
+                "data_time": data_time.isoformat() if data_time is not None else None,
+            }
+            record.update(
+                (variable, None if np.isnan(v) else float(v))
+                for variable, v in zip(request.variables, row))
+
+            yield json.dumps(record) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+# Вырезки /subset: форматы, размер кусков при отдаче NetCDF
+# и каталог для временных NetCDF файлов (пусто - системный)
+SUBSET_FORMATS = {
+    "netcdf": ("application/x-netcdf", "nc"),
+    "csv": ("text/csv", "csv"),
+    "arrow": (ARROW_MEDIA_TYPE, "arrow"),
+}
+SUBSET_CHUNK_BYTES = env.int("SUBSET_CHUNK_BYTES", 1024 * 1024)
+SUBSET_TMP_DIR = env.str("SUBSET_TMP_DIR", "")
+
+
+class SubsetSlab(NamedTuple):
+    """Окно сетки одного файла на одном шаге времени и уровне"""
+    ds_file: DatasetMatch
+    time_value: pd.Timestamp
+    level: Optional[float]
+    level_index: int
+    variables: List[str]
+    window: Dict[str, slice]
+    lats: np.ndarray
+    lons: np.ndarray
+    # CARRA: какие узлы окна лежат внутри bbox
+    mask: Optional[np.ndarray]
+
+
+def subset_window(var: xr.DataArray, bbox) -> Optional[Tuple[Dict[str, slice], np.ndarray,
+                                                          np.ndarray, Optional[np.ndarray]]]:
+    """
+    Наименьшее окно индексов сетки, покрывающее bbox, его координаты
+    и маска узлов внутри bbox (для криволинейной сетки). None - bbox вне сетки
+    """
+    west, south, east, north = bbox
+    lats, lons, _ = get_grid(var)
+
+    if lats.ndim == 2 and lons.ndim == 2:
+        inside = (lats >= south) & (lats <= north) & (lons >= west) & (lons <= east)
+        rows = np.flatnonzero(inside.any(axis=1))
+        cols = np.flatnonzero(inside.any(axis=0))
+
+        if not len(rows):
+            return None
+
+        # Копии: срезы-представления держали бы в памяти всю сетку
+        r, c = slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1)
+        return ({var.latitude.dims[0]: r, var.latitude.dims[1]: c},
+                lats[r, c].copy(), lons[r, c].copy(), inside[r, c].copy())
+
+    rows = np.flatnonzero((lats >= south) & (lats <= north))
+    cols = np.flatnonzero((lons >= west) & (lons <= east))
+
+    if not len(rows) or not len(cols):
+        return None
+
+    r, c = slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1)
+    return ({var.latitude.dims[0]: r, var.longitude.dims[0]: c},
+            lats[r].copy(), lons[c].copy(), None)
+
+
+def plan_subset(matches: List[DatasetMatch], variables: List[str], bbox,
+                levels: List[float], windows: Optional[dict] = None) -> List[SubsetSlab]:
+    """
+    Срезы вырезки по файлам каталога: только координаты, без чтения данных.
+    Переменные одного файла с одинаковыми измерениями читаются одним срезом.
+    Окно считается один раз на сетку: windows - (сигнатура, измерения) -> окно,
+    общий для всех файлов вырезки, поэтому срезы делят одни массивы окна
+    """
+    if windows is None:
+        windows = {}
+
+    slabs = []
+
+    for ds_file in matches:
+        ds = get_cached_dataset(ds_file.data_path)
+
+        groups: Dict[bool, List[str]] = {}
+        for variable in variables:
+            names = WIND_COMPONENTS.get(variable, (variable,))
+            if all(name in ds for name in names):
+                groups.setdefault('pressure_level' in ds[names[0]].dims, []).append(variable)
+
+        for has_levels, group in groups.items():
+            var = ds[WIND_COMPONENTS.get(group[0], (group[0],))[0]]
+
+            key = (get_grid(var)[2], var.latitude.dims, var.longitude.dims)
+            if key not in windows:
+                windows[key] = subset_window(var, bbox)
+
+            window = windows[key]
+            if window is None:
+                continue
+
+            if has_levels:
+                file_levels = ds_file.pressure_levels or get_dataset_index(ds_file.data_path, ds).levels
+                indexes = sorted({nearest_level_index(file_levels, level)
+                                  for level in (levels or file_levels)})
+                level_pairs = [(float(file_levels[i]), i) for i in indexes]
+            else:
+                level_pairs = [(None, 0)]
+
+            for level, level_index in level_pairs:
+                slabs.append(SubsetSlab(ds_file, pd.Timestamp(ds_file.time_value),
+                                        level, level_index, group, *window))
+
+    return slabs
+
+
+def read_subset_slab(slab: SubsetSlab) -> Dict[str, np.ndarray]:
+    """Окна переменных среза: по одному чтению гиперслэба на компоненту"""
+    ds = get_cached_dataset(slab.ds_file.data_path)
+    data = {}
+
+    for variable in slab.variables:
+        arrays = []
+        for name in WIND_COMPONENTS.get(variable, (variable,)):
+            var = ds[name]
+
+            indexers = dict(slab.window)
+            if 'valid_time' in var.dims:
+                indexers['valid_time'] = slab.ds_file.time_index
+            if 'pressure_level' in var.dims:
+                indexers['pressure_level'] = slab.level_index
+
+            arrays.append(np.asarray(var.isel(indexers).values, dtype=np.float32))
+
+        data[variable] = np.sqrt(arrays[0]**2 + arrays[1]**2) if len(arrays) == 2 else arrays[0]
+
+    return data
+
+
+def parse_bbox(value: str) -> List[float]:
+    """bbox запад,юг,восток,север; неверный - 422 до начала ответа"""
+    try:
+        area = [float(v) for v in value.split(",")]
+    except ValueError:
+        area = []
+
+    if (len(area) != 4 or not np.all(np.isfinite(area))
+            or area[0] > area[2] or area[1] > area[3] or area[1] < -90 or area[3] > 90):
+        raise HTTPException(
+            status_code=422,
+            detail="bbox: запад,юг,восток,север, запад <= восток, -90 <= юг <= север <= 90")
+
+    return area
+
+
+@app.get("/subset")
+async def subset(
+    variables: str,
+    start: str,
+    end: str,
+    bbox: str = "-180,-90,180,90",
+    levels: str = "",
+    type: str = "era5",
+    format: str = "netcdf"
+):
+    """
+    Вырезка переменных по области (bbox: запад,юг,восток,север), окну
+    времени и уровням давления в NetCDF, CSV или Arrow IPC.
+    Читаются только нужные окна сетки, по одному срезу за раз;
+    при отключении клиента чтение прекращается.
+
+    Потоком по мере чтения отдаются только CSV и Arrow. Для NetCDF
+    заголовки уходят сразу, а тело - только после записи всех срезов
+    во временный файл (HDF5 нельзя отдать по частям до закрытия). Для
+    больших окон за прокси с таймаутом чтения лучше csv или arrow
+    """
+    logger.info(
+        f"[Subset]: variables={variables}, start={start}, end={end}, bbox={bbox}, "
+        f"levels={levels}, type={type}, format={format}")
+
+    if format not in SUBSET_FORMATS:
+        raise HTTPException(
+            status_code=400, detail=f"format: {', '.join(SUBSET_FORMATS)}")
+
+    names = [v.strip() for v in variables.split(",") if v.strip()]
+    area = parse_bbox(bbox)
+    wanted_levels = [float(v) for v in levels.split(",") if v.strip()]
+
+    time_from = pd.to_datetime(start, format='%m/%d/%Y %H:%M')
+    time_to = pd.to_datetime(end, format='%m/%d/%Y %H:%M')
+
+    matches = await find_datasets_in_range(type, time_from, time_to)
+
+    media_type, extension = SUBSET_FORMATS[format]
+    filename = f"subset_{type}_{time_from:%Y%m%d%H%M}_{time_to:%Y%m%d%H%M}.{extension}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+
+    windows: dict = {}
+
+    if format in ("csv", "arrow"):
+        # До ответа планируется только первый файл с данными (для 404),
+        # остальные - по ходу отдачи
+        remaining = iter(matches)
+        first_slabs: List[SubsetSlab] = []
+        for ds_file in remaining:
+            first_slabs = await run_in_render_pool(
+                plan_subset, [ds_file], names, area, wanted_levels, windows)
+            if first_slabs:
+                break
+
+        if not first_slabs:
+            raise HTTPException(status_code=404, detail="Нет данных для вырезки")
+
+        async def planned_slabs():
+            for slab in first_slabs:
+                yield slab
+            for ds_file in remaining:
+                for slab in await run_in_render_pool(
+                        plan_subset, [ds_file], names, area, wanted_levels, windows):
+                    yield slab
+
+    if format == "csv":
+        async def stream():
+            yield csv_header(names)
+            async for slab in planned_slabs():
+                data = await run_in_render_pool(read_subset_slab, slab)
+                yield await run_in_render_pool(csv_chunk, subset_columns(
+                    slab.time_value, slab.level, slab.lats, slab.lons, slab.mask, data, names))
+
+        return StreamingResponse(stream(), media_type=media_type, headers=headers)
+
+    if format == "arrow":
+        async def stream():
+            writer = ArrowStreamWriter(names)
+            async for slab in planned_slabs():
+                data = await run_in_render_pool(read_subset_slab, slab)
+                yield await run_in_render_pool(writer.write, subset_columns(
+                    slab.time_value, slab.level, slab.lats, slab.lons, slab.mask, data, names))
+            yield writer.close()
+
+        return StreamingResponse(stream(), media_type=media_type, headers=headers)
+
+    # NetCDF: файл создается по всем шагам и уровням сразу, поэтому план
+    # строится целиком. У всех срезов должно быть одно окно одной сетки
+    slabs = await run_in_render_pool(plan_subset, matches, names, area, wanted_levels, windows)
+
+    if not slabs:
+        raise HTTPException(status_code=404, detail="Нет данных для вырезки")
+
+    first = slabs[0]
+    if any(slab.lats.shape != first.lats.shape or slab.lons.shape != first.lons.shape
+           or not np.array_equal(slab.lats, first.lats) or not np.array_equal(slab.lons, first.lons)
+           for slab in slabs):
+        raise HTTPException(
+            status_code=400,
+            detail="Для NetCDF переменные должны быть на одной сетке, используйте csv или arrow")
+
+    times = sorted({slab.time_value for slab in slabs})
+    levels_out = sorted({slab.level for slab in slabs if slab.level is not None})
+    level_variables = sorted({v for slab in slabs if slab.level is not None for v in slab.variables})
+
+    async def stream():
+        fd, path = tempfile.mkstemp(suffix=".nc", dir=SUBSET_TMP_DIR or None)
+        os.close(fd)
+
+        # Вызов файла в пуле не прерывается отменой генератора при отключении
+        # клиента: закрывать и удалять файл можно только после его завершения
+        running = None
+
+        async def call(func, *args):
+            nonlocal running
+            running = asyncio.ensure_future(run_in_render_pool(func, *args))
+            return await asyncio.shield(running)
+
+        try:
+            writer = None
+            try:
+                writer = await call(
+                    NetCDFSubsetWriter, path, times, levels_out, first.lats, first.lons,
+                    names, level_variables)
+                for slab in slabs:
+                    data = await run_in_render_pool(read_subset_slab, slab)
+                    await call(writer.write, slab.time_value, slab.level, data)
+            finally:
+                # Отмена области starlette повторяется на каждом await,
+                # поэтому ожидание и закрытие - под щитом
+                with anyio.CancelScope(shield=True):
+                    if running is not None:
+                        await asyncio.wait([running])
+                        # Файл создан уже после отмены
+                        if writer is None and running.exception() is None:
+                            writer = running.result()
+
+                    if writer is not None:
+                        await run_in_render_pool(writer.close)
+
+            with open(path, "rb") as f:
+                while chunk := f.read(SUBSET_CHUNK_BYTES):
+                    yield chunk
+        finally:
+            os.remove(path)
+
+    return StreamingResponse(stream(), media_type=media_type, headers=headers)
@@ -0,0 +1,267 @@
+"""
+Процессный бэкенд рендера тайлов.
+
+Срезы полей (2D массив переменной на шаге времени/уровне) и координаты
+сетки читаются один раз в основном процессе и кладутся в разделяемую
+память (multiprocessing.shared_memory). Воркеры пула процессов
+подключаются к ним по имени без копирования, строят индексы выборки,
+раскрашивают и кодируют PNG вне GIL основного процесса.
+
+Модуль намеренно не импортирует main: воркеры запускаются через spawn
+и не должны поднимать FastAPI, пул БД и логгер.
+"""
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Hashable, List, NamedTuple, Optional, Tuple
+import multiprocessing
+import threading
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from helpers import (encode_block_tiles, gather_regular, gather_remap,
+                     regular_tile_index, remap_tile_index,
+                     read_remap_index, write_remap_index)
+
+
+class SharedArray(NamedTuple):
+    """Описание массива в разделяемой памяти, передаваемое воркеру"""
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+class RenderTask(NamedTuple):
+    # Одно поле или компоненты ветра (u, v)
+    fields: Tuple[SharedArray, ...]
+    lats: SharedArray
+    lons: SharedArray
+    signature: str
+    z: int
+    xs: List[int]
+    ys: List[int]
+    vmin: float
+    vmax: float
+    draw_arrows: bool
+    palette_mode: bool
+    remap_max_dist: float
+    remap_index_dir: str
+
+
+def attach_array(desc: SharedArray) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    """Подключается к блоку разделяемой памяти и возвращает (блок, массив)"""
+    shm = shared_memory.SharedMemory(name=desc.name)
+    return shm, np.ndarray(desc.shape, dtype=np.dtype(desc.dtype), buffer=shm.buf)
+
+
+class SharedArrayStore:
+    """
+    LRU-хранилище массивов в разделяемой памяти на стороне основного процесса.
+
+    acquire() закрепляет блок на время рендера, release() снимает закрепление.
+    При превышении бюджета освобождаются (unlink) только незакрепленные блоки.
+    Параллельные промахи по одному ключу читают данные один раз.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+
+        self._blocks: "OrderedDict[Hashable, Tuple[shared_memory.SharedMemory, SharedArray]]" = OrderedDict()
+        self._pins: Dict[Hashable, int] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self._load_locks: Dict[Hashable, threading.Lock] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def acquire(self, key: Hashable, loader: Callable[[], np.ndarray]) -> SharedArray:
+        desc = self._pin(key)
+        if desc is not None:
+            return desc
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            desc = self._pin(key)
+            if desc is not None:
+                return desc
+
+            data = np.ascontiguousarray(loader())
+
+            shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+            np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)[...] = data
+            desc = SharedArray(shm.name, data.shape, data.dtype.str)
+
+            with self._lock:
+                self._blocks[key] = (shm, desc)
+                self._pins[key] = 1
+                self._size += shm.size
+                self.misses += 1
+                self._load_locks.pop(key, None)
+                self._evict()
+
+        return desc
+
+    def release(self, key: Hashable):
+        with self._lock:
+            if key in self._pins:
+                self._pins[key] -= 1
+            self._evict()
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Освобождает незакрепленные блоки, для которых predicate(key) истинно"""
+        with self._lock:
+            keys = [key for key in self._blocks
+                    if predicate(key) and not self._pins.get(key)]
+            for key in keys:
+                self._unlink(key)
+
+        return len(keys)
+
+    def close(self):
+        with self._lock:
+            for key in list(self._blocks):
+                self._unlink(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._blocks),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "pinned": sum(1 for n in self._pins.values() if n),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _pin(self, key: Hashable) -> Optional[SharedArray]:
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None:
+                return None
+
+            self._blocks.move_to_end(key)
+            self._pins[key] += 1
+            self.hits += 1
+            return block[1]
+
+    def _evict(self):
+        for key in list(self._blocks):
+            if self._size <= self.max_bytes:
+                break
+            if not self._pins.get(key):
+                self._unlink(key)
+                self.evictions += 1
+
+    def _unlink(self, key: Hashable):
+        shm, _ = self._blocks.pop(key)
+        self._pins.pop(key, None)
+        self._size -= shm.size
+        shm.close()
+        shm.unlink()
+
+
+def make_render_executor(max_workers: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+# Кэши воркера: KD-деревья CARRA и индексы выборки по сигнатуре сетки
+_WORKER_TREES: "OrderedDict[str, cKDTree]" = OrderedDict()
+_WORKER_INDEXES: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+_WORKER_TREES_SIZE = 2
+_WORKER_INDEXES_SIZE = 4096
+
+
+def _worker_cache_put(cache: OrderedDict, key, value, size: int):
+    cache[key] = value
+    while len(cache) > size:
+        cache.popitem(last=False)
+
+
+def _worker_remap_index(task: RenderTask, lats, lons, x, y) -> np.ndarray:
+    key = (task.signature, task.z, x, y)
+
+    index = _WORKER_INDEXES.get(key)
+    if index is not None:
+        return index
+
+    index = read_remap_index(task.remap_index_dir, task.signature, task.z, x, y)
+
+    if index is None:
+        tree = _WORKER_TREES.get(task.signature)
+        if tree is None:
+            tree = cKDTree(np.column_stack((lats.ravel(), lons.ravel())))
+            _worker_cache_put(_WORKER_TREES, task.signature, tree, _WORKER_TREES_SIZE)
+
+        index = remap_tile_index(tree, task.z, x, y, task.remap_max_dist)
+        write_remap_index(task.remap_index_dir, task.signature, task.z, x, y, index)
+
+    _worker_cache_put(_WORKER_INDEXES, key, index, _WORKER_INDEXES_SIZE)
+    return index
+
+
+def _worker_regular_index(task: RenderTask, lats, lons, x, y) -> np.ndarray:
+    key = (task.signature, task.z, x, y)
+
+    index = _WORKER_INDEXES.get(key)
+    if index is None:
+        index = regular_tile_index(lats, lons, task.z, x, y)
+        _worker_cache_put(_WORKER_INDEXES, key, index, _WORKER_INDEXES_SIZE)
+
+    return index
+
+
+def render_block(task: RenderTask) -> Dict[Tuple[int, int], bytes]:
+    """Рендер блока тайлов в воркере по полям из разделяемой памяти"""
+    handles = []
+
+    try:
+        def attach(desc):
+            shm, array = attach_array(desc)
+            handles.append(shm)
+            return array
+
+        lats, lons = attach(task.lats), attach(task.lons)
+        fields = [attach(desc) for desc in task.fields]
+
+        # Для CARRA (2D координаты) - выборка по плоским индексам узлов
+        if lats.ndim == 2 and lons.ndim == 2:
+            index = np.block([
+                [_worker_remap_index(task, lats, lons, x, y) for x in task.xs]
+                for y in task.ys
+            ])
+            blocks = [gather_remap(field, index) for field in fields]
+        else:
+            rows = np.concatenate([
+                _worker_regular_index(task, lats, lons, task.xs[0], y)[0]
+                for y in task.ys
+            ])
+            cols = np.concatenate([
+                _worker_regular_index(task, lats, lons, x, task.ys[0])[1]
+                for x in task.xs
+            ])
+            blocks = [gather_regular(field, rows, cols) for field in fields]
+
+        if len(blocks) == 2:
+            u_data, v_data = blocks
+            block = np.sqrt(u_data**2 + v_data**2)
+        else:
+            u_data = v_data = None
+            block = blocks[0]
+
+        return encode_block_tiles(
+            block, task.xs, task.ys, task.vmin, task.vmax,
+            u_data=u_data if task.draw_arrows else None,
+            v_data=v_data if task.draw_arrows else None,
+            palette_mode=task.palette_mode)
+    finally:
+        # Массивы-представления должны умереть до закрытия блоков
+        lats = lons = fields = blocks = None
+        for shm in handles:
+            shm.close()
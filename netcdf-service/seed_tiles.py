@@ -0,0 +1,196 @@
+"""
+Предварительный рендер тайлов в постоянное хранилище (TILE_STORE).
+
+Рендерит все тайлы окна времени, переменных, уровней, области и
+диапазона масштабов тем же кодом, что и /tile. Блоки, все тайлы которых
+уже есть в хранилище, пропускаются, поэтому прерванный запуск можно
+просто повторить. Каталог (таблицы datasets/dataset_times) должен быть
+уже проиндексирован сервисом.
+
+    python seed_tiles.py --type era5 --start "2024-01-01 00:00" --end "2024-01-02 00:00" \\
+        --variables z,u --levels 850,500 --bbox=-30,40,120,85 --zooms 2-6 \\
+        --store tiles.mbtiles
+"""
+from typing import List, Tuple
+import argparse
+import asyncio
+import time
+
+import mercantile
+import pandas as pd
+import psycopg_pool
+
+import main
+from helpers import WIND_COMPONENTS, is_tile_allowed
+from render_pool import SharedArrayStore, make_render_executor
+from tile_store import TileStore
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Предварительный рендер тайлов в TILE_STORE")
+    parser.add_argument("--type", default="era5", help="тип датасета: era5, carra")
+    parser.add_argument("--start", required=True, help="начало окна времени")
+    parser.add_argument("--end", required=True, help="конец окна времени")
+    parser.add_argument("--variables", required=True, help="переменные через запятую")
+    parser.add_argument("--levels", default="850",
+                        help="уровни давления через запятую (для переменных с уровнями)")
+    parser.add_argument("--bbox", default="-180,-85,180,85",
+                        help="область: запад,юг,восток,север")
+    parser.add_argument("--zooms", default="0-5", help="масштабы: 3 или 2-6")
+    parser.add_argument("--block", type=int, default=4,
+                        help="размер блока тайлов, рендерящегося за раз")
+    parser.add_argument("--workers", type=int, default=main.RENDER_WORKERS,
+                        help="число блоков в работе одновременно")
+    parser.add_argument("--store", default=main.TILE_STORE_PATH,
+                        help="путь к базе тайлов (по умолчанию TILE_STORE_PATH)")
+    return parser.parse_args()
+
+
+def parse_zooms(value: str) -> List[int]:
+    start, _, end = value.partition("-")
+    return list(range(int(start), int(end or start) + 1))
+
+
+def tile_blocks(bbox, z: int, size: int) -> List[Tuple[List[int], List[int]]]:
+    """Разрешенные тайлы области на масштабе z, сгруппированные в блоки size x size"""
+    blocks = {}
+
+    for t in mercantile.tiles(*bbox, [z]):
+        if not is_tile_allowed(t.z, t.x, t.y):
+            continue
+
+        xs, ys = blocks.setdefault((t.x // size, t.y // size), (set(), set()))
+        xs.add(t.x)
+        ys.add(t.y)
+
+    return [(sorted(xs), sorted(ys)) for xs, ys in blocks.values()]
+
+
+async def seed_jobs(args, queue: asyncio.Queue) -> int:
+    """Ставит в очередь блоки по всем шагам времени, переменным и уровням"""
+    bbox = [float(v) for v in args.bbox.split(",")]
+    zooms = parse_zooms(args.zooms)
+    variables = [v.strip() for v in args.variables.split(",") if v.strip()]
+    levels = [float(v) for v in args.levels.split(",") if v.strip()]
+
+    ds_files = await main.find_datasets_in_range(
+        args.type, pd.Timestamp(args.start), pd.Timestamp(args.end))
+
+    total = 0
+
+    for ds_file in ds_files:
+        ds = await main.run_in_render_pool(main.get_cached_dataset, ds_file.data_path)
+
+        for variable in variables:
+            name = WIND_COMPONENTS[variable][0] if variable in WIND_COMPONENTS else variable
+            if name not in ds:
+                continue
+
+            var = ds[name]
+            var_levels = levels if 'pressure_level' in var.dims else [None]
+
+            for pressure_level in var_levels:
+                level_index = main.resolve_level_index(
+                    ds_file, ds, var, pressure_level or 0)
+                vmin, vmax = await main.get_variable_stats(
+                    ds_file, ds, variable, ds_file.time_index, level_index)
+
+                layer_level = None if pressure_level is None else int(pressure_level)
+
+                for z in zooms:
+                    for xs, ys in tile_blocks(bbox, z, min(args.block, 2 ** z)):
+                        await queue.put((ds_file, ds, variable, z, xs, ys,
+                                         level_index, layer_level, vmin, vmax))
+                        total += len(xs) * len(ys)
+
+    return total
+
+
+async def seed_worker(queue: asyncio.Queue, progress: dict):
+    while True:
+        job = await queue.get()
+        try:
+            if job is None:
+                return
+
+            ds_file, ds, variable, z, xs, ys, level_index, pressure_level, vmin, vmax = job
+            layer = main.tile_layer(ds_file, variable, ds_file.time_index, pressure_level)
+            coords = [(x, y) for y in ys for x in xs]
+
+            existing = await main.run_in_render_pool(main.TILE_STORE.existing, layer, z, coords)
+
+            if len(existing) == len(coords):
+                progress["skipped"] += len(coords)
+                continue
+
+            try:
+                await main.render_and_store_tiles(
+                    ds_file, ds, variable, z, xs, ys, ds_file.time_index, level_index,
+                    pressure_level, vmin, vmax, memory_cache=False)
+                progress["rendered"] += len(coords)
+            except Exception as e:
+                progress["failed"] += len(coords)
+                print(f"⚠ Ошибка рендера {layer} z={z} x={xs} y={ys}: {e}")
+        finally:
+            queue.task_done()
+
+
+async def report_progress(progress: dict, started: float):
+    while True:
+        await asyncio.sleep(main.INDEX_PROGRESS_SECONDS)
+        print_progress(progress, started)
+
+
+def print_progress(progress: dict, started: float):
+    elapsed = time.perf_counter() - started
+    rate = progress["rendered"] / elapsed if elapsed else 0.0
+
+    print(f"Тайлы: отрендерено {progress['rendered']}, "
+          f"пропущено {progress['skipped']}, ошибок {progress['failed']}, "
+          f"{rate:.1f} тайлов/с")
+
+
+async def seed(args):
+    if not args.store:
+        raise SystemExit("Не задан путь к базе тайлов: --store или TILE_STORE_PATH")
+
+    main.TILE_STORE = TileStore(args.store, main.TILE_STORE_BYTES)
+    main.pool = psycopg_pool.AsyncConnectionPool(main.DB_DSN, open=False)
+    await main.pool.open()
+
+    if main.RENDER_BACKEND == "process":
+        main.RENDER_PROCESS_EXECUTOR = make_render_executor(main.RENDER_PROCESSES)
+        main.SHARED_FIELDS = SharedArrayStore(main.SHARED_FIELDS_BYTES)
+
+    progress = {"rendered": 0, "skipped": 0, "failed": 0}
+    started = time.perf_counter()
+
+    # Очередь ограничена, чтобы не держать в памяти все блоки окна сразу
+    queue: asyncio.Queue = asyncio.Queue(maxsize=args.workers * 4)
+    workers = [asyncio.create_task(seed_worker(queue, progress))
+               for _ in range(args.workers)]
+    reporter = asyncio.create_task(report_progress(progress, started))
+
+    try:
+        total = await seed_jobs(args, queue)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        reporter.cancel()
+
+        main.RENDER_EXECUTOR.shutdown(wait=True)
+        if main.RENDER_PROCESS_EXECUTOR is not None:
+            main.RENDER_PROCESS_EXECUTOR.shutdown(wait=True)
+            main.SHARED_FIELDS.close()
+
+        main.DATASET_CACHE.clear()
+        main.TILE_STORE.close()
+        await main.pool.close()
+
+    print_progress(progress, started)
+    print(f"Готово: {total} тайлов в окне")
+
+
+if __name__ == "__main__":
+    asyncio.run(seed(parse_args()))
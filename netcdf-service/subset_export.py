@@ -0,0 +1,154 @@
+"""
+Запись вырезок (/subset) по частям: CSV, Arrow IPC stream и NetCDF.
+
+Вырезка приходит срезами - окно сетки одного файла на одном шаге
+времени и уровне. CSV и Arrow отдаются клиенту по мере чтения срезов.
+NetCDF требует произвольной записи в файл, поэтому собирается во
+временном файле срез за срезом и отдается кусками только после записи
+последнего среза - до этого клиент получает лишь заголовки ответа.
+В памяти в любой момент один срез.
+"""
+from typing import Dict, List, Optional
+import io
+
+import netCDF4
+import numpy as np
+import pandas as pd
+from xarray.backends.locks import HDF5_LOCK, NETCDFC_LOCK
+
+
+def subset_columns(time_value, level: Optional[float], lats: np.ndarray, lons: np.ndarray,
+                   mask: Optional[np.ndarray], data: Dict[str, np.ndarray],
+                   variables: List[str]) -> Dict[str, np.ndarray]:
+    """
+    Колонки таблицы одного среза: time, pressure_level, latitude, longitude
+    и переменные. mask - узлы криволинейного окна внутри bbox
+    """
+    if lats.ndim == 1:
+        lons, lats = np.meshgrid(lons, lats)
+
+    def select(a):
+        return a[mask] if mask is not None else a.ravel()
+
+    lat = select(lats)
+    n = len(lat)
+
+    columns = {
+        "time": np.full(n, np.datetime64(pd.Timestamp(time_value), "ns")),
+        "pressure_level": np.full(n, np.nan if level is None else level),
+        "latitude": lat.astype(np.float64),
+        "longitude": select(lons).astype(np.float64),
+    }
+
+    for variable in variables:
+        values = data.get(variable)
+        columns[variable] = (select(values) if values is not None
+                             else np.full(n, np.nan, dtype=np.float32))
+
+    return columns
+
+
+def csv_header(variables: List[str]) -> bytes:
+    return (",".join(["time", "pressure_level", "latitude", "longitude"] + variables) + "\n").encode()
+
+
+def csv_chunk(columns: Dict[str, np.ndarray]) -> bytes:
+    return pd.DataFrame(columns).to_csv(
+        index=False, header=False, na_rep="", date_format="%Y-%m-%dT%H:%M:%S").encode()
+
+
+class ArrowStreamWriter:
+    """Arrow IPC stream, отдаваемый по батчу на срез"""
+
+    def __init__(self, variables: List[str]):
+        import pyarrow as pa
+
+        self._pa = pa
+        self.schema = pa.schema(
+            [("time", pa.timestamp("ns")), ("pressure_level", pa.float64()),
+             ("latitude", pa.float64()), ("longitude", pa.float64())]
+            + [(variable, pa.float32()) for variable in variables])
+
+        self._sink = io.BytesIO()
+        self._writer = pa.ipc.new_stream(self._sink, self.schema)
+
+    def write(self, columns: Dict[str, np.ndarray]) -> bytes:
+        self._writer.write_batch(
+            self._pa.RecordBatch.from_pydict(columns, schema=self.schema))
+        return self._drain()
+
+    def close(self) -> bytes:
+        self._writer.close()
+        return self._drain()
+
+    def _drain(self) -> bytes:
+        chunk = self._sink.getvalue()
+        self._sink.seek(0)
+        self._sink.truncate()
+        return chunk
+
+
+class NetCDFSubsetWriter:
+    """
+    NetCDF4 файл вырезки: time x [pressure_level] x окно сетки.
+    Обращения к netCDF4/HDF5 идут под блокировками xarray - библиотека
+    не потокобезопасна, а параллельно идет чтение исходных файлов
+    """
+
+    def __init__(self, path: str, times: List[pd.Timestamp], levels: List[float],
+                 lats: np.ndarray, lons: np.ndarray, variables: List[str],
+                 level_variables: List[str]):
+        self.times = list(times)
+        self.levels = list(levels)
+
+        with NETCDFC_LOCK, HDF5_LOCK:
+            self._ds = netCDF4.Dataset(path, "w", format="NETCDF4")
+            ds = self._ds
+
+            ds.createDimension("time", len(self.times))
+            time_var = ds.createVariable("time", "f8", ("time",))
+            time_var.units = "hours since 1970-01-01 00:00:00"
+            time_var.calendar = "proleptic_gregorian"
+            time_var[:] = netCDF4.date2num(
+                [pd.Timestamp(t).to_pydatetime() for t in self.times], time_var.units,
+                time_var.calendar)
+
+            if self.levels:
+                ds.createDimension("pressure_level", len(self.levels))
+                level_var = ds.createVariable("pressure_level", "f8", ("pressure_level",))
+                level_var.units = "hPa"
+                level_var[:] = self.levels
+
+            if lats.ndim == 1:
+                spatial = ("latitude", "longitude")
+                ds.createDimension("latitude", len(lats))
+                ds.createDimension("longitude", len(lons))
+                ds.createVariable("latitude", "f8", ("latitude",))[:] = lats
+                ds.createVariable("longitude", "f8", ("longitude",))[:] = lons
+            else:
+                spatial = ("y", "x")
+                ds.createDimension("y", lats.shape[0])
+                ds.createDimension("x", lats.shape[1])
+                ds.createVariable("latitude", "f8", spatial)[:] = lats
+                ds.createVariable("longitude", "f8", spatial)[:] = lons
+
+            ds.variables["latitude"].units = "degrees_north"
+            ds.variables["longitude"].units = "degrees_east"
+
+            for variable in variables:
+                dims = ("time",) + (("pressure_level",) if variable in level_variables else ()) + spatial
+                ds.createVariable(variable, "f4", dims, fill_value=np.float32(np.nan))
+
+    def write(self, time_value, level: Optional[float], data: Dict[str, np.ndarray]):
+        t = self.times.index(time_value)
+
+        with NETCDFC_LOCK, HDF5_LOCK:
+            for variable, values in data.items():
+                if level is None:
+                    self._ds.variables[variable][t] = values
+                else:
+                    self._ds.variables[variable][t, self.levels.index(level)] = values
+
+    def close(self):
+        with NETCDFC_LOCK, HDF5_LOCK:
+            self._ds.close()
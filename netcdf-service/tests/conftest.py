@@ -0,0 +1,50 @@
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def tile_client(tmp_path, monkeypatch):
+    """
+    TestClient сервиса без каталога и базы: любое время находит один
+    маленький файл ERA5 (z на сетке 0.25 градуса), пределы палитры -2..2
+    """
+    import main
+    from fastapi.testclient import TestClient
+
+    lats = np.arange(85, 29.99, -0.25)
+    lons = np.arange(-30, 40, 0.25)
+    data = np.random.default_rng(2).standard_normal((1, lats.size, lons.size)).astype(np.float32)
+
+    path = str(tmp_path / "era5.nc")
+    xr.Dataset(
+        {"z": (("valid_time", "latitude", "longitude"), data)},
+        coords={"valid_time": pd.date_range("2020-01-01", periods=1),
+                "latitude": lats, "longitude": lons},
+    ).to_netcdf(path)
+
+    match = main.DatasetMatch(path, pd.Timestamp("2020-01-01"), 0.0, os.path.getmtime(path), 0)
+
+    async def find_matching_dataset_by_time(*args, **kwargs):
+        return match
+
+    async def get_variable_stats(*args, **kwargs):
+        return -2.0, 2.0
+
+    monkeypatch.setattr(main, "find_matching_dataset_by_time", find_matching_dataset_by_time)
+    monkeypatch.setattr(main, "get_variable_stats", get_variable_stats)
+    monkeypatch.setattr(main, "TILE_STORE", None)
+    main.TILE_CACHE.clear()
+
+    # Без with: lifespan (база, слежение за DATA_DIR) не запускается
+    yield TestClient(main.app)
+
+    main.TILE_CACHE.clear()
+    main.DATASET_CACHE.clear()
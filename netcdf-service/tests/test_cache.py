@@ -0,0 +1,150 @@
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import cache as cache_module  # noqa: E402
+from cache import FileHandleCache, SizedLRUCache  # noqa: E402
+
+
+def test_lru_counts_bytes_and_evicts_oldest():
+    cache = SizedLRUCache(10)
+
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    assert cache.stats()["bytes"] == 8
+
+    # Обращение к "a" делает самым старым "b"
+    assert cache.get("a") == b"1234"
+    cache.put("c", b"1234")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1234"
+    assert cache.get("c") == b"1234"
+
+    stats = cache.stats()
+    assert stats["bytes"] == 8
+    assert stats["evictions"] == 1
+
+
+def test_lru_replace_and_oversized_values():
+    cache = SizedLRUCache(10)
+
+    cache.put("a", b"12345678")
+    cache.put("a", b"12")
+    assert cache.stats()["bytes"] == 2
+
+    # Значение больше бюджета не кэшируется и ничего не вытесняет
+    cache.put("big", b"x" * 11)
+    assert cache.get("big") is None
+    assert cache.get("a") == b"12"
+
+    assert cache.invalidate(lambda key: key == "a") == 1
+    assert cache.stats()["bytes"] == 0
+    assert len(cache) == 0
+
+
+def test_get_or_load_coalesces_concurrent_misses():
+    cache = SizedLRUCache(100)
+    calls = []
+    barrier = threading.Barrier(8)
+    results = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return b"value"
+
+    def worker():
+        barrier.wait()
+        results.append(cache.get_or_load("key", loader))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert results == [b"value"] * 8
+    assert cache.get_or_load("key", loader) == b"value"
+    assert len(calls) == 1
+
+
+class Handle:
+    def __init__(self, path):
+        self.path = path
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def make_files(tmp_path, *names):
+    paths = []
+    for name in names:
+        path = tmp_path / name
+        path.write_bytes(b"")
+        paths.append(str(path))
+    return paths
+
+
+def test_file_handles_expire_after_ttl(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+
+    closed = []
+    handles = FileHandleCache(Handle, max_size=3, ttl=60, on_close=closed.append)
+    a, b = make_files(tmp_path, "a.nc", "b.nc")
+
+    first = handles.get(a)
+    handles.get(b)
+    now[0] += 30
+    assert handles.get(a) is first
+
+    # a использовался 30 с назад, b - 60 с назад
+    now[0] += 30
+    assert handles.expire() == 1
+    assert closed == [b]
+    assert not first.closed
+
+    now[0] += 61
+    assert handles.expire() == 1
+    assert first.closed
+    assert len(handles) == 0
+    assert handles.stats()["expirations"] == 2
+
+
+def test_file_handle_reopened_when_mtime_changes(tmp_path):
+    invalidated = []
+    handles = FileHandleCache(Handle, max_size=3, ttl=60, on_invalidate=invalidated.append)
+    (a,) = make_files(tmp_path, "a.nc")
+
+    first = handles.get(a)
+    assert handles.get(a) is first
+
+    mtime = os.path.getmtime(a)
+    os.utime(a, (mtime + 10, mtime + 10))
+
+    second = handles.get(a)
+    assert second is not first
+    assert first.closed
+    assert invalidated == [a]
+    assert handles.stats()["invalidations"] == 1
+
+
+def test_file_handles_evict_least_recently_used(tmp_path):
+    handles = FileHandleCache(Handle, max_size=2, ttl=60)
+    a, b, c = make_files(tmp_path, "a.nc", "b.nc", "c.nc")
+
+    first = handles.get(a)
+    second = handles.get(b)
+    handles.get(a)
+    handles.get(c)
+
+    assert second.closed
+    assert not first.closed
+    assert handles.stats()["evictions"] == 1
@@ -0,0 +1,44 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from scipy.interpolate import RegularGridInterpolator
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from helpers import nearest_axis_index  # noqa: E402
+
+
+def test_nearest_axis_index_ascending_edges_and_ties():
+    coord = np.array([0.0, 1.0, 2.0, 3.0])
+    targets = np.array([-0.1, 0.0, 0.5, 1.49, 1.5, 2.51, 3.0, 3.1])
+
+    # При равном расстоянии - узел с меньшей координатой, вне сетки - -1
+    assert nearest_axis_index(coord, targets).tolist() == [-1, 0, 0, 1, 1, 3, 3, -1]
+
+
+def test_nearest_axis_index_descending_axis():
+    # Широта ERA5 идет с севера на юг
+    coord = np.array([90.0, 89.75, 89.5, 89.25])
+    targets = np.array([90.1, 90.0, 89.875, 89.6, 89.25, 89.2])
+
+    assert nearest_axis_index(coord, targets).tolist() == [-1, 0, 1, 2, 3, -1]
+
+
+@pytest.mark.parametrize("descending", [False, True])
+def test_nearest_axis_index_matches_regular_grid_interpolator(descending):
+    coord = np.arange(-180.0, 180.0, 0.25)
+    if descending:
+        coord = coord[::-1]
+
+    rng = np.random.default_rng(0)
+    # Точки на серединах между узлами проверяют правило равного расстояния
+    targets = np.concatenate([rng.uniform(-179.75, 179.5, 1000), np.arange(-179.875, 179.5, 7.25)])
+
+    order = np.argsort(coord)
+    interpolator = RegularGridInterpolator(
+        (coord[order],), order.astype(float), method="nearest")
+
+    expected = interpolator(targets[:, None]).astype(int)
+    assert np.array_equal(nearest_axis_index(coord, targets), expected)
@@ -0,0 +1,44 @@
+import main
+
+TILE = "/tile/4/8/4?variable=z&time=01/01/2020 00:00"
+
+
+def test_etag_matches():
+    etag = '"abc"'
+
+    assert main.etag_matches(etag, etag)
+    assert main.etag_matches('W/"abc"', etag)
+    assert main.etag_matches('"other", "abc"', etag)
+    assert main.etag_matches("*", etag)
+    assert not main.etag_matches('"other"', etag)
+    assert not main.etag_matches(None, etag)
+
+
+def test_tile_if_none_match_returns_304(tile_client):
+    first = tile_client.get(TILE)
+    etag = first.headers["ETag"]
+
+    assert first.status_code == 200
+    assert first.headers["content-type"] == "image/png"
+    # Шаг 2020 года старше HTTP_IMMUTABLE_AFTER_DAYS
+    assert "immutable" in first.headers["Cache-Control"]
+
+    for header in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        cached = tile_client.get(TILE, headers={"If-None-Match": header})
+        assert cached.status_code == 304
+        assert cached.content == b""
+        assert cached.headers["ETag"] == etag
+
+    stale = tile_client.get(TILE, headers={"If-None-Match": '"other"'})
+    assert stale.status_code == 200
+    assert stale.content == first.content
+
+
+def test_etag_depends_on_tile_and_render_settings(tile_client, monkeypatch):
+    etag = tile_client.get(TILE).headers["ETag"]
+
+    assert tile_client.get("/tile/4/9/4?variable=z&time=01/01/2020 00:00").headers["ETag"] != etag
+    assert tile_client.get(TILE + "&u_vmax=1").headers["ETag"] != etag
+
+    monkeypatch.setattr(main, "RENDER_SETTINGS", "changed")
+    assert tile_client.get(TILE).headers["ETag"] != etag
@@ -0,0 +1,93 @@
+"""
+Тайл, отрендеренный в составе блока (метатайлы, /tiles, seed_tiles),
+должен совпадать побайтно с тем же тайлом, отрендеренным отдельно,
+в том числе когда строкам блока нужны разные уровни пирамиды.
+"""
+import sys
+from pathlib import Path
+
+import mercantile
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+from helpers import is_tile_allowed  # noqa: E402
+
+
+def make_carra(path):
+    """
+    Полоса криволинейной сетки с шагом ~2.5 км поперек границы строк
+    тайлов z=2 и z=3 (66.5 и 79 с.ш.), где строкам нужны разные уровни
+    """
+    rows, cols = np.mgrid[0:600, 0:60].astype(np.float64)
+    lats = 60 + rows * 0.025 + cols * 0.002
+    lons = 4 + cols * 0.06 - rows * 0.004
+
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((1, 600, 60)).astype(np.float32)
+
+    xr.Dataset(
+        {"z": (("valid_time", "y", "x"), data)},
+        coords={"valid_time": pd.date_range("2024-01-01", periods=1),
+                "latitude": (("y", "x"), lats), "longitude": (("y", "x"), lons)},
+    ).to_netcdf(path)
+
+
+def make_era5(path):
+    lats = np.arange(85, 29.99, -0.25)
+    lons = np.arange(-30, 10, 0.25)
+
+    rng = np.random.default_rng(1)
+    data = rng.standard_normal((1, lats.size, lons.size)).astype(np.float32)
+
+    xr.Dataset(
+        {"z": (("valid_time", "latitude", "longitude"), data)},
+        coords={"valid_time": pd.date_range("2024-01-01", periods=1),
+                "latitude": lats, "longitude": lons},
+    ).to_netcdf(path)
+
+
+def blocks(bbox, z, size):
+    groups = {}
+    for t in mercantile.tiles(*bbox, [z]):
+        if is_tile_allowed(t.z, t.x, t.y):
+            xs, ys = groups.setdefault((t.x // size, t.y // size), (set(), set()))
+            xs.add(t.x)
+            ys.add(t.y)
+
+    return [(sorted(xs), sorted(ys)) for xs, ys in groups.values()]
+
+
+@pytest.mark.parametrize("make, bbox, expect_mixed", [
+    (make_carra, (1, 60, 8, 75), True),
+    (make_era5, (0, 50, 10, 80), False),
+])
+def test_block_tiles_equal_single_tiles(tmp_path, monkeypatch, make, bbox, expect_mixed):
+    monkeypatch.setattr(main, "OVERVIEW_MAX_LEVEL", 5)
+    monkeypatch.setattr(main, "REMAP_INDEX_DIR", "")
+
+    path = str(tmp_path / "data.nc")
+    make(path)
+
+    with xr.open_dataset(path, engine="netcdf4", chunks={}) as ds:
+        lats, lons, signature = main.get_grid(ds["z"])
+        mixed = 0
+
+        for z in range(2, 5):
+            for xs, ys in blocks(bbox, z, 4):
+                levels = main.select_overview(lats, lons, signature, z, ys)
+                mixed += len(set(levels)) > 1
+
+                block = main.render_tiles(ds, "z", z, xs, ys, 0, 0, -2.0, 2.0)
+
+                for (x, y), png in block.items():
+                    single = main.render_tiles(ds, "z", z, [x], [y], 0, 0, -2.0, 2.0)
+                    assert single[(x, y)] == png, (z, x, y)
+
+        # На CARRA уровень меняется от строки к строке внутри блока
+        if expect_mixed:
+            assert mixed
@@ -0,0 +1,50 @@
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import tile_store  # noqa: E402
+from tile_store import PRUNE_TARGET_FRACTION, TileStore  # noqa: E402
+
+
+def fill(store, monkeypatch, count, size=16 * 1024):
+    """count тайлов z=10 по size байт, i-й записан в момент i"""
+    for i in range(count):
+        monkeypatch.setattr(tile_store.time, "time", lambda i=i: float(i))
+        store.put_many("layer", 10, {(i, 0): os.urandom(size)})
+
+
+def test_prune_keeps_newest_tiles_within_target(tmp_path, monkeypatch):
+    store = TileStore(str(tmp_path / "tiles.mbtiles"))
+    fill(store, monkeypatch, 64)
+
+    store.max_bytes = 512 * 1024
+    assert store.size() > store.max_bytes
+
+    deleted = store.prune()
+
+    assert deleted > 0
+    assert store.size() <= store.max_bytes * PRUNE_TARGET_FRACTION
+
+    coords = [(i, 0) for i in range(64)]
+    kept = store.existing("layer", 10, coords)
+
+    # Удалены самые старые: остался непрерывный хвост последних записей
+    assert kept == set(coords[64 - len(kept):])
+    assert store.stats()["pruned"] == deleted
+
+    # База уже в пределах - повторная очистка ничего не удаляет
+    assert store.prune() == 0
+    store.close()
+
+
+def test_put_many_prunes_when_over_budget(tmp_path, monkeypatch):
+    store = TileStore(str(tmp_path / "tiles.mbtiles"), max_bytes=512 * 1024)
+    fill(store, monkeypatch, 64)
+
+    # Размер проверяется каждые PRUNE_CHECK_FRACTION от max_bytes записанного
+    assert store.size() <= store.max_bytes + 2 * 16 * 1024
+    assert store.get("layer", 10, 63, 0) is not None
+    assert store.get("layer", 10, 0, 0) is None
+    store.close()
@@ -0,0 +1,57 @@
+import main
+
+TIME = "01/01/2020 00:00"
+
+
+def read_records(content: bytes):
+    records, offset = [], 0
+
+    while offset < len(content):
+        z, x, y, length = main.TILE_RECORD.unpack_from(content, offset)
+        offset += main.TILE_RECORD.size
+        records.append(((z, x, y), content[offset:offset + length]))
+        offset += length
+
+    return records
+
+
+def test_batch_render_groups_render_only_requested_tiles():
+    # Диагональ блока - два тайла, а не весь блок 4x4
+    groups = main.batch_render_groups([(5, 16, 8), (5, 19, 11)])
+    assert sorted(groups) == [(5, (16,), (8,)), (5, (19,), (11,))]
+
+    # Строки с одинаковым набором x объединяются в прямоугольник
+    tiles = [(5, 16, 8), (5, 17, 8), (5, 16, 9), (5, 17, 9), (5, 16, 10)]
+    groups = main.batch_render_groups(tiles)
+    assert groups == {
+        (5, (16, 17), (8, 9)): [(5, 16, 8), (5, 17, 8), (5, 16, 9), (5, 17, 9)],
+        (5, (16,), (10,)): [(5, 16, 10)],
+    }
+    assert sorted(t for group in groups.values() for t in group) == sorted(tiles)
+
+
+def test_batch_matches_single_tiles(tile_client):
+    tiles = [[4, 8, 4], [4, 9, 4], [5, 17, 9], [5, 19, 11], [4, 8, 5], [4, 0, 4]]
+
+    response = tile_client.post("/tiles", json={"variable": "z", "time": TIME, "tiles": tiles})
+    assert response.status_code == 200
+
+    records = read_records(response.content)
+    assert [list(tile) for tile, _ in records] == tiles
+
+    for (z, x, y), png in records:
+        main.TILE_CACHE.clear()
+        single = tile_client.get(f"/tile/{z}/{x}/{y}?variable=z&time={TIME}")
+
+        if main.is_tile_allowed(z, x, y):
+            assert png == single.content, (z, x, y)
+        else:
+            # Тайл вне разрешенной области - запись нулевой длины
+            assert png == b""
+
+
+def test_batch_rejects_tiles_outside_grid(tile_client):
+    for tile in ([2, 4, 0], [2, 0, -1], [main.TILE_MAX_ZOOM + 1, 0, 0]):
+        response = tile_client.post(
+            "/tiles", json={"variable": "z", "time": TIME, "tiles": [[2, 1, 1], tile]})
+        assert response.status_code == 422, tile
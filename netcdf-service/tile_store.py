@@ -0,0 +1,248 @@
+"""
+Постоянное хранилище готовых PNG тайлов в SQLite в раскладке MBTiles.
+
+Одна база хранит много слоев: слой (layer) - версия файла данных,
+переменная, шаг времени, уровень давления и пределы палитры.
+Строки тайлов хранятся в схеме TMS (tile_row = 2^z - 1 - y), как в MBTiles.
+
+База открывается в режиме WAL: читатели не блокируют писателей, и одну
+базу могут делить несколько воркеров uvicorn на одном хосте. Размер
+ограничивается max_bytes: при превышении удаляются самые старые тайлы.
+"""
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import sqlite3
+import threading
+import time
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+
+CREATE TABLE IF NOT EXISTS tiles (
+    layer TEXT NOT NULL,
+    zoom_level INTEGER NOT NULL,
+    tile_column INTEGER NOT NULL,
+    tile_row INTEGER NOT NULL,
+    tile_data BLOB NOT NULL,
+    created_at REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (layer, zoom_level, tile_column, tile_row)
+) WITHOUT ROWID;
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS tiles_created_at ON tiles (created_at);
+"""
+
+# Доля max_bytes, после записи которой проверяется размер базы
+PRUNE_CHECK_FRACTION = 0.05
+
+# До какой доли max_bytes сокращается база при очистке
+PRUNE_TARGET_FRACTION = 0.9
+
+METADATA = {
+    "name": "netcdf-service",
+    "format": "png",
+    "type": "overlay",
+    "scheme": "tms",
+}
+
+
+def tms_row(z: int, y: int) -> int:
+    return (1 << z) - 1 - y
+
+
+class TileStore:
+    """
+    Потокобезопасная обертка над SQLite базой тайлов:
+    у каждого потока свое соединение. max_bytes = 0 - без ограничения размера
+    """
+
+    def __init__(self, path: str, max_bytes: int = 0):
+        self.path = path
+        self.max_bytes = max_bytes
+
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._written = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.pruned = 0
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+
+        with conn:
+            conn.executescript(SCHEMA)
+
+            # Базы, созданные до появления created_at
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(tiles)")}
+            if "created_at" not in columns:
+                conn.execute(
+                    "ALTER TABLE tiles ADD COLUMN created_at REAL NOT NULL DEFAULT 0")
+
+            conn.executescript(INDEXES)
+            conn.executemany(
+                "INSERT OR IGNORE INTO metadata (name, value) VALUES (?, ?)",
+                METADATA.items())
+
+    def get(self, layer: str, z: int, x: int, y: int) -> Optional[bytes]:
+        row = self._connect().execute("""
+            SELECT tile_data FROM tiles
+            WHERE layer=? AND zoom_level=? AND tile_column=? AND tile_row=?
+        """, (layer, z, x, tms_row(z, y))).fetchone()
+
+        with self._lock:
+            if row:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        return row[0] if row else None
+
+    def get_many(self, layer: str, z: int,
+                 coords: Iterable[Tuple[int, int]]) -> Dict[Tuple[int, int], bytes]:
+        """Найденные в хранилище тайлы из coords"""
+        conn = self._connect()
+        found = {}
+
+        for x, y in coords:
+            row = conn.execute("""
+                SELECT tile_data FROM tiles
+                WHERE layer=? AND zoom_level=? AND tile_column=? AND tile_row=?
+            """, (layer, z, x, tms_row(z, y))).fetchone()
+
+            if row:
+                found[(x, y)] = row[0]
+
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(coords) - len(found)
+
+        return found
+
+    def put_many(self, layer: str, z: int, tiles: Dict[Tuple[int, int], bytes]):
+        conn = self._connect()
+        now = time.time()
+
+        with conn:
+            conn.executemany("""
+                INSERT OR REPLACE INTO tiles
+                (layer, zoom_level, tile_column, tile_row, tile_data, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [(layer, z, x, tms_row(z, y), png, now) for (x, y), png in tiles.items()])
+
+        if not self.max_bytes:
+            return
+
+        with self._lock:
+            self._written += sum(len(png) for png in tiles.values())
+            check = self._written >= self.max_bytes * PRUNE_CHECK_FRACTION
+            if check:
+                self._written = 0
+
+        if check:
+            self.prune()
+
+    def existing(self, layer: str, z: int, coords: Iterable[Tuple[int, int]]) -> Set[Tuple[int, int]]:
+        """Какие из тайлов (x, y) уже есть в хранилище"""
+        conn = self._connect()
+        found = set()
+
+        for x, y in coords:
+            row = conn.execute("""
+                SELECT 1 FROM tiles
+                WHERE layer=? AND zoom_level=? AND tile_column=? AND tile_row=?
+            """, (layer, z, x, tms_row(z, y))).fetchone()
+
+            if row:
+                found.add((x, y))
+
+        return found
+
+    def size(self) -> int:
+        """Занятый данными объем базы в байтах (без свободных страниц)"""
+        conn = self._connect()
+
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+        return (page_count - freelist) * page_size
+
+    def prune(self) -> int:
+        """
+        Удаляет самые старые тайлы, пока база не сократится до
+        PRUNE_TARGET_FRACTION от max_bytes. Освобожденные страницы
+        переиспользуются SQLite, файл не усекается.
+        """
+        if not self.max_bytes:
+            return 0
+
+        excess = self.size() - self.max_bytes
+        if excess <= 0:
+            return 0
+
+        excess += self.max_bytes * (1 - PRUNE_TARGET_FRACTION)
+        conn = self._connect()
+
+        freed = 0
+        cutoff = None
+        for created_at, length in conn.execute(
+                "SELECT created_at, length(tile_data) FROM tiles ORDER BY created_at"):
+            freed += length
+            cutoff = created_at
+            if freed >= excess:
+                break
+
+        if cutoff is None:
+            return 0
+
+        with conn:
+            deleted = conn.execute(
+                "DELETE FROM tiles WHERE created_at <= ?", (cutoff,)).rowcount
+
+        with self._lock:
+            self.pruned += deleted
+
+        return deleted
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits, misses, pruned = self.hits, self.misses, self.pruned
+
+        total = hits + misses
+
+        return {
+            "bytes": self.size(),
+            "max_bytes": self.max_bytes,
+            "hits": hits,
+            "misses": misses,
+            "pruned": pruned,
+            "hit_ratio": hits / total if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+
+            with self._lock:
+                self._connections.append(conn)
+
+        return conn
@@ -0,0 +1,92 @@
+"""
+Перекладка NetCDF файлов в Zarr, нарезанный под тайлы.
+
+Файлы из CDS хранятся чанками, выбранными для архива: чтение одного
+тайла распаковывает большие блоки. Здесь каждая переменная пишется
+чанками 1 шаг времени x 1 уровень x ~256x256 узлов с быстрым кодеком
+(blosc lz4), так что холодное чтение тайла - несколько маленьких чанков.
+"""
+from pathlib import Path
+from typing import Optional
+import os
+import shutil
+
+import numpy as np
+import xarray as xr
+
+
+ZARR_SUFFIX = ".zarr"
+
+
+def zarr_store_path(zarr_dir: str, file_path: str) -> Path:
+    return Path(zarr_dir).resolve() / (Path(file_path).stem + ZARR_SUFFIX)
+
+
+def zarr_chunks(var: xr.DataArray, chunk_size: int) -> dict:
+    """Чанки переменной: по 1 по всем измерениям, кроме двух последних (сетка)"""
+    spatial = var.dims[-2:] if var.ndim >= 2 else ()
+
+    return {
+        dim: min(chunk_size, var.sizes[dim]) if dim in spatial else 1
+        for dim in var.dims
+    }
+
+
+def ingest_zarr(file_path: str, zarr_dir: str, chunk_size: int = 256) -> str:
+    """
+    Записывает NetCDF файл в Zarr хранилище в zarr_dir и возвращает его путь.
+    Хранилище собирается во временном каталоге и подменяет старое целиком.
+    """
+    from zarr.codecs import BloscCodec
+
+    store = zarr_store_path(zarr_dir, file_path)
+    tmp_store = store.with_name(f"{store.name}.{os.getpid()}.tmp")
+
+    if tmp_store.exists():
+        shutil.rmtree(tmp_store)
+
+    compressor = BloscCodec(cname="lz4", clevel=1, shuffle="shuffle")
+
+    with xr.open_dataset(file_path, engine="netcdf4", chunks={}) as ds:
+        out = ds.copy()
+        encoding = {}
+
+        for name, var in ds.data_vars.items():
+            chunks = zarr_chunks(var, chunk_size)
+
+            # Храним уже декодированные float32: тайлы и кэш срезов работают в float32
+            data = var.astype(np.float32) if var.dtype.kind in "fiu" else var
+            data = data.chunk(chunks)
+            data.encoding = {}
+
+            out[name] = data
+            encoding[name] = {"chunks": tuple(chunks.values()), "compressors": (compressor,)}
+
+        out.to_zarr(tmp_store, mode="w", encoding=encoding, consolidated=False)
+
+    if store.exists():
+        shutil.rmtree(store)
+    os.replace(tmp_store, store)
+
+    return str(store)
+
+
+def open_zarr_dataset(path: str) -> xr.Dataset:
+    """
+    Открывает Zarr хранилище лениво.
+    encoding["source"] проставляется как у NetCDF: по нему
+    ключуются кэши сетки и срезов.
+    """
+    path = str(Path(path).resolve())
+
+    ds = xr.open_zarr(path, chunks={}, consolidated=False)
+
+    for var in ds.variables.values():
+        var.encoding["source"] = path
+
+    return ds
+
+
+def remove_zarr_store(path: Optional[str]):
+    if path and os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)